@@ -0,0 +1,43 @@
+import timeit
+
+from session.packet import Packet, PacketHeader, PacketType
+
+NUMBER = 100000
+PAYLOAD_SIZE = 1200
+
+
+def make_packet() -> Packet:
+    header = PacketHeader(retransmit_count=0, src_conn_id=1, dst_conn_id=2, channel=4, fragment_id=0, pkt_id=1234,
+                          send_timestamp=0x12345678)
+    header.has_crc = True
+    header.pkt_type = PacketType.UNRELIABLE
+    return Packet(header, bytes(PAYLOAD_SIZE))
+
+
+def bench_parse(data) -> float:
+    def parse():
+        packet = Packet.parse(data)
+        # Dispatch reads the type a few times per packet on the way to the frame assembler
+        pkt_type = packet.header.pkt_type
+        return packet.crc_ok and pkt_type == PacketType.UNRELIABLE and packet.header.pkt_type != PacketType.ACK
+
+    return timeit.timeit(parse, number=NUMBER) / NUMBER
+
+
+def bench_serialize(packet: Packet) -> float:
+    return timeit.timeit(packet.serialize, number=NUMBER) / NUMBER
+
+
+def bench_header_type(packet: Packet) -> float:
+    header = packet.header
+    return timeit.timeit(lambda: header.pkt_type, number=NUMBER) / NUMBER
+
+
+if __name__ == '__main__':
+    packet = make_packet()
+    data = packet.serialize()
+    view = memoryview(bytearray(data))
+    print(f'parse (bytes):      {bench_parse(data) * 1e9:8.0f} ns/packet')
+    print(f'parse (memoryview): {bench_parse(view) * 1e9:8.0f} ns/packet')
+    print(f'serialize:          {bench_serialize(packet) * 1e9:8.0f} ns/packet')
+    print(f'header.pkt_type:    {bench_header_type(packet) * 1e9:8.0f} ns/access')
@@ -0,0 +1,88 @@
+import math
+import socket
+import statistics
+import struct
+import threading
+import time
+
+from session.receiver import receive_loop, RECV_BUFFER_SIZE
+
+PACKET_COUNT = 10000
+BURST_SIZE = 10
+BURST_INTERVAL = 0.001
+IDLE_DURATION = 1.0
+
+
+class CountingHandler:
+
+    def __init__(self, count: int):
+        self.closed = count <= 0
+        self.remaining = count
+        self.latencies: list[int] = []
+
+    def handle_packet(self, data: bytes):
+        sent, = struct.unpack_from('<Q', data)
+        self.latencies.append(time.perf_counter_ns() - sent)
+        self.remaining -= 1
+        if self.remaining <= 0:
+            self.closed = True
+
+    def poll(self) -> float:
+        return math.inf
+
+
+def spin_loop(sock: socket.socket, handler: CountingHandler):
+    # The receive loop session_worker used before it waited for readiness.
+    while not handler.closed:
+        try:
+            data, _ = sock.recvfrom(RECV_BUFFER_SIZE)
+        except BlockingIOError:
+            continue
+        handler.handle_packet(data)
+
+
+def run_receiver(loop, count: int, send: bool) -> tuple[float, float, list[int]]:
+    recv_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    recv_sock.bind(('127.0.0.1', 0))
+    recv_sock.setblocking(False)
+    handler = CountingHandler(count)
+    result = {}
+
+    def worker():
+        start = time.thread_time()
+        loop(recv_sock, handler)
+        result['cpu'] = time.thread_time() - start
+
+    thread = threading.Thread(target=worker)
+    wall_start = time.perf_counter()
+    thread.start()
+    if send:
+        send_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        padding = bytes(1200)
+        for i in range(count):
+            send_sock.sendto(struct.pack('<Q', time.perf_counter_ns()) + padding, recv_sock.getsockname())
+            if i % BURST_SIZE == BURST_SIZE - 1:
+                time.sleep(BURST_INTERVAL)
+        send_sock.close()
+    else:
+        time.sleep(IDLE_DURATION)
+        handler.closed = True
+    thread.join()
+    wall = time.perf_counter() - wall_start
+    recv_sock.close()
+    return result['cpu'], wall, handler.latencies
+
+
+def report(name: str, loop):
+    cpu, wall, latencies = run_receiver(loop, PACKET_COUNT, True)
+    idle_cpu, idle_wall, _ = run_receiver(loop, 1, False)
+    latencies.sort()
+    print(f'{name:>8}: {cpu * 1000:8.1f} ms CPU per {PACKET_COUNT} packets ({cpu / wall * 100:5.1f}% of {wall:.2f}s), '
+          f'idle {idle_cpu / idle_wall * 100:5.1f}% CPU, '
+          f'wakeup latency p50 {statistics.median(latencies) / 1000:.1f}us '
+          f'p99 {latencies[int(len(latencies) * 0.99)] / 1000:.1f}us')
+
+
+if __name__ == '__main__':
+    report('spin', spin_loop)
+    report('selector', receive_loop)
@@ -0,0 +1,89 @@
+import argparse
+import os
+import re
+import subprocess
+import sys
+import time
+
+from typing import NamedTuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Seconds from launching the CLI to its prompt, on a desktop machine
+TIME_TO_PROMPT_TARGET = 0.2
+RUNS = 5
+PROMPT_TIMEOUT = 10
+
+IMPORT_TIME_LINE = re.compile(r'import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)')
+
+
+class ImportTime(NamedTuple):
+    name: str
+    depth: int
+    self_us: int
+    cumulative_us: int
+
+
+def time_to_prompt() -> float:
+    """
+    Launch the CLI in a fresh interpreter and time until it asks for a command.
+    """
+    env = dict(os.environ, PYTHONUNBUFFERED='1')
+    start = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, 'cli.py'], cwd=ROOT, env=env, stdin=subprocess.PIPE,
+                            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    try:
+        while True:
+            char = proc.stdout.read(1)
+            if not char:
+                raise RuntimeError(f'CLI exited before its prompt ({proc.wait(PROMPT_TIMEOUT)})')
+            if char == b'>':
+                return time.perf_counter() - start
+    finally:
+        proc.kill()
+        proc.wait()
+
+
+def import_times(module: str) -> list[ImportTime]:
+    """
+    What `python -X importtime` reports for importing `module` in a fresh interpreter.
+    """
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'], cwd=ROOT,
+                            capture_output=True, text=True, check=True)
+    times = []
+    for line in result.stderr.splitlines():
+        match = IMPORT_TIME_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            times.append(ImportTime(name, len(indent) // 2, int(self_us), int(cumulative_us)))
+    return times
+
+
+def main(argv: list[str]) -> int:
+    parser = argparse.ArgumentParser('benchmarks.startup', description='CLI startup time and import breakdown')
+    parser.add_argument('--module', default='cli', help='module whose imports are broken down (default %(default)s)')
+    parser.add_argument('--top', type=int, default=15, help='slowest imports listed (default %(default)s)')
+    parser.add_argument('--target', type=float, default=TIME_TO_PROMPT_TARGET,
+                        help='time to prompt in seconds reported as too slow (default %(default)s)')
+    args = parser.parse_args(argv)
+
+    times = import_times(args.module)
+    total = next(t for t in times if t.name == args.module and t.depth == 0)
+    print(f'{"module":<56} {"self ms":>8} {"total ms":>9}')
+    for t in sorted((t for t in times if t is not total), key=lambda t: t.cumulative_us, reverse=True)[:args.top]:
+        print(f'{"  " * (t.depth - 1) + t.name:<56} {t.self_us / 1000:8.1f} {t.cumulative_us / 1000:9.1f}')
+    print(f'{args.module:<56} {total.self_us / 1000:8.1f} {total.cumulative_us / 1000:9.1f}')
+    loaded = {t.name for t in times}
+    for heavy in ['protobuf.steammessages_remoteplay_pb2', 'session.client_impl', 'Crypto.Cipher.AES', 'alsaaudio',
+                  'opuslib', 'gi']:
+        if heavy in loaded:
+            print(f'loaded at startup: {heavy}')
+
+    if args.module != 'cli':
+        return 0
+    prompt = min(time_to_prompt() for _ in range(RUNS))
+    print(f'\ntime to prompt {prompt * 1000:.0f} ms, target {args.target * 1000:.0f} ms')
+    return 0 if prompt <= args.target else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
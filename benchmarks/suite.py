@@ -0,0 +1,425 @@
+import argparse
+import json
+import os
+import platform
+import secrets
+import sys
+import time
+
+from typing import Callable, Optional
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), 'baseline.json')
+DEFAULT_THRESHOLD = 0.15
+MIN_DURATION = 0.2
+REPEAT = 5
+
+FRAGMENT_SIZE = 1200
+KEYFRAME_SIZE = 200 * 1024
+VIDEO_PAYLOAD_SIZE = 100 * 1024
+DECRYPT_POOL_BATCH = 32
+SCAN_SUBNETS = 16
+DATA_CHANNEL = 4
+
+cases: dict[str, Callable[[], Callable[[], object]]] = {}
+# Bytes handled per operation, for the cases reported as throughput too
+case_sizes: dict[str, int] = {}
+
+
+def case(name: str, size: int = 0):
+    """
+    Register a benchmark. The decorated function does the setup and returns the operation to time. Cases that go
+    through `size` bytes every operation also print their throughput.
+    """
+
+    def decorator(setup: Callable[[], Callable[[], object]]):
+        cases[name] = setup
+        if size:
+            case_sizes[name] = size
+        return setup
+
+    return decorator
+
+
+class BenchClient:
+    # Just enough of ClientImpl for channels to run without a socket.
+
+    def __init__(self):
+        self.closed = False
+        self.loop = None
+        self.auth_token = secrets.token_bytes(16)
+        self.mtu = 1200
+
+    def send_packet(self, *args, **kwargs):
+        pass
+
+    def add_channel(self, channel: int, handler):
+        pass
+
+    def remove_channel_by_type(self, handler_type):
+        pass
+
+
+def make_packet(pkt_type, body: bytes, pkt_id: int = 0, fragment_id: int = 0, channel: int = DATA_CHANNEL):
+    from session.packet import Packet, PacketHeader
+    header = PacketHeader(channel=channel, fragment_id=fragment_id, pkt_id=pkt_id)
+    header.has_crc = True
+    header.pkt_type = pkt_type
+    return Packet(header, body)
+
+
+def make_frame_packets(pkt_type, frag_type, payload: bytes) -> list:
+    view = memoryview(payload)
+    chunks = [view[i:i + FRAGMENT_SIZE] for i in range(0, len(payload), FRAGMENT_SIZE)]
+    packets = [make_packet(pkt_type, chunks[0], fragment_id=len(chunks) - 1)]
+    packets.extend(make_packet(frag_type, chunk, fragment_id=i) for i, chunk in enumerate(chunks[1:]))
+    return packets
+
+
+def renumber(packets: list, start_id: int, timestamp: int):
+    # Every iteration has to look like a new frame to the duplicate filter, which may keep the old headers
+    from session.packet import PacketHeader
+    for i, packet in enumerate(packets):
+        header = packet.header
+        packet.header = PacketHeader(header.type_and_crc, 0, header.src_conn_id, header.dst_conn_id, header.channel,
+                                     header.fragment_id, (start_id + i) & 0xFFFF, timestamp)
+
+
+@case('packet.parse')
+def bench_packet_parse():
+    from session.packet import Packet, PacketType
+    data = bytes(make_packet(PacketType.UNRELIABLE_FRAG, secrets.token_bytes(FRAGMENT_SIZE)).serialize())
+    return lambda: Packet.parse(data).crc_ok
+
+
+@case('packet.serialize')
+def bench_packet_serialize():
+    from session.packet import PacketType
+    packet = make_packet(PacketType.UNRELIABLE_FRAG, secrets.token_bytes(FRAGMENT_SIZE))
+    return packet.serialize
+
+
+@case('frame_assembler.single')
+def bench_frame_assembler_single():
+    from session.frame import FrameAssembler
+    from session.packet import PacketType
+    assembler = FrameAssembler(DATA_CHANNEL)
+    packets = [make_packet(PacketType.UNRELIABLE, secrets.token_bytes(FRAGMENT_SIZE))]
+    state = {'pkt_id': 0, 'timestamp': 0}
+
+    def run():
+        renumber(packets, state['pkt_id'], state['timestamp'])
+        state['pkt_id'] += 1
+        state['timestamp'] += 0x10000
+        assembler.add_packet(packets[0])
+        return assembler.poll_frame()
+
+    return run
+
+
+@case('frame_assembler.keyframe')
+def bench_frame_assembler_keyframe():
+    from session.frame import FrameAssembler
+    from session.packet import PacketType
+    assembler = FrameAssembler(DATA_CHANNEL)
+    packets = make_frame_packets(PacketType.UNRELIABLE, PacketType.UNRELIABLE_FRAG, secrets.token_bytes(KEYFRAME_SIZE))
+    state = {'pkt_id': 0, 'timestamp': 0}
+
+    def run():
+        renumber(packets, state['pkt_id'], state['timestamp'])
+        state['pkt_id'] += len(packets)
+        state['timestamp'] += 0x10000
+        for packet in packets:
+            assembler.add_packet(packet)
+        frame = assembler.poll_frame()
+        assert frame and len(frame.body) == KEYFRAME_SIZE
+        return frame
+
+    return run
+
+
+@case('frame_assembler.keyframes_reordered')
+def bench_frame_assembler_reordered():
+    import random
+    from session.frame import FrameAssembler
+    from session.packet import PacketType
+    assembler = FrameAssembler(DATA_CHANNEL)
+    frames = [make_frame_packets(PacketType.UNRELIABLE, PacketType.UNRELIABLE_FRAG, secrets.token_bytes(KEYFRAME_SIZE))
+              for _ in range(2)]
+    # Two keyframes in flight at once, their packets interleaved and shuffled
+    order = [(f, i) for f, packets in enumerate(frames) for i in range(len(packets))]
+    random.Random(0).shuffle(order)
+    state = {'pkt_id': 0, 'timestamp': 0}
+
+    def run():
+        for packets in frames:
+            renumber(packets, state['pkt_id'], state['timestamp'])
+            state['pkt_id'] += len(packets)
+        state['timestamp'] += 0x10000
+        for f, i in order:
+            assembler.add_packet(frames[f][i])
+        completed = [assembler.poll_frame(), assembler.poll_frame()]
+        assert all(frame and len(frame.body) == KEYFRAME_SIZE for frame in completed)
+        return completed
+
+    return run
+
+
+@case('channel.handle_packet')
+def bench_channel_handle_packet():
+    from session.channels.base import Channel
+    from session.packet import PacketType
+    channel = Channel(BenchClient(), DATA_CHANNEL)
+    packets = [make_packet(PacketType.UNRELIABLE, secrets.token_bytes(FRAGMENT_SIZE))]
+    state = {'pkt_id': 0, 'timestamp': 0}
+
+    def run():
+        renumber(packets, state['pkt_id'], state['timestamp'])
+        state['pkt_id'] += 1
+        state['timestamp'] += 0x10000
+        channel.handle_packet(packets[0])
+
+    return run
+
+
+@case('frame.encrypt')
+def bench_frame_encrypt():
+    from session.frame import frame_encrypt
+    key = secrets.token_bytes(16)
+    plain = secrets.token_bytes(FRAGMENT_SIZE)
+    return lambda: frame_encrypt(plain, key, 1)
+
+
+@case('frame.decrypt')
+def bench_frame_decrypt():
+    from session.frame import frame_encrypt, frame_decrypt
+    key = secrets.token_bytes(16)
+    encrypted = frame_encrypt(secrets.token_bytes(FRAGMENT_SIZE), key, 1)
+    return lambda: frame_decrypt(encrypted, key, 1)
+
+
+@case('video.handle_data.encrypted_keyframe')
+def bench_video_decrypt():
+    import struct
+    from protobuf.steammessages_remoteplay_pb2 import CStartVideoDataMsg
+    from service.ccrypto import symmetric_encrypt_with_iv
+    from session.channels.video import Video
+    client = BenchClient()
+    video = Video(client, CStartVideoDataMsg(channel=DATA_CHANNEL))
+    encrypted = symmetric_encrypt_with_iv(secrets.token_bytes(KEYFRAME_SIZE), bytes(16), client.auth_token, False)
+    payload = struct.pack('<HBHH', 1, 0x20, 0, 0) + encrypted
+    return lambda: video.handle_data(None, payload)
+
+
+@case('video.decrypt.100k', size=VIDEO_PAYLOAD_SIZE)
+def bench_video_decrypt_into():
+    from service.ccrypto import ZERO_IV, symmetric_key
+    key = symmetric_key(secrets.token_bytes(16))
+    encrypted = key.encrypt(secrets.token_bytes(VIDEO_PAYLOAD_SIZE - 1), ZERO_IV, False)
+    output = memoryview(bytearray(len(encrypted)))
+    return lambda: key.decrypt_into(encrypted, ZERO_IV, output)
+
+
+@case('video.handle_data.encrypted_100k', size=VIDEO_PAYLOAD_SIZE)
+def bench_video_handle_data_100k():
+    import struct
+    from protobuf.steammessages_remoteplay_pb2 import CStartVideoDataMsg
+    from service.ccrypto import ZERO_IV, symmetric_key
+    from session.channels.video import Video
+    client = BenchClient()
+    video = Video(client, CStartVideoDataMsg(channel=DATA_CHANNEL))
+    encrypted = symmetric_key(client.auth_token).encrypt(secrets.token_bytes(VIDEO_PAYLOAD_SIZE - 1), ZERO_IV, False)
+    payload = struct.pack('<HBHH', 1, 0x20, 0, 0) + encrypted
+    return lambda: video.handle_data(None, payload)
+
+
+def bench_decrypt_pool(workers: int):
+    from service.ccrypto import ZERO_IV, symmetric_key
+    from session.decrypt import DecryptPool
+    key = symmetric_key(secrets.token_bytes(16))
+    encrypted = key.encrypt(secrets.token_bytes(VIDEO_PAYLOAD_SIZE - 1), ZERO_IV, False)
+    pool = DecryptPool(key, ZERO_IV, lambda tag, data: None, workers)
+
+    def run():
+        for i in range(DECRYPT_POOL_BATCH):
+            pool.submit(i, encrypted)
+        pool.drain()
+
+    return run
+
+
+# Sustained throughput of a stream of 100 KB frames, by worker count
+for _workers in (1, 2, 4):
+    case(f'video.decrypt_pool.workers_{_workers}', size=VIDEO_PAYLOAD_SIZE * DECRYPT_POOL_BATCH)(
+        lambda workers=_workers: bench_decrypt_pool(workers))
+
+
+@case('service.message_serialize')
+def bench_message_serialize():
+    from protobuf.steammessages_remoteclient_discovery_pb2 import CMsgRemoteClientBroadcastDiscovery, \
+        k_ERemoteClientBroadcastMsgDiscovery
+    from service.common import message_serialize
+    body = CMsgRemoteClientBroadcastDiscovery(seq_num=1)
+    return lambda: message_serialize(k_ERemoteClientBroadcastMsgDiscovery, body, 1)
+
+
+@case('service.message_parse')
+def bench_message_parse():
+    from protobuf.steammessages_remoteclient_discovery_pb2 import CMsgRemoteClientBroadcastStatus, \
+        k_ERemoteClientBroadcastMsgStatus
+    from service.common import message_serialize, message_parse
+    body = CMsgRemoteClientBroadcastStatus(version=8, min_version=6, connect_port=27036, hostname='benchmark-host',
+                                           enabled_services=1, ostype=-184, is64bit=True, euniverse=1, timestamp=1,
+                                           mac_addresses=['00:11:22:33:44:55'], ip_addresses=['192.168.1.2'],
+                                           users=[CMsgRemoteClientBroadcastStatus.User(steamid=1, auth_key_id=1)])
+    data = message_serialize(k_ERemoteClientBroadcastMsgStatus, body, 1)
+    return lambda: message_parse(data)
+
+
+@case('service.discovery_scan')
+def bench_discovery_scan():
+    # A scanner's round over many subnets: a probe for each, and a status back from each
+    from protobuf.steammessages_remoteclient_discovery_pb2 import CMsgRemoteClientBroadcastDiscovery, \
+        CMsgRemoteClientBroadcastStatus, k_ERemoteClientBroadcastMsgDiscovery, k_ERemoteClientBroadcastMsgStatus
+    from service.common import message_serialize, message_parse
+    replies = [message_serialize(k_ERemoteClientBroadcastMsgStatus,
+                                 CMsgRemoteClientBroadcastStatus(version=8, connect_port=27036, hostname=f'host-{i}',
+                                                                 euniverse=1), 100 + i) for i in range(SCAN_SUBNETS)]
+    state = {'seq_num': 0}
+
+    def run():
+        for reply in replies:
+            state['seq_num'] += 1
+            message_serialize(k_ERemoteClientBroadcastMsgDiscovery,
+                              CMsgRemoteClientBroadcastDiscovery(seq_num=state['seq_num']), 1)
+            message_parse(reply)
+
+    return run
+
+
+@case('service.pairing_encrypt_ticket')
+def bench_pairing_encrypt_ticket():
+    from service import ccrypto, pairing
+    enc_key = secrets.token_bytes(32)
+
+    def run():
+        ticket = pairing.authorization_req_ticket_plain(1, '1234', enc_key, 'benchmark')
+        return ccrypto.rsa_encrypt(ticket.SerializeToString(), pairing.authorization_req_rsa_pubkey(1))
+
+    return run
+
+
+@case('control.on_reliable')
+def bench_control_on_reliable():
+    from protobuf.steammessages_remoteplay_pb2 import CVideoEncoderInfoMsg, k_EStreamControlVideoEncoderInfo, \
+        k_EStreamChannelControl
+    from session.channels.control import Control
+    control = Control(BenchClient(), k_EStreamChannelControl)
+    payload = CVideoEncoderInfoMsg(info='benchmark encoder 1920x1080 @ 60fps').SerializeToString()
+    return lambda: control.on_reliable(1, k_EStreamControlVideoEncoderInfo, payload)
+
+
+@case('metrics.counter_inc')
+def bench_metrics_counter():
+    from session.metrics import MetricsRegistry
+    return MetricsRegistry().counter('steamlink_benchmark').inc
+
+
+@case('metrics.exposition')
+def bench_metrics_exposition():
+    from session.channels.base import Channel
+    from session.metrics import REGISTRY
+    # What a scrape costs with a session's worth of channels registered
+    channels = [Channel(BenchClient(), channel) for channel in range(6)]
+
+    def run():
+        # The registry only holds the channels' collectors weakly
+        assert channels
+        return REGISTRY.exposition()
+
+    return run
+
+
+def measure(operation: Callable[[], object]) -> float:
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            operation()
+        elapsed = time.perf_counter() - start
+        if elapsed >= MIN_DURATION:
+            break
+        number *= 2 if elapsed <= 0 else max(2, min(10, int(MIN_DURATION / elapsed) + 1))
+    best = elapsed
+    for _ in range(REPEAT - 1):
+        start = time.perf_counter()
+        for _ in range(number):
+            operation()
+        best = min(best, time.perf_counter() - start)
+    return best / number * 1e9
+
+
+def run(selected: Optional[list[str]]) -> dict[str, float]:
+    results: dict[str, float] = {}
+    for name, setup in cases.items():
+        if selected and not any(s in name for s in selected):
+            continue
+        try:
+            operation = setup()
+        except ImportError as e:
+            print(f'{name:<40} skipped ({e})')
+            continue
+        results[name] = measure(operation)
+        line = f'{name:<40} {results[name]:14.0f} ns/op'
+        if name in case_sizes:
+            line += f' {case_sizes[name] / results[name] * 1e3:10.1f} MB/s'
+        print(line)
+    return results
+
+
+def compare(results: dict[str, float], baseline: dict[str, float], threshold: float) -> list[str]:
+    regressions = []
+    print(f'\n{"benchmark":<40} {"baseline":>14} {"current":>14} {"change":>8}')
+    for name, current in results.items():
+        previous = baseline.get(name)
+        if previous is None:
+            print(f'{name:<40} {"-":>14} {current:14.0f}      new')
+            continue
+        change = current / previous - 1
+        flag = ''
+        if change > threshold:
+            flag = '  REGRESSION'
+            regressions.append(name)
+        print(f'{name:<40} {previous:14.0f} {current:14.0f} {change:+8.1%}{flag}')
+    return regressions
+
+
+def main(argv: list[str]) -> int:
+    parser = argparse.ArgumentParser('benchmarks.suite', description='Session hot path benchmarks')
+    parser.add_argument('-k', dest='selected', action='append', help='only run benchmarks containing this string')
+    parser.add_argument('--save', nargs='?', const=BASELINE_PATH, help='write results as the new baseline')
+    parser.add_argument('--compare', nargs='?', const=BASELINE_PATH, help='compare results against a baseline')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='relative slowdown reported as a regression (default %(default)s)')
+    args = parser.parse_args(argv)
+
+    results = run(args.selected)
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({
+                'python': platform.python_version(),
+                'machine': platform.machine(),
+                'results': {name: round(value, 1) for name, value in results.items()},
+            }, f, indent=2, sort_keys=True)
+            f.write('\n')
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f'\n{len(regressions)} regression(s) over {args.threshold:.0%}: {", ".join(regressions)}')
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
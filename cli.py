@@ -1,6 +1,7 @@
 import argparse
 import sys
 from asyncio import DatagramTransport
+from typing import Callable
 
 import asyncio
 from google.protobuf.message import Message
@@ -9,9 +10,8 @@ from protobuf.steammessages_remoteclient_discovery_pb2 import k_ERemoteClientBro
     CMsgRemoteClientBroadcastDiscovery, \
     k_ERemoteClientBroadcastMsgStatus, ERemoteClientBroadcastMsg
 from service.commands.base import CliCommand
-from service.commands.pair import PairCommand
-from service.commands.stream import StreamCommand
 from service.common import ServiceProtocol
+from service.identity import DEFAULT_PROFILE, use_profile
 
 
 class ArgumentParser(argparse.ArgumentParser):
@@ -26,6 +26,17 @@ def exception_handler(loop: asyncio.AbstractEventLoop, context: dict[str]):
     loop.stop()
 
 
+def stream_command() -> type[CliCommand]:
+    # Brings in the whole session stack, so only once it's asked for
+    from service.commands.stream import StreamCommand
+    return StreamCommand
+
+
+def pair_command() -> type[CliCommand]:
+    from service.commands.pair import PairCommand
+    return PairCommand
+
+
 async def ainput(string: str) -> str:
     await asyncio.get_event_loop().run_in_executor(
         None, lambda s=string: sys.stdout.write(s + ' '))
@@ -35,11 +46,11 @@ async def ainput(string: str) -> str:
 
 class ServiceProtocolImpl(ServiceProtocol):
     discovered: [str, tuple[Message, Message]] = {}
-    commands: [str, type[CliCommand]] = {
-        'stream': StreamCommand,
-        's': StreamCommand,
-        'pair': PairCommand,
-        'p': PairCommand,
+    commands: [str, Callable[[], type[CliCommand]]] = {
+        'stream': stream_command,
+        's': stream_command,
+        'pair': pair_command,
+        'p': pair_command,
     }
     command: CliCommand = None
 
@@ -83,17 +94,17 @@ class ServiceProtocolImpl(ServiceProtocol):
         if not host:
             print('Host info not available')
             return
-        self.command = PairCommand(self, args.ip, host)
+        self.command = pair_command()(self, args.ip, host)
         await self.command.run()
 
     async def read_command(self):
         while True:
             args = (await ainput('>')).strip().split(' ')
-            command_type = self.commands.get(args[0], None)
-            if not command_type:
+            command_loader = self.commands.get(args[0], None)
+            if not command_loader:
                 print(f'Unrecognized command {args[0]}.')
                 continue
-            command: CliCommand = command_type(self)
+            command: CliCommand = command_loader()(self)
             if not command.parse_args(args[1:]):
                 continue
             self.command = command
@@ -114,6 +125,10 @@ class ServiceProtocolImpl(ServiceProtocol):
 
 
 if __name__ == '__main__':
+    cli_args = argparse.ArgumentParser(description='Steam Link CLI')
+    cli_args.add_argument('--profile', default=DEFAULT_PROFILE,
+                          help='client identity to pair and stream as, each kept in its own directory')
+    use_profile(cli_args.parse_args().profile)
     main_loop = asyncio.get_event_loop()
     # main_loop.set_exception_handler(exception_handler)
     t = main_loop.create_datagram_endpoint(ServiceProtocolImpl, local_addr=('0.0.0.0', 0), allow_broadcast=True)
@@ -1,13 +1,23 @@
 # Algorithm described as per https://pkg.go.dev/github.com/Tommy-42/go-steam/cryptoutil
 import secrets
+from functools import lru_cache
+from typing import Union
+
 from Crypto.Cipher import PKCS1_OAEP, AES
 from Crypto.PublicKey import RSA
+from Crypto.Util.strxor import strxor
+
+
+@lru_cache(maxsize=8)
+def rsa_public_cipher(pubkey: bytes) -> PKCS1_OAEP.PKCS1OAEP_Cipher:
+    """
+    The OAEP cipher for `pubkey`, decoded once. Each encryption draws its own random seed, so it can be reused.
+    """
+    return PKCS1_OAEP.new(RSA.import_key(pubkey))
 
 
 def rsa_encrypt(plaintext: bytes, pubkey: bytes) -> bytes:
-    rsa_key = RSA.import_key(pubkey)
-    cipher = PKCS1_OAEP.new(rsa_key)
-    return cipher.encrypt(plaintext)
+    return rsa_public_cipher(pubkey).encrypt(plaintext)
 
 
 def rsa_decrypt(ciphertext: bytes, privkey: bytes) -> bytes:
@@ -16,32 +26,82 @@ def rsa_decrypt(ciphertext: bytes, privkey: bytes) -> bytes:
     return cipher.decrypt(ciphertext)
 
 
+# Decrypting through the cached ECB cipher takes three calls instead of one, which only pays off past this size
+ECB_DECRYPT_MIN_SIZE = 1024
+ZERO_IV = bytes(16)
+PADDING = [bytes([pl]) * pl for pl in range(17)]
+
+
+def pkcs7pad(data: bytes) -> bytes:
+    if type(data) != bytearray and type(data) != bytes:
+        raise TypeError("Only support bytearray/bytes !")
+    pl = 16 - (len(data) % 16)
+    return data + PADDING[pl]
+
+
+def unpkcs7pad(data: memoryview) -> memoryview:
+    if not data:
+        # Padding always adds at least a byte, so this was never encrypted whole
+        raise ValueError('Nothing to unpad')
+    pl = data[-1]
+    if pl < len(data) and bytes(data[len(data) - pl:]).count(pl) == pl:
+        return data[:len(data) - pl]
+    return data
+
+
+class SymmetricKey:
+    """
+    An AES key with its ECB cipher, so its key schedule, built once. Large CBC decryptions run every block through
+    the ECB cipher in one call and XOR each with the ciphertext block before it, which also lets the blocks be
+    decrypted in parallel, unlike CBC mode. Encryption chains from block to block, so it still takes a CBC cipher
+    per message.
+    """
+
+    def __init__(self, key: bytes):
+        self.key = key
+        self.ecb = AES.new(key, AES.MODE_ECB)
+
+    def encrypt(self, plaintext: bytes, iv: bytes, with_iv: bool) -> bytes:
+        # AES-CBC-PKCS7Padding
+        encrypted = AES.new(self.key, AES.MODE_CBC, iv).encrypt(pkcs7pad(plaintext))
+        if with_iv:
+            # AES-ECB
+            return self.ecb.encrypt(iv) + encrypted
+        return encrypted
+
+    def decrypt_into(self, encrypted: Union[bytes, bytearray, memoryview], iv: bytes,
+                     output: Union[bytearray, memoryview]) -> memoryview:
+        """
+        Decrypt into `output`, which has to be as long as `encrypted` and not share memory with it, and return the
+        part of it left after unpadding.
+        """
+        out = memoryview(output)
+        if len(encrypted) < ECB_DECRYPT_MIN_SIZE:
+            AES.new(self.key, AES.MODE_CBC, iv).decrypt(encrypted, output=out)
+        else:
+            self.ecb.decrypt(encrypted, output=out)
+            strxor(out[:16], iv, output=out[:16])
+            strxor(out[16:], memoryview(encrypted)[:-16], output=out[16:])
+        return unpkcs7pad(out)
+
+    def decrypt(self, encrypted: Union[bytes, bytearray, memoryview], iv: bytes) -> bytes:
+        return bytes(self.decrypt_into(encrypted, iv, bytearray(len(encrypted))))
+
+
+@lru_cache(maxsize=8)
+def symmetric_key(key: bytes) -> SymmetricKey:
+    """
+    The cached SymmetricKey for `key`, there's normally only the session key and the pairing secret.
+    """
+    return SymmetricKey(key)
+
+
 def symmetric_encrypt_with_iv(plaintext: bytes, iv: bytes, key: bytes, with_iv: bool) -> bytes:
-    def pkcs7pad(data: bytes, block_size: int = 16) -> bytes:
-        if type(data) != bytearray and type(data) != bytes:
-            raise TypeError("Only support bytearray/bytes !")
-        pl = block_size - (len(data) % block_size)
-        return data + bytes([pl for _ in range(pl)])
-
-    # AES-CBC-PKCS7Padding
-    cipher = AES.new(key, AES.MODE_CBC, iv)
-    encrypted = cipher.encrypt(pkcs7pad(plaintext))
-    if with_iv:
-        # AES-ECB
-        iv_cipher = AES.new(key, AES.MODE_ECB)
-        return iv_cipher.encrypt(iv) + encrypted
-    return encrypted
+    return symmetric_key(key).encrypt(plaintext, iv, with_iv)
 
 
 def symmetric_decrypt_with_iv(encrypted: bytes, iv: bytes, key: bytes) -> bytes:
-    def unpkcs7pad(data: bytes) -> bytes:
-        pl = data[-1]
-        if pl < len(data) and pl == data[-pl:].count(pl):
-            return data[0:-pl]
-        return data
-
-    cipher = AES.new(key, AES.MODE_CBC, iv)
-    return unpkcs7pad(cipher.decrypt(encrypted))
+    return symmetric_key(key).decrypt(encrypted, iv)
 
 
 def symmetric_encrypt(plaintext: bytes, key: bytes) -> bytes:
@@ -49,6 +109,5 @@ def symmetric_encrypt(plaintext: bytes, key: bytes) -> bytes:
 
 
 def symmetric_decrypt(encrypted: bytes, key: bytes) -> bytes:
-    iv_cipher = AES.new(key, AES.MODE_ECB)
-    iv = iv_cipher.decrypt(encrypted[0:16])
+    iv = symmetric_key(key).ecb.decrypt(encrypted[0:16])
     return symmetric_decrypt_with_iv(encrypted[16:], iv, key)
@@ -7,7 +7,7 @@ from google.protobuf.message import Message
 from protobuf.steammessages_remoteclient_discovery_pb2 import CMsgRemoteClientBroadcastStatus, \
     k_ERemoteDeviceAuthorizationRequest, k_ERemoteDeviceAuthorizationResponse, \
     k_ERemoteDeviceAuthorizationInProgress, k_ERemoteDeviceAuthorizationSuccess
-from service import pairing, common
+from service import pairing
 from service.commands.base import CliCommand
 from service.common import ServiceProtocol
 
@@ -33,11 +33,12 @@ class PairCommand(CliCommand):
         return True
 
     async def run(self):
-        enckey = common.get_secret_key()
+        enckey = self.protocol.identity.secret_key
         pin = '%04u' % secrets.randbelow(10000)
         print(f'Pair with PIN {pin}')
+        message = pairing.authorization_req(self.host.euniverse, 'Microwave Oven', enckey, pin,
+                                            self.protocol.profile)
         while not self.ended:
-            message = pairing.authorization_req(self.host.euniverse, 'Microwave Oven', enckey, pin)
             self.send_message(k_ERemoteDeviceAuthorizationRequest, message, (self.ip, self.host.connect_port))
             await asyncio.sleep(3)
 
@@ -46,7 +47,7 @@ class PairCommand(CliCommand):
             return False
         print(f'message arrived: {msg}')
         if msg.result == k_ERemoteDeviceAuthorizationSuccess:
-            common.set_steamid(msg.steamid)
+            self.protocol.identity.steamid = msg.steamid
             self.ended = True
         elif msg.result != k_ERemoteDeviceAuthorizationInProgress:
             self.ended = True
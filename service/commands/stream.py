@@ -10,8 +10,9 @@ from protobuf.steammessages_remoteclient_discovery_pb2 import CMsgRemoteClientBr
     CMsgRemoteDeviceProofResponse, k_ERemoteDeviceStreamingFailed, ERemoteDeviceStreamingResult
 from service import streaming, ccrypto
 from service.commands.base import CliCommand
-from service.common import ServiceProtocol, get_secret_key
+from service.common import ServiceProtocol
 from session.client_impl import session_run, session_run_command
+from session.metrics import MetricsServer, SnapshotWriter
 
 
 class StreamCommand(CliCommand):
@@ -28,10 +29,19 @@ class StreamCommand(CliCommand):
         self.request_id = 1 + secrets.randbelow(0x7fffffff)
         self.streaming_info = None
         self.native = False
+        self.metrics_port = 0
+        self.metrics_json = None
+        self.decrypt_workers = 0
 
     def parse_args(self, argv: list[str]) -> bool:
         stream = ArgumentParser('stream')
         stream.add_argument('-n', '--native', dest='native', action='store_true', default=False)
+        stream.add_argument('--metrics-port', dest='metrics_port', type=int, default=0,
+                            help='serve session metrics on this local port, in Prometheus format at /metrics')
+        stream.add_argument('--metrics-json', dest='metrics_json', type=str, default=None,
+                            help='write session metrics to this file as JSON every few seconds')
+        stream.add_argument('--decrypt-workers', dest='decrypt_workers', type=int, default=0,
+                            help='decrypt video frames on this many threads instead of the receiving one')
         stream.add_argument('ip', nargs='?', type=str, default='192.168.4.16')
         args = stream.parse_args(argv)
         ip = args.ip
@@ -43,25 +53,38 @@ class StreamCommand(CliCommand):
         self.header = header
         self.host = host
         self.native = args.native
+        self.metrics_port = args.metrics_port
+        self.metrics_json = args.metrics_json
+        self.decrypt_workers = args.decrypt_workers
         return True
 
     async def run(self):
-        message = streaming.streaming_req(self.request_id, self.header.client_id)
+        message = streaming.streaming_req(self.request_id, self.header.client_id, self.protocol.profile)
         while not self.ended:
             self.send_message(k_ERemoteDeviceStreamingRequest, message, (self.ip, self.host.connect_port))
             await asyncio.sleep(1)
         if self.streaming_info:
-            session_key = ccrypto.symmetric_decrypt(self.streaming_info.encrypted_session_key, get_secret_key())
+            session_key = ccrypto.symmetric_decrypt(self.streaming_info.encrypted_session_key,
+                                                    self.protocol.identity.secret_key)
             if self.native:
                 retval = await session_run_command(self.ip, self.streaming_info.port, self.streaming_info.transport,
                                                    session_key)
             else:
-                retval = await session_run(self.ip, self.streaming_info.port, self.streaming_info.transport,
-                                           session_key)
+                exporters = []
+                if self.metrics_port:
+                    exporters.append(MetricsServer(address=('127.0.0.1', self.metrics_port)).start())
+                if self.metrics_json:
+                    exporters.append(SnapshotWriter(self.metrics_json).start())
+                try:
+                    retval = await session_run(self.ip, self.streaming_info.port, self.streaming_info.transport,
+                                               session_key, self.decrypt_workers)
+                finally:
+                    for exporter in exporters:
+                        exporter.close()
             print(f'client exited with code {retval}')
 
     def gen_proof_response(self, challenge: bytes) -> Message:
-        encrypted = ccrypto.symmetric_encrypt(challenge, get_secret_key())
+        encrypted = ccrypto.symmetric_encrypt(challenge, self.protocol.identity.secret_key)
         return CMsgRemoteDeviceProofResponse(request_id=self.request_id, response=encrypted)
 
     def message_received(self, header: Message, msg: Message, addr: tuple[str, int]) -> bool:
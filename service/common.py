@@ -1,10 +1,9 @@
-import os.path
 import struct
 from asyncio import DatagramTransport
-from os import path
+from functools import lru_cache
+from typing import Optional
 
 import asyncio
-import secrets
 from google.protobuf.message import Message
 
 from protobuf.steammessages_remoteclient_discovery_pb2 import CMsgRemoteClientBroadcastHeader, \
@@ -12,7 +11,7 @@ from protobuf.steammessages_remoteclient_discovery_pb2 import CMsgRemoteClientBr
     k_ERemoteClientBroadcastMsgStatus, CMsgRemoteDeviceAuthorizationResponse, k_ERemoteDeviceAuthorizationResponse, \
     k_ERemoteDeviceAuthorizationRequest, CMsgRemoteDeviceAuthorizationRequest, k_ERemoteDeviceProofRequest, \
     CMsgRemoteDeviceProofRequest, CMsgRemoteDeviceStreamingResponse, k_ERemoteDeviceStreamingResponse
-from service import ccrypto
+from service.identity import Identity, identity
 
 pkt_magic: bytes = bytes([0xff, 0xff, 0xff, 0xff, 0x21, 0x4c, 0x5f, 0xa0])
 
@@ -26,97 +25,94 @@ pkt_types: dict[int, type[Message]] = {
 }
 
 
-def _load_bytes(file: str, size: int) -> bytes:
-    with open(file) as f:
-        s = f.read(size * 2)
-        if len(s) == size * 2:
-            return bytes.fromhex(s)
-    raise IOError('Bytes not valid')
+def get_device_id(profile: Optional[str] = None) -> int:
+    return identity(profile).device_id
 
 
-def _obtain_random_bytes(file: str, size: int) -> bytes:
-    try:
-        return _load_bytes(file, size)
-    except IOError:
-        pass
-    value = secrets.token_bytes(size)
-    return _save_bytes(file, value)
-
-
-def _save_bytes(file, value):
-    filedir = os.path.dirname(file)
-    if not os.path.exists(filedir):
-        os.makedirs(filedir, exist_ok=True)
-    with open(file, 'w') as f:
-        f.write(value.hex())
-        f.flush()
-    return value
-
-
-def _config_path(name: str) -> str:
-    return path.join(path.expanduser('~'), '.steamlink', name)
+def get_secret_key(profile: Optional[str] = None) -> bytes:
+    return identity(profile).secret_key
 
 
-def get_device_id() -> int:
-    return int.from_bytes(_obtain_random_bytes(_config_path('device_id.txt'), 8), byteorder='big', signed=False)
+def get_steamid(profile: Optional[str] = None) -> int:
+    return identity(profile).steamid
 
 
-def get_secret_key() -> bytes:
-    return _obtain_random_bytes(_config_path('secret_key.txt'), 32)
+def set_steamid(steamid: int, profile: Optional[str] = None):
+    identity(profile).steamid = steamid
 
 
-def get_steamid() -> int:
-    return int.from_bytes(_load_bytes(_config_path('steamid.txt'), 8), byteorder='big', signed=False)
+LENGTH = struct.Struct('<I')
+MAGIC_LENGTH = len(pkt_magic)
+# Magic, then a length for each of the header and the body
+MIN_MESSAGE_LENGTH = MAGIC_LENGTH + LENGTH.size * 2 + 4
 
 
-def set_steamid(steamid: int):
-    return _save_bytes(_config_path('steamid.txt'), steamid.to_bytes(8, byteorder='big', signed=False))
+@lru_cache(maxsize=256)
+def _parse_header(header_bytes: bytes) -> tuple[Message, type[Message]]:
+    """
+    A host sends the same few headers over and over, so each is parsed once, along with the body type it calls
+    for. The header is shared between every message that carries it and mustn't be modified.
+    """
+    header = CMsgRemoteClientBroadcastHeader()
+    header.ParseFromString(header_bytes)
+    body_type = pkt_types.get(header.msg_type)
+    if body_type is None:
+        raise ValueError(f'Unknown message type {header.msg_type}')
+    return header, body_type
 
 
 def message_parse(data: bytes) -> tuple[Message, Message]:
     mlen = len(data)
-    if mlen < 20:
+    if mlen < MIN_MESSAGE_LENGTH:
         raise ValueError('Invalid packet: too short')
-    offset = 0
-    magic, = struct.unpack_from('<8s', data, offset)
-    if magic != pkt_magic:
-        raise ValueError(f'Invalid packet: wrong magic {magic.hex()}')
-    offset += 8
-    header_len, = struct.unpack_from('<1I', data, offset)
-    offset += 4
-    if mlen < offset + header_len:
+    if not data.startswith(pkt_magic):
+        raise ValueError(f'Invalid packet: wrong magic {data[:MAGIC_LENGTH].hex()}')
+    offset = MAGIC_LENGTH
+    header_len, = LENGTH.unpack_from(data, offset)
+    offset += LENGTH.size
+    if mlen < offset + header_len + LENGTH.size:
         raise ValueError('Message too short')
-    header = CMsgRemoteClientBroadcastHeader()
-    header.ParseFromString(data[offset:offset + header_len])
+    header, body_type = _parse_header(bytes(data[offset:offset + header_len]))
     offset += header_len
-    body_len, = struct.unpack_from('<1I', data, offset)
-    offset += 4
-    body = pkt_types[header.msg_type]()
+    body_len, = LENGTH.unpack_from(data, offset)
+    offset += LENGTH.size
+    if mlen < offset + body_len:
+        raise ValueError('Message too short')
+    body = body_type()
     body.ParseFromString(data[offset:offset + body_len])
     return header, body
 
 
-def message_serialize(msg_type: int, body: Message) -> bytes:
-    header = CMsgRemoteClientBroadcastHeader(client_id=get_device_id(), msg_type=msg_type)
-    header_bytes = header.SerializeToString()
+@lru_cache(maxsize=64)
+def _message_prefix(client_id: int, msg_type: int) -> bytes:
+    """
+    Everything ahead of the body length, which only depends on who we are and what we send.
+    """
+    header_bytes = CMsgRemoteClientBroadcastHeader(client_id=client_id, msg_type=msg_type).SerializeToString()
+    return pkt_magic + LENGTH.pack(len(header_bytes)) + header_bytes
+
+
+def message_serialize(msg_type: int, body: Message, client_id: Optional[int] = None) -> bytes:
+    if client_id is None:
+        client_id = get_device_id()
     body_bytes = body.SerializeToString()
-    result = bytes(pkt_magic)
-    result += struct.pack('<1I', len(header_bytes))
-    result += header_bytes
-    result += struct.pack('<1I', len(body_bytes))
-    result += body_bytes
-    return result
+    return b''.join((_message_prefix(client_id, msg_type), LENGTH.pack(len(body_bytes)), body_bytes))
 
 
 def device_token(dev_id: int, enc_key: bytes) -> bytes:
+    # pycryptodome is only loaded by the commands that need it
+    from service import ccrypto
     return ccrypto.symmetric_encrypt(dev_id.to_bytes(8, byteorder='little', signed=False), enc_key)
 
 
 class ServiceProtocol(asyncio.DatagramProtocol):
     transport: DatagramTransport
 
-    def __init__(self):
+    def __init__(self, profile: Optional[str] = None):
         super().__init__()
+        self.profile = profile
+        # Held on to, every datagram we send carries its device ID
+        self.identity: Identity = identity(profile)
 
     def connection_made(self, transport: DatagramTransport) -> None:
         self.transport = transport
@@ -126,7 +122,7 @@ class ServiceProtocol(asyncio.DatagramProtocol):
         self.message_received(header, message, addr)
 
     def send_message(self, msg_type: int, msg: Message, addr: tuple[str, int]):
-        data = message_serialize(msg_type, msg)
+        data = message_serialize(msg_type, msg, self.identity.device_id)
         self.transport.sendto(data, addr)
 
     def message_received(self, header: Message, msg: Message, addr: tuple[str, int]):
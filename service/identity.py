@@ -0,0 +1,117 @@
+import os
+import secrets
+import threading
+
+from os import path
+from typing import Dict, Optional
+
+DEFAULT_PROFILE = 'default'
+CONFIG_DIR = path.join(path.expanduser('~'), '.steamlink')
+
+DEVICE_ID_FILE = 'device_id.txt'
+SECRET_KEY_FILE = 'secret_key.txt'
+STEAMID_FILE = 'steamid.txt'
+
+
+def _load_bytes(file: str, size: int) -> bytes:
+    with open(file) as f:
+        s = f.read(size * 2)
+        if len(s) == size * 2:
+            return bytes.fromhex(s)
+    raise IOError('Bytes not valid')
+
+
+def _save_bytes(file: str, value: bytes) -> bytes:
+    os.makedirs(path.dirname(file), exist_ok=True)
+    # Written aside and renamed over, so a crash never leaves half a key behind
+    temp_file = f'{file}.tmp'
+    with open(temp_file, 'w') as f:
+        f.write(value.hex())
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_file, file)
+    return value
+
+
+class Identity:
+    """
+    A client identity: the device ID and secret key we pair with, and the Steam ID we were paired to. Each file is
+    read once, the first time it's needed, and kept in memory after that; missing device IDs and keys are generated.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.values: Dict[str, bytes] = {}
+        self.lock = threading.Lock()
+
+    def value(self, name: str, size: int, generate: bool) -> bytes:
+        value = self.values.get(name)
+        if value is not None:
+            return value
+        with self.lock:
+            value = self.values.get(name)
+            if value is None:
+                file = path.join(self.directory, name)
+                try:
+                    value = _load_bytes(file, size)
+                except IOError:
+                    if not generate:
+                        raise
+                    value = _save_bytes(file, secrets.token_bytes(size))
+                self.values[name] = value
+            return value
+
+    def set_value(self, name: str, value: bytes):
+        with self.lock:
+            self.values[name] = _save_bytes(path.join(self.directory, name), value)
+
+    @property
+    def device_id(self) -> int:
+        return int.from_bytes(self.value(DEVICE_ID_FILE, 8, True), byteorder='big', signed=False)
+
+    @property
+    def secret_key(self) -> bytes:
+        return self.value(SECRET_KEY_FILE, 32, True)
+
+    @property
+    def steamid(self) -> int:
+        """
+        Raises IOError until we're paired.
+        """
+        return int.from_bytes(self.value(STEAMID_FILE, 8, False), byteorder='big', signed=False)
+
+    @steamid.setter
+    def steamid(self, steamid: int):
+        self.set_value(STEAMID_FILE, steamid.to_bytes(8, byteorder='big', signed=False))
+
+
+_identities: Dict[str, Identity] = {}
+_identities_lock = threading.Lock()
+_current_profile = DEFAULT_PROFILE
+
+
+def profile_directory(profile: str) -> str:
+    # The default profile stays where the files have always been
+    if profile == DEFAULT_PROFILE:
+        return CONFIG_DIR
+    return path.join(CONFIG_DIR, 'profiles', profile)
+
+
+def identity(profile: Optional[str] = None) -> Identity:
+    """
+    The identity of `profile`, or of the current one, shared by everything in the process.
+    """
+    profile = profile or _current_profile
+    found = _identities.get(profile)
+    if found is None:
+        with _identities_lock:
+            found = _identities.setdefault(profile, Identity(profile_directory(profile)))
+    return found
+
+
+def use_profile(profile: str):
+    """
+    Make `profile` the identity used when none is given.
+    """
+    global _current_profile
+    _current_profile = profile
@@ -1,21 +1,36 @@
 import os.path
 from base64 import b64decode
+from functools import lru_cache
+from typing import Optional
 
-import yaml
 from google.protobuf.message import Message
 
 from protobuf.steammessages_remoteclient_discovery_pb2 import CMsgRemoteDeviceAuthorizationRequest
 from service import ccrypto
 from service.common import get_device_id, device_token
 
-with open(os.path.join(os.path.dirname(__file__), 'pubkey.yml')) as f:
-    keys = yaml.load(f, Loader=yaml.FullLoader)
+PUBKEY_PATH = os.path.join(os.path.dirname(__file__), 'pubkey.yml')
+
+
+@lru_cache(maxsize=None)
+def pubkeys() -> dict[int, str]:
+    """
+    The public keys of Steam's universes, read on first use so commands that don't pair never load them.
+    """
+    import yaml
+    with open(PUBKEY_PATH) as f:
+        return yaml.load(f, Loader=yaml.FullLoader)
+
+
+@lru_cache(maxsize=None)
+def _universe_pubkey(universe: int) -> bytes:
+    return b64decode(pubkeys()[universe])
 
 
 def authorization_req_rsa_pubkey(universe: int) -> bytes:
     if universe > 4:
         raise ValueError(f'Unsupported universe {universe}')
-    return b64decode(keys[min(universe, 3)])
+    return _universe_pubkey(min(universe, 3))
 
 
 def authorization_req_ticket_plain(dev_id: int, pin: str, enc_key: bytes, name: str) -> Message:
@@ -31,9 +46,14 @@ def authorization_req_ticket_plain(dev_id: int, pin: str, enc_key: bytes, name:
     return ticket
 
 
-def authorization_req(universe: int, device_name: str, enc_key: bytes, pin: str) -> Message:
+def authorization_req(universe: int, device_name: str, enc_key: bytes, pin: str,
+                      profile: Optional[str] = None) -> Message:
+    """
+    The request for pairing with `pin`. The encrypted ticket is different every time, build it once per attempt and
+    resend that.
+    """
     pubkey = authorization_req_rsa_pubkey(universe)
-    device_id = get_device_id()
+    device_id = get_device_id(profile)
     plain = authorization_req_ticket_plain(device_id, pin, enc_key, device_name)
     encrypted_request = ccrypto.rsa_encrypt(plain.SerializeToString(), pubkey)
     return CMsgRemoteDeviceAuthorizationRequest(device_token=device_token(device_id, enc_key), device_name=device_name,
@@ -1,3 +1,5 @@
+from typing import Optional
+
 from google.protobuf.message import Message
 
 from protobuf.steammessages_remoteclient_discovery_pb2 import CMsgRemoteDeviceStreamingRequest, \
@@ -6,7 +8,7 @@ from protobuf.steammessages_remoteclient_discovery_pb2 import CMsgRemoteDeviceSt
 from service.common import get_device_id, device_token, get_secret_key
 
 
-def streaming_req(request_id: int, client_id: int) -> Message:
+def streaming_req(request_id: int, client_id: int, profile: Optional[str] = None) -> Message:
     message = CMsgRemoteDeviceStreamingRequest()
     message.client_id = client_id
     message.request_id = request_id
@@ -24,7 +26,7 @@ def streaming_req(request_id: int, client_id: int) -> Message:
     message.stream_interface = k_EStreamInterfaceDefault
     message.supported_transport.extend([k_EStreamTransportUDP, k_EStreamTransportUDPRelay, k_EStreamTransportSDR])
     message.restricted = False
-    message.device_token = device_token(get_device_id(), get_secret_key())
+    message.device_token = device_token(get_device_id(profile), get_secret_key(profile))
     message.device_version = 'build 827'
     message.network_test = False
     message.gameid = 0
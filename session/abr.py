@@ -0,0 +1,147 @@
+import math
+import time
+
+from dataclasses import dataclass
+from typing import Callable, Optional, Tuple
+
+ABR_INTERVAL = 0.5
+# Share of frames lost, late or expired in an interval above which the stream is congested, and below which it's
+# healthy. In between the bitrate stays where it is.
+CONGESTED_LOSS = 0.05
+HEALTHY_LOSS = 0.01
+# Weight of the newest interval in the smoothed loss, so a single unlucky interval doesn't move the bitrate
+LOSS_SMOOTHING = 0.25
+DECREASE_FACTOR = 0.75
+INCREASE_FACTOR = 1.15
+# While congested, what arrives is about what the link carries, so cut to at least a bit under it
+THROUGHPUT_SHARE = 0.9
+MIN_DECREASE_INTERVAL = 1.0
+MIN_INCREASE_INTERVAL = 3.0
+# Healthy intervals in a row before going up
+HEALTHY_INTERVALS = 6
+# Congested intervals in a row at the minimum bitrate before dropping the framerate
+FRAMERATE_DROP_INTERVALS = 2
+FRAMERATES = (60, 30)
+MIN_BITRATE_KBPS = 2000
+
+
+@dataclass
+class StreamCounters:
+    """
+    Running totals for a data channel, read by the controller every interval.
+    """
+    frames: int = 0
+    lost: int = 0
+    late: int = 0
+    expired: int = 0
+    bytes: int = 0
+
+
+@dataclass
+class AbrStats:
+    decreases: int = 0
+    increases: int = 0
+    framerate_changes: int = 0
+    loss: float = 0.0
+    throughput_kbps: float = 0.0
+
+
+class AbrController:
+    """
+    Steers the host's target bitrate by what reaches us. Every interval it compares the stream's counters with the
+    previous ones and smooths the share of frames lost, late or expired: congestion cuts the bitrate
+    multiplicatively, a run of healthy intervals raises it a little, and anything in between holds it. Changes in
+    either direction are spaced out by a minimum interval. Once the bitrate is at its floor and the stream is still
+    congested, the framerate goes down a step, and comes back up when the bitrate has room again.
+    """
+
+    def __init__(self, counters: Callable[[], StreamCounters], set_bitrate: Callable[[int], None],
+                 set_framerate: Callable[[int], None], bitrate_kbps: int, max_kbps: int,
+                 min_kbps: int = MIN_BITRATE_KBPS, interval: float = ABR_INTERVAL,
+                 clock: Callable[[], float] = time.monotonic):
+        self.counters = counters
+        self.set_bitrate = set_bitrate
+        self.set_framerate = set_framerate
+        self.bitrate_kbps = bitrate_kbps
+        self.max_kbps = max_kbps
+        self.min_kbps = min_kbps
+        self.interval = interval
+        self.framerate_index = 0
+        self.stats = AbrStats()
+        self.last: Optional[Tuple[float, StreamCounters]] = None
+        self.last_change = -math.inf
+        self.healthy = 0
+        self.congested = 0
+        self.next_deadline = clock() + interval
+
+    @property
+    def framerate(self) -> int:
+        return FRAMERATES[self.framerate_index]
+
+    def poll(self, now: float):
+        if now < self.next_deadline:
+            return
+        self.next_deadline = now + self.interval
+        counters = self.counters()
+        last, self.last = self.last, (now, counters)
+        if last is not None:
+            self.update(now, now - last[0], last[1], counters)
+
+    def update(self, now: float, elapsed: float, before: StreamCounters, after: StreamCounters):
+        frames = after.frames - before.frames
+        lost = max(after.lost - before.lost, after.expired - before.expired)
+        impaired = lost + after.late - before.late
+        if frames + lost <= 0:
+            # Nothing was streamed, so there's nothing to judge
+            return
+        stats = self.stats
+        stats.loss += (impaired / (frames + lost) - stats.loss) * LOSS_SMOOTHING
+        stats.throughput_kbps = (after.bytes - before.bytes) * 8 / elapsed / 1000
+        if stats.loss >= CONGESTED_LOSS:
+            self.healthy = 0
+            self.congested += 1
+            self.on_congested(now)
+        elif stats.loss <= HEALTHY_LOSS:
+            self.congested = 0
+            self.healthy += 1
+            self.on_healthy(now)
+        else:
+            self.healthy = 0
+            self.congested = 0
+
+    def on_congested(self, now: float):
+        if self.bitrate_kbps <= self.min_kbps:
+            if self.congested >= FRAMERATE_DROP_INTERVALS and self.framerate_index < len(FRAMERATES) - 1:
+                self.change_framerate(self.framerate_index + 1)
+                self.congested = 0
+            return
+        if now - self.last_change < MIN_DECREASE_INTERVAL:
+            return
+        target = min(self.bitrate_kbps * DECREASE_FACTOR, self.stats.throughput_kbps * THROUGHPUT_SHARE)
+        self.stats.decreases += 1
+        # Judge the new bitrate on its own losses, not the ones that made us cut
+        self.stats.loss = 0.0
+        self.change_bitrate(now, max(int(target), self.min_kbps))
+
+    def on_healthy(self, now: float):
+        if self.healthy < HEALTHY_INTERVALS or now - self.last_change < MIN_INCREASE_INTERVAL:
+            return
+        if self.framerate_index > 0 and self.bitrate_kbps >= 2 * self.min_kbps:
+            self.change_framerate(self.framerate_index - 1)
+            self.healthy = 0
+            return
+        if self.bitrate_kbps >= self.max_kbps:
+            return
+        self.stats.increases += 1
+        self.healthy = 0
+        self.change_bitrate(now, min(int(self.bitrate_kbps * INCREASE_FACTOR), self.max_kbps))
+
+    def change_bitrate(self, now: float, bitrate_kbps: int):
+        self.bitrate_kbps = bitrate_kbps
+        self.last_change = now
+        self.set_bitrate(bitrate_kbps)
+
+    def change_framerate(self, index: int):
+        self.framerate_index = index
+        self.stats.framerate_changes += 1
+        self.set_framerate(FRAMERATES[index])
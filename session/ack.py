@@ -0,0 +1,81 @@
+import math
+import time
+
+from dataclasses import dataclass
+from typing import Callable, Dict, Optional, Tuple
+
+from session.frame import frame_timestamp
+from session.packet import PacketType
+
+ACK_DELAY = 0.002
+
+
+@dataclass
+class AckStats:
+    sent: int = 0
+    # ACKs and NACKs that never went out, because one for the same packet was already waiting
+    saved: int = 0
+    added_latency: float = 0.0
+    max_added_latency: float = 0.0
+
+    @property
+    def mean_added_latency(self) -> float:
+        return self.added_latency / self.sent if self.sent else 0.0
+
+
+SendFunction = Callable[[bool, PacketType, int, bytes], None]
+
+
+class AckScheduler:
+    """
+    Holds the ACKs and NACKs a channel owes for up to `delay` seconds, then sends them together, still one
+    datagram per packet. Whatever is owed for the same packet by then goes out once, and an ACK wins over a NACK.
+    With no delay, everything owed after a receive wakeup is sent when the worker next polls.
+    """
+
+    def __init__(self, send: SendFunction, delay: float = ACK_DELAY, clock: Callable[[], float] = time.monotonic):
+        self.send = send
+        self.delay = delay
+        self.clock = clock
+        self.stats = AckStats()
+        self.pending: Dict[int, Tuple[PacketType, float]] = {}
+        self.next_deadline = math.inf
+
+    def ack(self, pkt_id: int):
+        self.schedule(PacketType.ACK, pkt_id)
+
+    def nack(self, pkt_id: int):
+        self.schedule(PacketType.NACK, pkt_id)
+
+    def schedule(self, pkt_type: PacketType, pkt_id: int):
+        now = self.clock()
+        pending = self.pending
+        if not pending:
+            self.next_deadline = now + self.delay
+        elif pkt_id in pending:
+            self.stats.saved += 1
+            if pkt_type == PacketType.NACK or pending[pkt_id][0] == PacketType.ACK:
+                return
+        pending[pkt_id] = (pkt_type, now)
+
+    def poll(self, now: float):
+        if now >= self.next_deadline:
+            self.flush(now)
+
+    def flush(self, now: Optional[float] = None):
+        pending = self.pending
+        if not pending:
+            return
+        if now is None:
+            now = self.clock()
+        self.pending = {}
+        self.next_deadline = math.inf
+        stats = self.stats
+        body = int.to_bytes(frame_timestamp(), 4, byteorder='little', signed=False)
+        for pkt_id, (pkt_type, received_at) in pending.items():
+            latency = now - received_at
+            stats.sent += 1
+            stats.added_latency += latency
+            if latency > stats.max_added_latency:
+                stats.max_added_latency = latency
+            self.send(True, pkt_type, pkt_id, body)
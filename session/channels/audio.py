@@ -1,24 +1,49 @@
 from concurrent.futures import ThreadPoolExecutor
 
-from alsaaudio import PCM, PCM_PLAYBACK, PCM_NORMAL, PCM_FORMAT_S16_LE
-from opuslib import Decoder as OpusDecoder
 from typing import Optional
 
-from protobuf.steammessages_remoteplay_pb2 import CStartAudioDataMsg
+from protobuf.steammessages_remoteplay_pb2 import CStartAudioDataMsg, k_EStreamingAudioData
+from session import media
 from session.channels.data import Data
 from session.client import Client
 from session.frame import DataFrameHeader
+from session.jitter import AUDIO_MIN_DELAY, AUDIO_MAX_DELAY
+from session.metrics import REGISTRY
 
 
 class Audio(Data):
+    data_type = k_EStreamingAudioData
+    jitter_min_delay = AUDIO_MIN_DELAY
+    jitter_max_delay = AUDIO_MAX_DELAY
 
     def __init__(self, client: Client, message: CStartAudioDataMsg):
         super().__init__(client, message.channel)
-        self.executor: ThreadPoolExecutor = ThreadPoolExecutor(max_workers=1)
-        self.decoder: OpusDecoder = OpusDecoder(message.frequency, message.channels)
-        self.sink: PCM = PCM(type=PCM_PLAYBACK, mode=PCM_NORMAL, rate=message.frequency,
-                             channels=message.channels, format=PCM_FORMAT_S16_LE, periodsize=32,
-                             device='default')
+        self.decode_errors = REGISTRY.counter('steamlink_audio_decode_errors', 'Audio frames Opus failed to decode',
+                                              **self.metric_labels)
+        self.executor: Optional[ThreadPoolExecutor] = None
+        try:
+            self.decoder = media.backend(media.AUDIO_DECODER)(message.frequency, message.channels)
+            self.sink = media.backend(media.AUDIO_OUTPUT)(message.frequency, message.channels)
+        except media.MediaUnavailable as e:
+            # Still a channel, so the host's packets are acknowledged and counted, just not played
+            print(f'Audio disabled: {e}')
+            return
+        self.executor = ThreadPoolExecutor(max_workers=1)
 
     def handle_data(self, header: Optional[DataFrameHeader], payload: bytes):
-        self.executor.submit(lambda: self.sink.write(self.decoder.decode(payload, 480)))
+        if self.executor is None:
+            return
+        data = bytes(payload)
+        self.executor.submit(self.play, data)
+
+    def play(self, data: bytes):
+        try:
+            pcm = self.decoder.decode(data, 480)
+        except media.DecodeError:
+            self.decode_errors.inc()
+            return
+        self.sink.write(pcm)
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
@@ -1,35 +1,62 @@
+from collections import deque
+
 from google.protobuf.message import Message
-from typing import Set
+from typing import Deque, Iterable, List, Optional, Tuple
 
+from session.ack import AckScheduler
 from session.client import Client
 from session.frame import Frame, FrameAssembler, frame_encrypt, frame_timestamp
-from session.packet import Packet, PacketType
+from session.metrics import REGISTRY, Sample, stats_samples
+from session.packet import Packet, PacketType, RELIABLE_TYPES, PACKET_HEADER_LENGTH, PACKET_CRC_LENGTH
+from session.retransmit import RetransmitQueue
+from session.scheduler import SendPriority
+from session.sequence import PacketIdAllocator
 
 
 class Channel:
+    send_priority: SendPriority = SendPriority.CONTROL
 
     def __init__(self, client: Client, channel: int):
         self.client = client
         self.channel = channel
         self.frame_assembler: FrameAssembler = FrameAssembler(channel)
-        self.sent_packets: Set[int] = set[int]()
+        self.sent_packets: PacketIdAllocator = PacketIdAllocator()
+        self.retransmits: RetransmitQueue = RetransmitQueue(self.resend_packet)
+        self.acks: AckScheduler = AckScheduler(self.send_packet)
+        self.pending_reliable: Deque[Tuple[int, Message]] = deque()
+        # Messages sent with a packet ID of the caller's choosing while an earlier packet still had it
+        self.held_reliable: Deque[Tuple[int, int, Message]] = deque()
         self.recv_decrypt_sequence: int = 0
         self.send_encrypt_sequence: int = 0
-        self._next_pkt_id = 0
+        self.metric_labels: dict[str, str] = {'channel': str(channel), 'type': type(self).__name__.lower()}
+        self.packets_received = REGISTRY.counter('steamlink_channel_packets_received', 'Packets received per channel',
+                                                 **self.metric_labels)
+        self.nacks_sent = REGISTRY.counter('steamlink_nacks_sent', 'Reliable packets we refused',
+                                           **self.metric_labels)
+        self.nacks_received = REGISTRY.counter('steamlink_nacks_received', 'Reliable packets the host refused',
+                                               **self.metric_labels)
+        REGISTRY.add_collector(self.collect_metrics)
 
     def handle_packet(self, packet: Packet):
-        pkt_type = packet.header.pkt_type
+        header = packet.header
+        pkt_type = header.pkt_type
+        self.packets_received.inc()
         if pkt_type == PacketType.ACK:
-            self.on_ack(packet.header.pkt_id, int.from_bytes(packet.body, byteorder='little', signed=False))
+            self.on_ack(header.pkt_id, int.from_bytes(packet.body, byteorder='little', signed=False))
         elif pkt_type == PacketType.NACK:
-            self.on_nack(packet.header.pkt_id, int.from_bytes(packet.body, byteorder='little', signed=False))
+            self.on_nack(header.pkt_id, int.from_bytes(packet.body, byteorder='little', signed=False))
+        elif pkt_type in RELIABLE_TYPES and self.frame_assembler.is_duplicate(header):
+            # We have it already, so the host missed our ACK
+            self.frame_assembler.stats.duplicates += 1
+            self.acks.ack(header.pkt_id)
         elif self.frame_assembler.add_packet(packet):
-            if packet.header.pkt_type in [PacketType.RELIABLE, PacketType.RELIABLE_FRAG]:
-                self.send_ack(packet.header.pkt_id, packet.header.channel)
+            if pkt_type in RELIABLE_TYPES:
+                self.acks.ack(header.pkt_id)
         else:
-            # print(f'Send NACK to {packet.header.pkt_type}')
-            if packet.header.pkt_type in [PacketType.RELIABLE, PacketType.RELIABLE_FRAG]:
-                self.send_nack(packet.header.pkt_id, packet.header.channel)
+            # print(f'Send NACK to {pkt_type}')
+            if pkt_type in RELIABLE_TYPES:
+                self.nacks_sent.inc()
+                self.acks.nack(header.pkt_id)
 
         while True:
             frame = self.frame_assembler.poll_frame()
@@ -40,28 +67,79 @@ class Channel:
     def handle_frame(self, frame: Frame):
         pass
 
+    def close(self):
+        """
+        The channel was removed from the session.
+        """
+        pass
+
     def on_ack(self, pkt_id: int, timestamp: int):
-        if pkt_id not in self.sent_packets:
+        self.retransmits.acknowledge(pkt_id)
+        if not self.sent_packets.release(pkt_id):
             return
-        self.sent_packets.remove(pkt_id)
+        self.flush_pending_reliable()
 
     def on_nack(self, pkt_id: int, timestamp: int):
+        self.nacks_received.inc()
         if pkt_id not in self.sent_packets:
             return
-        self.sent_packets.remove(pkt_id)
-        print(f'packet {pkt_id} returned nack')
-
-    def send_packet(self, has_crc: bool, pkt_type: PacketType, pkt_id: int, body: bytes = b'', pad_to: int = 0):
-        self.client.send_packet(has_crc, pkt_type, pkt_id, self.channel, body, pad_to)
-
-    def next_pkt_id(self) -> int:
-        pkt_id = 0
-        for i in range(self._next_pkt_id, 65536):
-            if i not in self.sent_packets:
-                pkt_id = i
-                break
-        self.sent_packets.add(pkt_id)
-        return pkt_id
+        if not self.retransmits.negative_acknowledge(pkt_id):
+            print(f'packet {pkt_id} returned nack, giving up')
+            self.sent_packets.release(pkt_id)
+            self.flush_pending_reliable()
+
+    def poll(self, now: float) -> float:
+        """
+        Run what's due by `now`, and return the time this channel next needs polling.
+        """
+        self.acks.poll(now)
+        self.frame_assembler.expire(now)
+        given_up = self.retransmits.poll(now)
+        if given_up:
+            for pkt_id in given_up:
+                print(f'packet {pkt_id} was never acknowledged, giving up')
+                self.sent_packets.release(pkt_id)
+            self.flush_pending_reliable()
+        return min(self.acks.next_deadline, self.frame_assembler.next_deadline, self.retransmits.next_deadline)
+
+    def collect_metrics(self) -> Iterable[Sample]:
+        labels = tuple(self.metric_labels.items())
+        samples: List[Sample] = []
+        samples += stats_samples('steamlink_frame_assembler', self.frame_assembler.stats, labels)
+        samples += stats_samples('steamlink_retransmit', self.retransmits.stats, labels)
+        rtt = self.retransmits.rtt
+        if rtt.srtt is not None:
+            samples.append(('steamlink_rtt_seconds', labels, rtt.srtt))
+        samples.append(('steamlink_rto_seconds', labels, rtt.rto))
+        samples += stats_samples('steamlink_ack', self.acks.stats, labels)
+        samples.append(('steamlink_pending_reliable', labels, len(self.pending_reliable)))
+        samples.append(('steamlink_held_reliable', labels, len(self.held_reliable)))
+        return samples
+
+    def send_packet(self, has_crc: bool, pkt_type: PacketType, pkt_id: int, body: bytes = b'', pad_to: int = 0,
+                    retransmit_count: int = 0, fragment_id: int = 0, priority: Optional[SendPriority] = None):
+        if priority is None:
+            priority = self.send_priority
+        self.client.send_packet(has_crc, pkt_type, pkt_id, self.channel, body, pad_to, retransmit_count, fragment_id,
+                                priority)
+
+    def send_tracked(self, has_crc: bool, pkt_type: PacketType, pkt_id: int, body: bytes = b'', fragment_id: int = 0,
+                     priority: Optional[SendPriority] = None):
+        """
+        Send a packet that is sent again until it's acknowledged.
+        """
+        if priority is None:
+            priority = self.send_priority
+        self.retransmits.track(has_crc, pkt_type, pkt_id, body, fragment_id, priority)
+        self.send_packet(has_crc, pkt_type, pkt_id, body, fragment_id=fragment_id, priority=priority)
+
+    def resend_packet(self, has_crc: bool, pkt_type: PacketType, pkt_id: int, body: bytes, retransmit_count: int,
+                      fragment_id: int, priority: SendPriority):
+        self.send_packet(has_crc, pkt_type, pkt_id, body, retransmit_count=retransmit_count, fragment_id=fragment_id,
+                         priority=priority)
+
+    def next_pkt_id(self) -> Optional[int]:
+        return self.sent_packets.allocate()
 
     def send_ack(self, pkt_id: int, channel: int):
         body = int.to_bytes(frame_timestamp(), 4, byteorder='little', signed=False)
@@ -72,14 +150,68 @@ class Channel:
         self.send_packet(True, PacketType.NACK, pkt_id, body)
 
     def send_reliable(self, msg_type: int, message: Message, pkt_id: int = -1):
+        if pkt_id == -1:
+            # Keep messages in order behind any that are already waiting for the window
+            if self.pending_reliable or self.sent_packets.full:
+                self.pending_reliable.append((msg_type, message))
+                return
+            if not self.send_reliable_packet(msg_type, message):
+                self.pending_reliable.append((msg_type, message))
+            return
+        if not self.send_reliable_packet(msg_type, message, pkt_id):
+            # Sending now would take over the retransmission of the packet in flight, wait for it to go
+            print(f'Packet ID {pkt_id} is still in flight in channel {self.channel}, holding the message')
+            self.held_reliable.append((pkt_id, msg_type, message))
+
+    def send_reliable_packet(self, msg_type: int, message: Message, pkt_id: int = -1) -> bool:
+        """
+        Send a message, split into RELIABLE and RELIABLE_FRAG packets if it doesn't fit in one. Returns False and
+        sends nothing if the window can't take all of its packets, or if an explicit `pkt_id` is still in flight.
+        """
         payload = message.SerializeToString()
-        if self.frame_should_encrypt(msg_type):
+        encrypted = self.frame_should_encrypt(msg_type)
+        if encrypted:
             payload = frame_encrypt(payload, self.client.auth_token, self.send_encrypt_sequence)
             self.send_encrypt_sequence += 1
-        body = int.to_bytes(msg_type, 1, byteorder='little', signed=False) + payload
+        body = memoryview(int.to_bytes(msg_type, 1, byteorder='little', signed=False) + payload)
+        fragment_size = self.client.mtu - PACKET_HEADER_LENGTH - PACKET_CRC_LENGTH
+        count = max(1, -(-len(body) // fragment_size))
+        if count > self.sent_packets.window:
+            raise ValueError(f'Message of {len(body)} bytes needs {count} packets, more than the send window')
         if pkt_id == -1:
-            pkt_id = self.next_pkt_id()
-        self.send_packet(True, PacketType.RELIABLE, pkt_id, body)
+            pkt_id = self.sent_packets.allocate(count)
+        elif any((pkt_id + i) & 0xFFFF in self.sent_packets for i in range(count)):
+            # The fragments take the IDs after the head's, all of them have to be free
+            pkt_id = None
+        else:
+            for i in range(count):
+                self.sent_packets.claim((pkt_id + i) & 0xFFFF)
+        if pkt_id is None:
+            # Nothing went out with this sequence number, so the message can take it again later
+            if encrypted:
+                self.send_encrypt_sequence -= 1
+            return False
+        priority = self.message_priority(msg_type)
+        if count == 1:
+            self.send_tracked(True, PacketType.RELIABLE, pkt_id, body, 0, priority)
+            return True
+        # Head packet carries the number of fragments following it, each fragment its own index
+        self.send_tracked(True, PacketType.RELIABLE, pkt_id, body[:fragment_size], count - 1, priority)
+        for i in range(1, count):
+            self.send_tracked(True, PacketType.RELIABLE_FRAG, (pkt_id + i) & 0xFFFF,
+                              body[i * fragment_size:(i + 1) * fragment_size], i - 1, priority)
+        return True
+
+    def flush_pending_reliable(self):
+        for _ in range(len(self.held_reliable)):
+            pkt_id, msg_type, message = self.held_reliable.popleft()
+            if not self.send_reliable_packet(msg_type, message, pkt_id):
+                self.held_reliable.append((pkt_id, msg_type, message))
+        while self.pending_reliable and not self.sent_packets.full:
+            msg_type, message = self.pending_reliable[0]
+            if not self.send_reliable_packet(msg_type, message):
+                break
+            self.pending_reliable.popleft()
 
     def send_unconnected(self, msg_type: int, payload: bytes, pad_to: int):
         type_bytes = int.to_bytes(msg_type, 1, byteorder='little', signed=False)
@@ -88,3 +220,6 @@ class Channel:
 
     def frame_should_encrypt(self, msg_type: int) -> bool:
         return False
+
+    def message_priority(self, msg_type: int) -> SendPriority:
+        return self.send_priority
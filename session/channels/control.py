@@ -1,5 +1,7 @@
 import asyncio
+import math
 from google.protobuf.message import DecodeError, Message
+from typing import Iterable, Optional
 
 from protobuf.steammessages_remoteclient_discovery_pb2 import k_EStreamDeviceFormFactorTV
 from protobuf.steammessages_remoteplay_pb2 import k_EStreamControlClientHandshake, k_EStreamControlServerHandshake, \
@@ -17,13 +19,44 @@ from protobuf.steammessages_remoteplay_pb2 import k_EStreamControlClientHandshak
     k_EStreamControlNegotiationComplete, CNegotiationSetConfigMsg, CNegotiationInitMsg, CAuthenticationResponseMsg, \
     CServerHandshakeMsg, k_EStreamVersionCurrent, CAuthenticationRequestMsg, \
     CStreamingClientCaps, CStreamingClientConfig, CStreamVideoMode, k_EStreamVideoCodecHEVC, k_EStreamVideoCodecH264, \
-    k_EStreamAudioCodecOpus, CNegotiatedConfig, k_EStreamControlKeepAlive, CKeepAliveMsg
+    k_EStreamAudioCodecOpus, CNegotiatedConfig, k_EStreamControlKeepAlive, CKeepAliveMsg, \
+    k_EStreamControlInputControllerAttached_OBSOLETE, k_EStreamControlInputControllerDetached_OBSOLETE, \
+    k_EStreamControlInputControllerState_OBSOLETE, k_EStreamControlInputControllerStateHID_OBSOLETE, \
+    k_EStreamControlInputControllerWirelessPresence_OBSOLETE, k_EStreamControlInputGamepadAttached_OBSOLETE, \
+    k_EStreamControlInputGamepadDetached_OBSOLETE, k_EStreamControlInputGamepadEvent_OBSOLETE, \
+    k_EStreamControlInputKeyDown, k_EStreamControlInputKeyUp, k_EStreamControlInputLatencyTest, \
+    k_EStreamControlInputMouseDown, k_EStreamControlInputMouseMotion, k_EStreamControlInputMouseUp, \
+    k_EStreamControlInputMouseWheel, k_EStreamControlInputText, k_EStreamControlInputTouchFingerDown, \
+    k_EStreamControlInputTouchFingerMotion, k_EStreamControlInputTouchFingerUp
 from service.common import get_steamid
+from session.abr import AbrController
 from session.channels.audio import Audio
 from session.channels.base import Channel
+from session.client import Client
 from session.channels.video import Video
 from session.frame import Frame, frame_should_encrypt, frame_decrypt, frame_hmac256
+from session.metrics import REGISTRY, Sample, stats_samples
 from session.packet import PacketType
+from session.probe import ProbeResult
+from session.scheduler import SendPriority
+
+MAX_DECODE_BITRATE_KBPS = 30000
+MAX_BURST_BITRATE_KBPS = 90000
+MIN_DECODE_BITRATE_KBPS = 2000
+# Share of the probed bandwidth, after loss, offered as the decode bitrate
+PROBE_BITRATE_SHARE = 0.7
+
+# Sent ahead of everything else queued, they're what the player feels
+INPUT_MESSAGES = frozenset([
+    k_EStreamControlInputControllerAttached_OBSOLETE, k_EStreamControlInputControllerDetached_OBSOLETE,
+    k_EStreamControlInputControllerState_OBSOLETE, k_EStreamControlInputControllerStateHID_OBSOLETE,
+    k_EStreamControlInputControllerWirelessPresence_OBSOLETE, k_EStreamControlInputGamepadAttached_OBSOLETE,
+    k_EStreamControlInputGamepadDetached_OBSOLETE, k_EStreamControlInputGamepadEvent_OBSOLETE,
+    k_EStreamControlInputKeyDown, k_EStreamControlInputKeyUp, k_EStreamControlInputLatencyTest,
+    k_EStreamControlInputMouseDown, k_EStreamControlInputMouseMotion, k_EStreamControlInputMouseUp,
+    k_EStreamControlInputMouseWheel, k_EStreamControlInputText, k_EStreamControlInputTouchFingerDown,
+    k_EStreamControlInputTouchFingerMotion, k_EStreamControlInputTouchFingerUp,
+])
 
 
 class Control(Channel):
@@ -55,6 +88,14 @@ class Control(Channel):
         k_EStreamControlVideoEncoderInfo: CVideoEncoderInfoMsg,
     }
 
+    def __init__(self, client: Client, channel: int):
+        super().__init__(client, channel)
+        self.max_bitrate_kbps: int = MAX_DECODE_BITRATE_KBPS
+        self.qos_requested: bool = False
+        self.abr: Optional[AbrController] = None
+        self.decrypt_failures = REGISTRY.counter('steamlink_decrypt_failures', 'Messages and frames that failed to '
+                                                 'decrypt', **self.metric_labels)
+
     def handle_frame(self, frame: Frame):
         header = frame.header
         payload = frame.body
@@ -64,6 +105,7 @@ class Control(Channel):
                 try:
                     message = frame_decrypt(payload[1:], self.client.auth_token, self.recv_decrypt_sequence)
                 except ValueError as e:
+                    self.decrypt_failures.inc()
                     raise ValueError(
                         f'Failed to decode message (head {header}) {EStreamControlMessage.Name(msg_type)}: {e}')
                 self.recv_decrypt_sequence += 1
@@ -110,9 +152,13 @@ class Control(Channel):
         elif msg_type == k_EStreamControlStopAudioData:
             self.client.remove_channel_by_type(Audio)
         elif msg_type == k_EStreamControlStartVideoData:
-            self.client.add_channel(message.channel, Video(self.client, message))
+            video = Video(self.client, message, self.client.decrypt_workers)
+            self.client.add_channel(message.channel, video)
+            self.abr = AbrController(video.stream_counters, self.set_target_bitrate, self.set_target_framerate,
+                                     self.max_bitrate_kbps, self.max_bitrate_kbps)
         elif msg_type == k_EStreamControlStopVideoData:
             self.client.remove_channel_by_type(Video)
+            self.abr = None
         elif msg_type == k_EStreamControlSetTitle:
             print(f'Set title {message.text}')
         else:
@@ -120,7 +166,8 @@ class Control(Channel):
             pass
 
     def on_server_handshake(self, message: CServerHandshakeMsg):
-        mtu = message.info.mtu
+        if message.info.mtu:
+            self.client.mtu = message.info.mtu
         out_msg = CAuthenticationRequestMsg(version=k_EStreamVersionCurrent, steamid=get_steamid(),
                                             token=frame_hmac256(b'Steam In-Home Streaming', self.client.auth_token))
         self.send_reliable(k_EStreamControlAuthenticationRequest, out_msg)
@@ -130,6 +177,12 @@ class Control(Channel):
             self.client.hangup()
 
     def on_negotiation_init(self, pkt_id: int, message: CNegotiationInitMsg):
+        # Our caps depend on what the link probe finds, so the reply waits for it
+        self.client.after_link_probe(lambda result: self.send_negotiation_config(pkt_id, message, result))
+
+    def send_negotiation_config(self, pkt_id: int, message: CNegotiationInitMsg, probe: Optional[ProbeResult]):
+        if probe and probe.path_mtu:
+            self.client.mtu = min(self.client.mtu, probe.path_mtu)
         config = CNegotiatedConfig(reliable_data=message.reliable_data)
         for codec in message.supported_audio_codecs:
             if codec in [k_EStreamAudioCodecOpus]:
@@ -156,23 +209,54 @@ class Control(Channel):
         client_caps = CStreamingClientCaps()
         client_caps.system_can_suspend = True
         # client_caps.supports_video_hevc = True
-        client_caps.maximum_decode_bitrate_kbps = 30000
-        client_caps.maximum_burst_bitrate_kbps = 90000
+        client_caps.maximum_decode_bitrate_kbps, client_caps.maximum_burst_bitrate_kbps = probed_bitrates(probe)
+        self.max_bitrate_kbps = client_caps.maximum_decode_bitrate_kbps
         client_caps.form_factor = k_EStreamDeviceFormFactorTV
 
         out_msg = CNegotiationSetConfigMsg(config=config, streaming_client_config=client_cfg,
                                            streaming_client_caps=client_caps)
         self.send_reliable(k_EStreamControlNegotiationSetConfig, out_msg, pkt_id)
+        self.client.on_bitrate_changed(client_caps.maximum_decode_bitrate_kbps)
 
     def on_negotation_set_config(self, pkt_id: int, message: CNegotiationSetConfigMsg):
         out_msg = CNegotiationCompleteMsg()
         self.send_reliable(k_EStreamControlNegotiationComplete, out_msg, pkt_id)
         self.start_heartbeat()
 
+    def set_target_bitrate(self, bitrate_kbps: int):
+        if not self.qos_requested:
+            # The first cut means the link is struggling, have the host mark its packets for QoS too
+            self.qos_requested = True
+            self.send_reliable(k_EStreamControlSetQoS, CSetQoSMsg(use_qos=True))
+        self.send_reliable(k_EStreamControlSetTargetBitrate, CSetTargetBitrateMsg(bitrate=bitrate_kbps))
+        self.client.on_bitrate_changed(bitrate_kbps)
+
+    def set_target_framerate(self, framerate: int):
+        self.send_reliable(k_EStreamControlSetTargetFramerate, CSetTargetFramerateMsg(framerate=framerate))
+
+    def poll(self, now: float) -> float:
+        deadline = super().poll(now)
+        if self.abr:
+            self.abr.poll(now)
+            deadline = min(deadline, self.abr.next_deadline)
+        return deadline
+
+    def collect_metrics(self) -> Iterable[Sample]:
+        samples = list(super().collect_metrics())
+        if self.abr:
+            labels = tuple(self.metric_labels.items())
+            samples += stats_samples('steamlink_abr', self.abr.stats, labels)
+            samples.append(('steamlink_abr_bitrate_kbps', labels, self.abr.bitrate_kbps))
+            samples.append(('steamlink_abr_framerate', labels, self.abr.framerate))
+        return samples
+
     def frame_should_encrypt(self, msg_type: int) -> bool:
         return msg_type not in [k_EStreamControlClientHandshake, k_EStreamControlServerHandshake,
                                 k_EStreamControlAuthenticationRequest, k_EStreamControlAuthenticationResponse]
 
+    def message_priority(self, msg_type: int) -> SendPriority:
+        return SendPriority.INPUT if msg_type in INPUT_MESSAGES else self.send_priority
+
     async def heartbeat_task(self):
         while not self.client.closed:
             message = CKeepAliveMsg()
@@ -182,3 +266,15 @@ class Control(Channel):
     def start_heartbeat(self):
         loop = self.client.loop
         loop.call_later(7, self.heartbeat_task)
+
+
+def probed_bitrates(probe: Optional[ProbeResult]) -> tuple[int, int]:
+    """
+    Decode and burst bitrate caps in kbps for a link probe result, or the decoder's limits without one.
+    """
+    if not probe or not probe.ok or math.isnan(probe.bandwidth_kbps):
+        return MAX_DECODE_BITRATE_KBPS, MAX_BURST_BITRATE_KBPS
+    usable = probe.bandwidth_kbps * (1 - probe.loss)
+    decode = int(min(max(usable * PROBE_BITRATE_SHARE, MIN_DECODE_BITRATE_KBPS), MAX_DECODE_BITRATE_KBPS))
+    burst = int(min(max(usable, decode), MAX_BURST_BITRATE_KBPS))
+    return decode, burst
@@ -1,16 +1,34 @@
-from typing import Optional
+import math
 
-from protobuf.steammessages_remoteplay_pb2 import k_EStreamDataPacket
+from typing import Iterable, Optional, Tuple, Union
+
+from protobuf.steammessages_remoteplay_pb2 import k_EStreamDataPacket, k_EStreamingVideoData
+from session.abr import StreamCounters
 from session.channels.base import Channel
-from session.frame import Frame, DataFrameHeader, FRAME_HEADER_LENGTH
+from session.client import Client
+from session.frame import Frame, DataFrameHeader, FRAME_HEADER_LENGTH, frame_timestamp, frame_timestamp_from_secs
+from session.framestats import FrameStatsRecorder
+from session.jitter import JitterBuffer
+from session.metrics import Sample, stats_samples
 from session.packet import PacketType
 
 
 class Data(Channel):
+    data_type: int = k_EStreamingVideoData
+    jitter_min_delay: float = 0.0
+    jitter_max_delay: float = 0.0
+
+    def __init__(self, client: Client, channel: int):
+        super().__init__(client, channel)
+        self.jitter_buffer: JitterBuffer[Tuple[DataFrameHeader, Union[bytes, bytearray]]] = \
+            JitterBuffer(self.release_data, self.jitter_min_delay, self.jitter_max_delay)
+        self.received_bytes = 0
+        self.frame_stats: FrameStatsRecorder = FrameStatsRecorder(self.data_type)
 
     def handle_frame(self, frame: Frame):
         if frame.header.pkt_type != PacketType.UNRELIABLE:
             return
+        self.received_bytes += len(frame.body)
         payload_type = frame.body[0]
         payload = frame.body[1:]
         if payload_type != k_EStreamDataPacket:
@@ -19,7 +37,51 @@ class Data(Channel):
         if len(payload) > FRAME_HEADER_LENGTH:
             header = DataFrameHeader.parse(payload)
             payload = payload[FRAME_HEADER_LENGTH:]
+        if header is None:
+            self.handle_data(header, payload)
+            return
+        if isinstance(payload, memoryview):
+            # Single packet frames still point into the receive ring, which is reused before they play out
+            payload = bytes(payload)
+        completed = frame_timestamp()
+        # The assembler's clock is time.monotonic, the same one frame timestamps are taken from
+        started = frame_timestamp_from_secs(frame.started) if not math.isnan(frame.started) else completed
+        self.frame_stats.received(header.id, len(payload), started, completed)
+        jitter = self.jitter_buffer
+        late = jitter.stats.late
+        jitter.push(header.id, frame.header.send_timestamp, (header, payload))
+        if jitter.stats.late != late:
+            self.frame_stats.dropped_late(header.id)
+        else:
+            # How much longer than the fastest frames this one took
+            self.frame_stats.add_network_time(max(0.0, jitter.last_transit - jitter.base_transit))
+
+    def release_data(self, data: Tuple[DataFrameHeader, Union[bytes, bytearray]]):
+        header, payload = data
+        self.frame_stats.decode_begin(header.id, frame_timestamp())
         self.handle_data(header, payload)
+        self.frame_stats.decode_end(header.id, frame_timestamp())
 
     def handle_data(self, header: Optional[DataFrameHeader], payload: bytes):
         pass
+
+    def stream_counters(self) -> StreamCounters:
+        jitter = self.jitter_buffer.stats
+        assembler = self.frame_assembler.stats
+        return StreamCounters(frames=jitter.released, lost=jitter.skipped, late=jitter.late,
+                              expired=assembler.expired_frames + assembler.dropped_frames, bytes=self.received_bytes)
+
+    def collect_metrics(self) -> Iterable[Sample]:
+        samples = list(super().collect_metrics())
+        labels = tuple(self.metric_labels.items())
+        samples += stats_samples('steamlink_jitter', self.jitter_buffer.stats, labels)
+        frame_stats = self.frame_stats
+        samples.append(('steamlink_frames_displayed', labels, frame_stats.displayed))
+        samples.append(('steamlink_frames_lost', labels, frame_stats.lost))
+        samples.append(('steamlink_frames_late', labels, frame_stats.late))
+        samples.append(('steamlink_data_received_bytes', labels, self.received_bytes))
+        return samples
+
+    def poll(self, now: float) -> float:
+        self.jitter_buffer.poll(now)
+        return min(super().poll(now), self.jitter_buffer.next_deadline)
@@ -1,23 +1,68 @@
+from typing import Iterable, Optional
+
 from protobuf.steammessages_remoteplay_pb2 import k_EStreamDiscoveryPingRequest, CDiscoveryPingRequest, \
     CDiscoveryPingResponse, k_EStreamDiscoveryPingResponse
 from session.channels.base import Channel
+from session.client import Client
+from session.metrics import Sample
 from session.packet import Packet, PacketType
+from session.probe import LinkProbe
+from session.scheduler import SendPriority
 
 
 class Discovery(Channel):
+    send_priority = SendPriority.DISCOVERY
+
+    def __init__(self, client: Client, channel: int):
+        super().__init__(client, channel)
+        self.probe: Optional[LinkProbe] = None
+
     def handle_packet(self, packet: Packet):
         header = packet.header
         payload = packet.body
+        self.packets_received.inc()
         if header.pkt_type == PacketType.UNCONNECTED:
             self.on_unconnected(payload[0], packet.size, payload[1:])
 
     def on_unconnected(self, msg_type: int, pkt_size: int, payload: bytes):
-        if msg_type != k_EStreamDiscoveryPingRequest:
-            print(f'Unrecognized unconnected packet {msg_type}')
-            return
         msg_size = int.from_bytes(payload[0:4], byteorder='little', signed=True)
-        req: CDiscoveryPingRequest = CDiscoveryPingRequest()
-        req.ParseFromString(payload[4:4 + msg_size])
+        if msg_type == k_EStreamDiscoveryPingRequest:
+            req: CDiscoveryPingRequest = CDiscoveryPingRequest()
+            req.ParseFromString(payload[4:4 + msg_size])
+
+            resp = CDiscoveryPingResponse(sequence=req.sequence, packet_size_received=pkt_size)
+            self.send_unconnected(k_EStreamDiscoveryPingResponse, resp.SerializeToString(), req.packet_size_requested)
+        elif msg_type == k_EStreamDiscoveryPingResponse:
+            resp: CDiscoveryPingResponse = CDiscoveryPingResponse()
+            resp.ParseFromString(payload[4:4 + msg_size])
+            if self.probe:
+                self.probe.on_response(resp.sequence)
+        else:
+            print(f'Unrecognized unconnected packet {msg_type}')
+
+    def collect_metrics(self) -> Iterable[Sample]:
+        samples = list(super().collect_metrics())
+        result = self.probe.result if self.probe else None
+        if result is not None:
+            labels = tuple(self.metric_labels.items())
+            samples.append(('steamlink_probe_loss', labels, result.loss))
+            samples.append(('steamlink_probe_rtt_min_seconds', labels, result.rtt_min))
+            samples.append(('steamlink_probe_bandwidth_kbps', labels, result.bandwidth_kbps))
+            samples.append(('steamlink_probe_path_mtu', labels, result.path_mtu))
+        return samples
+
+    def start_probe(self) -> LinkProbe:
+        self.probe = LinkProbe(self.send_ping)
+        self.probe.start()
+        return self.probe
+
+    def send_ping(self, sequence: int, packet_size_requested: int, pad_to: int):
+        req = CDiscoveryPingRequest(sequence=sequence, packet_size_requested=packet_size_requested)
+        self.send_unconnected(k_EStreamDiscoveryPingRequest, req.SerializeToString(), pad_to)
 
-        resp = CDiscoveryPingResponse(sequence=req.sequence, packet_size_received=pkt_size)
-        self.send_unconnected(k_EStreamDiscoveryPingResponse, resp.SerializeToString(), req.packet_size_requested)
+    def poll(self, now: float) -> float:
+        deadline = super().poll(now)
+        if self.probe:
+            self.probe.poll(now)
+            deadline = min(deadline, self.probe.next_deadline)
+        return deadline
@@ -1,5 +1,60 @@
+import math
+
+from protobuf.steammessages_remoteplay_pb2 import CStreamingSessionStats, k_EStreamStatsFrameEvents
 from session.channels.base import Channel
+from session.client import Client
+from session.framestats import FrameStatsRecorder, FRAME_STATS_INTERVAL, session_stats
+from session.scheduler import SendPriority
 
 
 class Stats(Channel):
-    pass
+    """
+    Reports how the data channels' frames fared to the host, which tunes its encoder by them.
+    """
+    send_priority = SendPriority.STATS
+
+    def __init__(self, client: Client, channel: int, interval: float = FRAME_STATS_INTERVAL):
+        super().__init__(client, channel)
+        self.interval = interval
+        self.recorders: list[FrameStatsRecorder] = []
+        # Every stream reported this session, including the ones that have stopped
+        self.session_recorders: list[FrameStatsRecorder] = []
+        self.next_report = -math.inf
+
+    def add_recorder(self, recorder: FrameStatsRecorder):
+        self.recorders.append(recorder)
+        self.session_recorders.append(recorder)
+
+    def remove_recorder(self, recorder: FrameStatsRecorder):
+        if recorder in self.recorders:
+            self.send_frame_stats(recorder)
+            self.recorders.remove(recorder)
+
+    def poll(self, now: float) -> float:
+        deadline = super().poll(now)
+        if now >= self.next_report:
+            if not math.isinf(self.next_report):
+                for recorder in self.recorders:
+                    self.send_frame_stats(recorder)
+            self.next_report = now + self.interval
+        return min(deadline, self.next_report)
+
+    def send_frame_stats(self, recorder: FrameStatsRecorder, accumulated: bool = False):
+        message = recorder.collect()
+        if accumulated:
+            if message is None:
+                message = recorder.empty_message()
+            message.accumulated_stats.extend(recorder.accumulated())
+        if message is not None:
+            self.send_reliable(k_EStreamStatsFrameEvents, message)
+
+    def send_session_stats(self) -> CStreamingSessionStats:
+        """
+        Report what's left of every stream along with its totals, on the way out of the session.
+        """
+        for recorder in self.recorders:
+            self.send_frame_stats(recorder, accumulated=True)
+        stats = session_stats(self.session_recorders)
+        print(f'Session frame loss {stats.frame_loss_percentage:.1f}%, network time '
+              f'{stats.average_network_time_ms:.1f} ms (stddev {stats.stddev_network_time_ms:.1f} ms)')
+        return stats
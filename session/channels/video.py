@@ -1,13 +1,18 @@
 import struct
 
 from dataclasses import dataclass
-from typing import Optional
+from typing import Optional, Tuple, Union
 
-from protobuf.steammessages_remoteplay_pb2 import CStartVideoDataMsg
-from service.ccrypto import symmetric_decrypt_with_iv
+from protobuf.steammessages_remoteplay_pb2 import CStartVideoDataMsg, k_EStreamingVideoData
+from service.ccrypto import ZERO_IV, symmetric_key
 from session.channels.data import Data
 from session.client import Client
-from session.frame import DataFrameHeader
+from session.decrypt import DecryptPool
+from session.frame import DataFrameHeader, frame_timestamp
+from session.jitter import VIDEO_MIN_DELAY, VIDEO_MAX_DELAY
+from session.metrics import REGISTRY
+
+VIDEO_HEADER_LENGTH = 7
 
 
 @dataclass
@@ -23,17 +28,74 @@ class VideoFrameHeader:
 
     @classmethod
     def parse(cls, data: bytes):
-        return VideoFrameHeader(*struct.unpack('<HBHH', data[:7]))
+        return VideoFrameHeader(*struct.unpack_from('<HBHH', data))
 
 
 class Video(Data):
+    data_type = k_EStreamingVideoData
+    jitter_min_delay = VIDEO_MIN_DELAY
+    jitter_max_delay = VIDEO_MAX_DELAY
 
-    def __init__(self, client: Client, message: CStartVideoDataMsg):
+    def __init__(self, client: Client, message: CStartVideoDataMsg, decrypt_workers: int = 0):
         super().__init__(client, message.channel)
+        self.decrypt_failures = REGISTRY.counter('steamlink_decrypt_failures', 'Messages and frames that failed to '
+                                                 'decrypt', **self.metric_labels)
+        self.key = symmetric_key(client.auth_token)
+        # Frames are decrypted into the same buffer every time, grown as needed
+        self.decrypt_buffer = bytearray()
+        # Encrypted frames are decrypted off the receiving thread when there are workers for it
+        self.decrypt_pool: Optional[DecryptPool[Tuple[Optional[DataFrameHeader], VideoFrameHeader]]] = None
+        if decrypt_workers:
+            self.decrypt_pool = DecryptPool(self.key, ZERO_IV, self.on_decrypted, decrypt_workers,
+                                            on_error=self.on_decrypt_failed)
+
+    def release_data(self, data: Tuple[DataFrameHeader, Union[bytes, bytearray]]):
+        if self.decrypt_pool is None:
+            super().release_data(data)
+            return
+        # The frame is only queued for the pool here, its decode ends once the worker has handled it
+        header, payload = data
+        self.frame_stats.decode_begin(header.id, frame_timestamp())
+        self.handle_data(header, payload)
 
     def handle_data(self, header: Optional[DataFrameHeader], payload: bytes):
         vheader = VideoFrameHeader.parse(payload)
-        encrypted = vheader.flags & 0x20
-        data = payload[7:]
-        if encrypted:
-            data = symmetric_decrypt_with_iv(data, bytes(0 for _ in range(0, 16)), self.client.auth_token)
+        data = memoryview(payload)[VIDEO_HEADER_LENGTH:]
+        if self.decrypt_pool:
+            # Plain frames go through the pool as well, or they'd overtake the encrypted ones still decrypting
+            self.decrypt_pool.submit((header, vheader), data, vheader.encrypted)
+            return
+        if vheader.encrypted:
+            if len(self.decrypt_buffer) < len(data):
+                self.decrypt_buffer = bytearray(len(data))
+            try:
+                data = self.key.decrypt_into(data, ZERO_IV, memoryview(self.decrypt_buffer)[:len(data)])
+            except ValueError:
+                self.decrypt_failures.inc()
+                return
+        self.handle_video(vheader, data)
+
+    def handle_video(self, header: VideoFrameHeader, data: memoryview):
+        """
+        A whole video frame, decrypted. `data` is only valid during the call. With a decryption pool this runs on
+        its workers, one frame at a time and still in order.
+        """
+        pass
+
+    def on_decrypted(self, tag: Tuple[Optional[DataFrameHeader], VideoFrameHeader], data: memoryview):
+        header, vheader = tag
+        self.handle_video(vheader, data)
+        self.decoded(header)
+
+    def on_decrypt_failed(self, tag: Tuple[Optional[DataFrameHeader], VideoFrameHeader]):
+        self.decrypt_failures.inc()
+        self.decoded(tag[0])
+
+    def decoded(self, header: Optional[DataFrameHeader]):
+        # Done with the frame as far as the pool goes, the stats never leave a frame pending
+        if header is not None:
+            self.frame_stats.decode_end(header.id, frame_timestamp())
+
+    def close(self):
+        if self.decrypt_pool:
+            self.decrypt_pool.close()
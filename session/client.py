@@ -1,6 +1,13 @@
 from asyncio import AbstractEventLoop
 
+from typing import Callable, Optional
+
 from session.packet import PacketType
+from session.probe import ProbeResult
+from session.scheduler import SendPriority
+
+# Used until the host tells us the MTU in its handshake
+DEFAULT_MTU = 1200
 
 
 class Client:
@@ -8,6 +15,9 @@ class Client:
     def __init__(self, loop: AbstractEventLoop):
         self.closed: bool = False
         self.loop: AbstractEventLoop = loop
+        self.mtu: int = DEFAULT_MTU
+        # Threads decrypting video frames, 0 to decrypt them as they arrive
+        self.decrypt_workers: int = 0
 
     def on_connected(self, conn_id: int, timestamp: int):
         pass
@@ -16,5 +26,12 @@ class Client:
         pass
 
     def send_packet(self, has_crc: bool, pkt_type: PacketType, pkt_id: int, channel: int, payload: bytes = b'',
-                    pad_to: int = 0):
+                    pad_to: int = 0, retransmit_count: int = 0, fragment_id: int = 0,
+                    priority: SendPriority = SendPriority.CONTROL):
         pass
+
+    def on_bitrate_changed(self, bitrate_kbps: int):
+        pass
+
+    def after_link_probe(self, callback: Callable[[Optional[ProbeResult]], None]):
+        callback(None)
@@ -1,16 +1,19 @@
-import errno
 import socket
 import subprocess
 import sys
+import threading
+import time
 from concurrent.futures import ThreadPoolExecutor
 
 import asyncio
 import crc32c
 import secrets
 from asyncio import AbstractEventLoop
+from typing import Callable, Iterable, List, Optional, Union
 
 from session.channels.base import Channel
 from session.channels.control import Control
+from session.channels.data import Data
 from session.channels.discovery import Discovery
 from session.channels.stats import Stats
 from protobuf.steammessages_remoteclient_discovery_pb2 import EStreamTransport
@@ -19,8 +22,13 @@ from protobuf.steammessages_remoteplay_pb2 import k_EStreamChannelDiscovery, k_E
     k_EStreamChannelStats
 from service.common import get_steamid
 from session.client import Client
+from session.clock import ClockSync
 from session.frame import Frame, frame_timestamp
-from session.packet import PacketHeader, Packet, PacketType
+from session.metrics import REGISTRY, Sample, stats_samples
+from session.packet import PacketHeader, Packet, PacketType, CONNECTION_TYPES, PACKET_HEADER_LENGTH
+from session.probe import ProbeResult
+from session.receiver import receive_loop
+from session.scheduler import SendPriority, SendScheduler
 
 streaming_client = '/home/pi/.local/share/SteamLink/bin/streaming_client'
 ld_library_path = '/home/pi/.local/share/SteamLink/lib'
@@ -44,38 +52,40 @@ async def session_run_command(ip: str, port: int, transport: int, session_key: b
     return await proc.wait()
 
 
-async def session_run(ip: str, port: int, transport: int, session_key: bytes) -> int:
+async def session_run(ip: str, port: int, transport: int, session_key: bytes, decrypt_workers: int = 0) -> int:
     loop = asyncio.get_event_loop()
     with ThreadPoolExecutor(max_workers=1) as executor:
-        await loop.run_in_executor(executor, lambda: session_worker(loop, (ip, port), session_key))
+        await loop.run_in_executor(executor, lambda: session_worker(loop, (ip, port), session_key, decrypt_workers))
     return 0
 
 
-def session_worker(loop: AbstractEventLoop, host_address: tuple[str, int], auth_token: bytes):
+def session_worker(loop: AbstractEventLoop, host_address: tuple[str, int], auth_token: bytes,
+                   decrypt_workers: int = 0):
     sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
     sock.setblocking(False)
-    client = ClientImpl(loop, sock, host_address, auth_token)
-    while not client.closed:
-        try:
-            data, _ = sock.recvfrom(2048)
-        except socket.error as e:
-            err = e.args[0]
-            if err == errno.EAGAIN or err == errno.EWOULDBLOCK:
-                continue
-            else:
-                raise e
-        else:
-            client.handle_packet(data)
+    if hasattr(socket, 'IP_MTU_DISCOVER'):
+        # Don't let the kernel fragment, so the link probe sees which sizes really get through
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MTU_DISCOVER, socket.IP_PMTUDISC_DO)
+    client = ClientImpl(loop, sock, host_address, auth_token, decrypt_workers)
+    receive_loop(sock, client)
+    for channel in client.channels.values():
+        channel.close()
 
 
 class ClientImpl(Client):
 
-    def __init__(self, loop: AbstractEventLoop, sock: socket.socket, addr: tuple[str, int], auth_token: bytes):
+    def __init__(self, loop: AbstractEventLoop, sock: socket.socket, addr: tuple[str, int], auth_token: bytes,
+                 decrypt_workers: int = 0):
         super().__init__(loop)
         self.sock = sock
         self.closed = False
         self.addr = addr
         self.auth_token = auth_token
+        self.decrypt_workers = decrypt_workers
+        self.sender = SendScheduler(self.send_datagram)
+        self.clock_sync = ClockSync()
+        # Sends from the worker are flushed once per wakeup, any other thread flushes its own right away
+        self.worker_thread = threading.get_ident()
         self.src_conn_id = 1 + secrets.randbelow(255)
         self.dst_conn_id = 0
         self.connect_timestamp = 0
@@ -87,57 +97,137 @@ class ClientImpl(Client):
             k_EStreamChannelStats: Stats(self, k_EStreamChannelStats),
         }
         self.connection_channel: Channel = Connection(self, k_EStreamChannelDiscovery)
+        self.packets_received = REGISTRY.counter('steamlink_packets_received', 'Datagrams received from the host')
+        self.bytes_received = REGISTRY.counter('steamlink_received_bytes', 'Bytes received from the host')
+        self.bad_crc_packets = REGISTRY.counter('steamlink_bad_crc_packets', 'Datagrams dropped for a bad CRC')
+        self.invalid_packets = REGISTRY.counter('steamlink_invalid_packets',
+                                                'Datagrams dropped for being too short, of an unknown type or '
+                                                'for an unknown channel')
+        self.unmatched_packets = REGISTRY.counter('steamlink_unmatched_connection_packets',
+                                                  'Datagrams dropped for another connection ID')
+        self.packets_sent = REGISTRY.counter('steamlink_packets_sent', 'Datagrams sent to the host')
+        self.bytes_sent = REGISTRY.counter('steamlink_sent_bytes', 'Bytes sent to the host')
+        self.send_errors = REGISTRY.counter('steamlink_send_errors', 'Datagrams the socket refused')
+        REGISTRY.add_collector(self.collect_metrics)
         self.connect()
 
-    def handle_packet(self, data: bytes):
+    def handle_packet(self, data: Union[bytes, memoryview]):
+        self.packets_received.inc()
+        self.bytes_received.inc(len(data))
+        if len(data) < PACKET_HEADER_LENGTH:
+            self.invalid_packets.inc()
+            return
         packet = Packet.parse(data)
         header = packet.header
+        # Nothing in a corrupt datagram can be trusted, the type included
         if packet.crc_ok is False:
+            self.bad_crc_packets.inc()
             print('Bad CRC! dropping.')
             return
-        elif header.pkt_type != PacketType.UNCONNECTED and header.dst_conn_id != self.src_conn_id:
+        try:
+            pkt_type = header.pkt_type
+        except ValueError:
+            self.invalid_packets.inc()
+            print(f'Unknown packet type {header.type_and_crc & 0x7F}! dropping.')
+            return
+        if pkt_type != PacketType.UNCONNECTED and header.dst_conn_id != self.src_conn_id:
+            self.unmatched_packets.inc()
             print(f'Unmatched connection ID: {header.dst_conn_id}! expect {self.src_conn_id}. dropping.')
             return
+        self.clock_sync.add_sample(header.send_timestamp)
 
-        if header.pkt_type in [PacketType.CONNECT, PacketType.CONNECT_ACK, PacketType.DISCONNECT]:
+        if pkt_type in CONNECTION_TYPES:
             self.connection_channel.handle_packet(packet)
-        else:
-            self.channels[header.channel].handle_packet(packet)
+            return
+        channel = self.channels.get(header.channel)
+        if channel is None:
+            self.invalid_packets.inc()
+            return
+        channel.handle_packet(packet)
 
     def send_packet(self, has_crc: bool, pkt_type: PacketType, pkt_id: int, channel: int, payload: bytes = b'',
-                    pad_to: int = 0):
+                    pad_to: int = 0, retransmit_count: int = 0, fragment_id: int = 0,
+                    priority: SendPriority = SendPriority.CONTROL):
         send_timestamp = frame_timestamp()
         header = PacketHeader()
         header.has_crc = has_crc
         header.pkt_type = pkt_type
-        header.retransmit_count = 0
+        header.retransmit_count = retransmit_count
         header.src_conn_id = self.src_conn_id
         header.dst_conn_id = self.dst_conn_id
         header.channel = channel
-        header.fragment_id = 0
+        header.fragment_id = fragment_id
         header.pkt_id = pkt_id
         header.send_timestamp = send_timestamp
         packet = Packet(header, payload)
-        self.sock.sendto(packet.serialize(pad_to), self.addr)
+        self.sender.enqueue(priority, packet.serialize(pad_to))
+        if threading.get_ident() != self.worker_thread:
+            self.sender.flush()
+
+    def send_datagram(self, data: bytearray):
+        try:
+            self.sock.sendto(data, self.addr)
+        except OSError as e:
+            self.send_errors.inc()
+            print(f'Failed to send {len(data)} bytes: {e}')
+            return
+        self.packets_sent.inc()
+        self.bytes_sent.inc(len(data))
+
+    def poll(self) -> float:
+        now = time.monotonic()
+        deadline = self.connection_channel.poll(now)
+        for channel in list(self.channels.values()):
+            deadline = min(deadline, channel.poll(now))
+        self.sender.flush(now)
+        return min(deadline, self.sender.next_deadline) - now
+
+    def collect_metrics(self) -> Iterable[Sample]:
+        samples: List[Sample] = []
+        for priority, stats in zip(SendPriority, self.sender.stats):
+            samples += stats_samples('steamlink_send', stats, (('priority', priority.name.lower()),))
+        samples.append(('steamlink_send_bitrate_kbps', (), self.sender.bucket.rate / 125))
+        clock_sync = self.clock_sync
+        samples += stats_samples('steamlink_clock_sync', clock_sync.stats, ())
+        if clock_sync.synced:
+            samples.append(('steamlink_clock_drift_ppm', (), clock_sync.drift))
+        samples.append(('steamlink_mtu', (), self.mtu))
+        return samples
+
+    def on_bitrate_changed(self, bitrate_kbps: int):
+        self.sender.set_bitrate(bitrate_kbps)
 
     def on_connected(self, conn_id: int, timestamp: int):
         self.dst_conn_id = conn_id
         self.connect_timestamp = timestamp
+        self.channels[k_EStreamChannelDiscovery].start_probe()
         self.handshake(conn_id, timestamp)
 
+    def after_link_probe(self, callback: Callable[[Optional[ProbeResult]], None]):
+        probe = self.channels[k_EStreamChannelDiscovery].probe
+        if probe is None:
+            callback(None)
+        else:
+            probe.when_done(callback)
+
     def on_disconnect(self):
         self.closed = True
 
     def add_channel(self, channel: int, handler: Channel):
         self.channels[channel] = handler
+        if isinstance(handler, Data):
+            self.channels[k_EStreamChannelStats].add_recorder(handler.frame_stats)
 
     def remove_channel_by_index(self, channel: int):
-        del self.channels[channel]
+        handler = self.channels.pop(channel)
+        handler.close()
+        if isinstance(handler, Data):
+            self.channels[k_EStreamChannelStats].remove_recorder(handler.frame_stats)
 
     def remove_channel_by_type(self, handler_type: type(Channel)):
         channel_to_remove = -1
         for channel in self.channels:
-            if self.channels[channel] is handler_type:
+            if isinstance(self.channels[channel], handler_type):
                 channel_to_remove = channel
                 break
         if channel_to_remove != -1:
@@ -146,13 +236,16 @@ class ClientImpl(Client):
     def connect(self):
         body = int.to_bytes(crc32c.crc32c(b'Connect'), 4, byteorder='little', signed=False)
         pkt_id = self.connection_channel.next_pkt_id()
-        self.connection_channel.send_packet(False, PacketType.CONNECT, pkt_id, body)
+        self.connection_channel.send_tracked(False, PacketType.CONNECT, pkt_id, body)
 
     def handshake(self, conn_id: int, timestamp: int):
         self.channels[k_EStreamChannelControl].send_reliable(k_EStreamControlClientHandshake,
                                                              CClientHandshakeMsg(info=CStreamingClientHandshakeInfo()))
 
     def hangup(self):
+        self.channels[k_EStreamChannelStats].send_session_stats()
+        # The stats are queued behind the disconnect by priority, so get them out first
+        self.sender.flush()
         self.connection_channel.send_packet(True, PacketType.DISCONNECT, 0)
 
 
@@ -171,7 +264,7 @@ class Connection(Channel):
             self.client.on_disconnect()
 
     def on_connect_ack(self, pkt_id: int, conn_id: int, timestamp: int):
-        if pkt_id not in self.sent_packets:
+        self.retransmits.acknowledge(pkt_id)
+        if not self.sent_packets.release(pkt_id):
             return
-        self.sent_packets.remove(pkt_id)
         self.client.on_connected(conn_id, timestamp)
@@ -0,0 +1,171 @@
+import math
+import time
+
+from collections import deque
+from dataclasses import dataclass
+from typing import Callable, Deque, Optional, Tuple
+
+TIMESTAMP_UNITS = 65536
+# Offsets are fitted through the lowest one seen in each interval, over the last few of them
+CLOCK_SYNC_INTERVAL = 1.0
+CLOCK_SYNC_WINDOW = 64
+# A sample this far under the fitted line is taken as an outlier, and this many in a row as a host clock step
+OUTLIER_THRESHOLD = 0.01
+MAX_OUTLIERS = 16
+
+
+class TimestampUnwrapper:
+    """
+    Turns 32-bit timestamps into ones that keep counting past 2^32, assuming consecutive calls are less than
+    half a wrap apart (about 9 hours in 1/65536 s units).
+    """
+
+    def __init__(self):
+        self.last = -1
+        self.value = 0
+
+    def unwrap(self, timestamp: int) -> int:
+        self.value = self.peek(timestamp)
+        self.last = timestamp
+        return self.value
+
+    def peek(self, timestamp: int) -> int:
+        """
+        Unwrap `timestamp` relative to the last one, without moving on from it.
+        """
+        if self.last < 0:
+            return timestamp
+        delta = (timestamp - self.last) & 0xFFFFFFFF
+        if delta & 0x80000000:
+            delta -= 0x100000000
+        return self.value + delta
+
+
+@dataclass
+class ClockSyncStats:
+    samples: int = 0
+    outliers: int = 0
+    resets: int = 0
+    jitter: float = 0.0
+
+
+class ClockSync:
+    """
+    Relates the host's packet timestamps to our monotonic clock.
+
+    Every sample is (our receive time - host send time), the clock offset plus that packet's one way delay. The
+    least delayed samples sit on a line whose intercept is the offset plus the path's minimum delay and whose slope
+    is the drift between the clocks, so that's the line fitted. Delays computed against it are the part over the
+    minimum, which is what queues and jitter add.
+    """
+
+    def __init__(self, clock: Callable[[], float] = time.monotonic, interval: float = CLOCK_SYNC_INTERVAL,
+                 window: int = CLOCK_SYNC_WINDOW):
+        self.clock = clock
+        self.interval = interval
+        self.stats = ClockSyncStats()
+        self.unwrapper = TimestampUnwrapper()
+        self.minima: Deque[Tuple[float, float]] = deque(maxlen=window)
+        self.bucket_end = -math.inf
+        self.bucket_time = 0.0
+        self.bucket_offset = math.inf
+        self.reference = 0.0
+        self.intercept = math.nan
+        self.slope = 0.0
+        self.consecutive_outliers = 0
+        self.last_offset = math.nan
+
+    @property
+    def synced(self) -> bool:
+        return not math.isnan(self.intercept)
+
+    @property
+    def drift(self) -> float:
+        """
+        How much faster our clock runs than the host's, in parts per million.
+        """
+        return self.slope * 1e6
+
+    def offset(self, local_time: float) -> float:
+        """
+        Local time minus host time at `local_time`, including the minimum one way delay.
+        """
+        return self.intercept + self.slope * (local_time - self.reference)
+
+    def add_sample(self, host_timestamp: int, local_time: Optional[float] = None):
+        if local_time is None:
+            local_time = self.clock()
+        host_time = self.unwrapper.unwrap(host_timestamp) / TIMESTAMP_UNITS
+        sample = local_time - host_time
+        stats = self.stats
+        stats.samples += 1
+        if not math.isnan(self.last_offset):
+            stats.jitter += (abs(sample - self.last_offset) - stats.jitter) / 16
+        self.last_offset = sample
+        if self.synced and sample < self.offset(local_time) - OUTLIER_THRESHOLD:
+            self.consecutive_outliers += 1
+            stats.outliers += 1
+            if self.consecutive_outliers < MAX_OUTLIERS:
+                return
+            self.reset()
+            stats.resets += 1
+        self.consecutive_outliers = 0
+        if local_time >= self.bucket_end:
+            self.close_bucket()
+            self.bucket_end = local_time + self.interval
+        if sample < self.bucket_offset:
+            self.bucket_time = local_time
+            self.bucket_offset = sample
+            if len(self.minima) < 2:
+                # Until there are two intervals to fit through, go by the best sample so far
+                self.reference = local_time
+                self.intercept = min(sample, self.intercept) if self.synced else sample
+
+    def close_bucket(self):
+        if math.isinf(self.bucket_offset):
+            return
+        self.minima.append((self.bucket_time, self.bucket_offset))
+        self.bucket_offset = math.inf
+        if len(self.minima) >= 2:
+            self.fit()
+
+    def fit(self):
+        minima = self.minima
+        count = len(minima)
+        reference = sum(t for t, _ in minima) / count
+        mean = sum(offset for _, offset in minima) / count
+        variance = sum((t - reference) ** 2 for t, _ in minima)
+        covariance = sum((t - reference) * (offset - mean) for t, offset in minima)
+        self.reference = reference
+        self.slope = covariance / variance if variance > 0 else 0.0
+        self.intercept = mean
+
+    def reset(self):
+        self.minima.clear()
+        self.bucket_end = -math.inf
+        self.bucket_offset = math.inf
+        self.intercept = math.nan
+        self.slope = 0.0
+        self.consecutive_outliers = 0
+
+    def to_local(self, host_timestamp: int) -> float:
+        """
+        Our monotonic time matching a host timestamp, shifted by the minimum one way delay.
+        """
+        host_time = self.unwrapper.peek(host_timestamp) / TIMESTAMP_UNITS
+        # Solve local = host + intercept + slope * (local - reference)
+        return (host_time + self.intercept - self.slope * self.reference) / (1 - self.slope)
+
+    def one_way_delay(self, host_timestamp: int, local_time: Optional[float] = None) -> float:
+        """
+        How much longer than the fastest packets one sent at `host_timestamp` and received at `local_time` took.
+        """
+        if local_time is None:
+            local_time = self.clock()
+        return local_time - self.to_local(host_timestamp)
+
+    def age(self, host_timestamp: int, now: Optional[float] = None) -> float:
+        """
+        Time since the host sent something stamped `host_timestamp`, over the minimum one way delay.
+        """
+        return self.one_way_delay(host_timestamp, now)
@@ -0,0 +1,140 @@
+import threading
+import traceback
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Callable, Deque, Generic, List, Optional, TypeVar, Union
+
+from service.ccrypto import SymmetricKey
+
+# Frames submitted and not yet emitted, per worker, before submit() waits
+IN_FLIGHT_PER_WORKER = 2
+
+T = TypeVar('T')
+
+
+@dataclass
+class DecryptPoolStats:
+    submitted: int = 0
+    emitted: int = 0
+    failed: int = 0
+    # Times submit() had to wait for the oldest frame to come out
+    stalls: int = 0
+
+
+class PendingFrame(Generic[T]):
+    __slots__ = ('tag', 'encrypted', 'buffer', 'data', 'done')
+
+    def __init__(self, tag: T, encrypted: Union[bytes, bytearray, memoryview], buffer: Optional[bytearray]):
+        self.tag = tag
+        self.encrypted = encrypted
+        # None for frames passed through as they are
+        self.buffer = buffer
+        # None if it didn't decrypt
+        self.data: Optional[memoryview] = None
+        self.done = False
+
+
+class DecryptPool(Generic[T]):
+    """
+    Decrypts frames on worker threads and hands them to `sink` in the order they were submitted. pycryptodome
+    releases the GIL while the cipher runs, so the workers really do decrypt in parallel, and the thread receiving
+    packets only pays for queueing the frame.
+
+    At most `max_in_flight` frames are between submit() and the sink, past that submit() waits for the oldest one,
+    so a slow sink slows the receiver down rather than piling frames up. The sink is called by whichever worker
+    completes the frame next in order, one call at a time, with the decrypted payload as a view into a buffer that
+    is reused once the call returns. Frames that fail to decrypt go to `on_error` instead, in the same order.
+    Frames that aren't encrypted can be submitted too, so they come out in order with the rest.
+    """
+
+    def __init__(self, key: SymmetricKey, iv: bytes, sink: Callable[[T, memoryview], None], workers: int,
+                 max_in_flight: int = 0, on_error: Optional[Callable[[T], None]] = None):
+        self.key = key
+        self.iv = iv
+        self.sink = sink
+        self.on_error = on_error
+        self.max_in_flight = max_in_flight or workers * IN_FLIGHT_PER_WORKER
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='decrypt')
+        self.slots = threading.Semaphore(self.max_in_flight)
+        # Guards the order and the free buffers, held only briefly
+        self.lock = threading.Lock()
+        # Held while emitting, so the sink sees one frame at a time
+        self.emit_lock = threading.Lock()
+        self.pending: Deque[PendingFrame[T]] = deque()
+        self.buffers: List[bytearray] = []
+        self.stats = DecryptPoolStats()
+
+    def submit(self, tag: T, encrypted: Union[bytes, bytearray, memoryview], decrypt: bool = True):
+        """
+        Decrypt `encrypted` and emit it with `tag` after every frame submitted before it, or emit it as it is if
+        `decrypt` is False. `encrypted` must stay unchanged until then.
+        """
+        if not self.slots.acquire(blocking=False):
+            self.stats.stalls += 1
+            self.slots.acquire()
+        with self.lock:
+            buffer = None
+            if decrypt:
+                buffer = self.buffers.pop() if self.buffers else bytearray()
+                if len(buffer) < len(encrypted):
+                    buffer = bytearray(len(encrypted))
+            frame = PendingFrame(tag, encrypted, buffer)
+            self.pending.append(frame)
+        self.stats.submitted += 1
+        self.executor.submit(self.decrypt, frame)
+
+    def decrypt(self, frame: PendingFrame[T]):
+        encrypted = frame.encrypted
+        try:
+            if frame.buffer is None:
+                frame.data = memoryview(encrypted)
+            else:
+                frame.data = self.key.decrypt_into(encrypted, self.iv, memoryview(frame.buffer)[:len(encrypted)])
+        except Exception:
+            # Whatever went wrong, the frame has to be done, or the ones after it never come out
+            frame.data = None
+        frame.encrypted = None
+        with self.lock:
+            frame.done = True
+        self.emit_ready()
+
+    def emit_ready(self):
+        with self.emit_lock:
+            while True:
+                with self.lock:
+                    if not self.pending or not self.pending[0].done:
+                        return
+                    frame = self.pending.popleft()
+                try:
+                    if frame.data is not None:
+                        self.stats.emitted += 1
+                        self.sink(frame.tag, frame.data)
+                    else:
+                        self.stats.failed += 1
+                        if self.on_error:
+                            self.on_error(frame.tag)
+                except Exception:
+                    traceback.print_exc()
+                finally:
+                    frame.data = None
+                    if frame.buffer is not None:
+                        with self.lock:
+                            self.buffers.append(frame.buffer)
+                    self.slots.release()
+
+    def drain(self):
+        """
+        Wait until every frame submitted so far has been emitted.
+        """
+        for _ in range(self.max_in_flight):
+            self.slots.acquire()
+        for _ in range(self.max_in_flight):
+            self.slots.release()
+
+    def close(self):
+        """
+        Emit what's in flight and stop the workers.
+        """
+        self.executor.shutdown(wait=True)
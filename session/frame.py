@@ -1,18 +1,25 @@
+import hmac
+import math
 import struct
 import time
 
 import queue
-from Crypto.Hash import HMAC, MD5, SHA256
+from collections import deque
 from dataclasses import dataclass
-from queue import Queue
-from typing import Optional, Dict, Tuple
+from queue import SimpleQueue
+from typing import Callable, Deque, Optional, Dict, Union
 
 from protobuf.steammessages_remoteplay_pb2 import k_EStreamControlAuthenticationResponse, \
     k_EStreamControlAuthenticationRequest, k_EStreamControlServerHandshake, k_EStreamControlClientHandshake
 from service import ccrypto
-from session.packet import PacketHeader, Packet, PacketType
+from session.metrics import REGISTRY
+from session.packet import PacketHeader, Packet, PacketType, FRAME_START_TYPES, FRAGMENT_TYPES, RELIABLE_TYPES
 
 FRAME_HEADER_LENGTH = 12
+PACKET_WINDOW_SIZE = 1024
+MAX_PENDING_FRAMES = 16
+FRAME_TIMEOUT = 0.25
+RELIABLE_FRAME_TIMEOUT = 10.0
 
 
 def frame_should_encrypt(msg_type: int) -> bool:
@@ -22,14 +29,15 @@ def frame_should_encrypt(msg_type: int) -> bool:
 
 def frame_encrypt(data: bytes, key: bytes, sequence: int) -> bytes:
     plain = int.to_bytes(sequence, 8, byteorder='little', signed=False) + data
-    iv = HMAC.new(key, plain, MD5).digest()
+    iv = hmac.digest(key, plain, 'md5')
     return iv + ccrypto.symmetric_encrypt_with_iv(plain, iv, key, False)
 
 
 def frame_decrypt(encrypted: bytes, key: bytes, expect_sequence: int) -> bytes:
     iv = encrypted[0:16]
     plain = ccrypto.symmetric_decrypt_with_iv(encrypted[16:], iv, key)
-    HMAC.new(key, plain, MD5).verify(iv)
+    if not hmac.compare_digest(hmac.digest(key, plain, 'md5'), iv):
+        raise ValueError('MAC check failed')
     if expect_sequence >= 0:
         actual_sequence = int.from_bytes(plain[:8], byteorder='little', signed=False)
         if expect_sequence != actual_sequence:
@@ -38,7 +46,7 @@ def frame_decrypt(encrypted: bytes, key: bytes, expect_sequence: int) -> bytes:
 
 
 def frame_hmac256(data: bytes, key: bytes) -> bytes:
-    return HMAC.new(key, data, SHA256).digest()
+    return hmac.digest(key, data, 'sha256')
 
 
 def frame_timestamp_from_secs(timestamp: float) -> int:
@@ -53,19 +61,82 @@ def frame_timestamp():
 class Frame:
     header: PacketHeader
     body: bytes
-    completed: bool = True
-    frag_count: int = 0
-    expected_sequence: int = 0
+    # When its first packet arrived, by the assembler's clock
+    started: float = math.nan
 
-    def append_packet(self, packet: Packet) -> bool:
-        if self.completed or self.frag_count != packet.header.fragment_id:
+
+class PartialFrame:
+    """
+    A fragmented frame being reassembled. The first packet is part 0 and carries the number of fragments,
+    fragment `i` is part `i + 1`. Every part but the last has the size of the first one, so once the first
+    part is in, each part is copied straight to its place in a buffer allocated for the whole frame.
+    Parts arriving before the first one are held aside until then.
+    """
+    __slots__ = ('header', 'buffer', 'view', 'filled', 'stride', 'length', 'received', 'total', 'early', 'started',
+                 'deadline')
+
+    def __init__(self, started: float, deadline: float):
+        self.started = started
+        self.deadline = deadline
+        self.header: Optional[PacketHeader] = None
+        self.buffer: Optional[bytearray] = None
+        self.view: Optional[memoryview] = None
+        self.filled: Optional[bytearray] = None
+        self.stride = 0
+        self.length = 0
+        self.received = 0
+        self.total = -1
+        self.early: Dict[int, bytes] = {}
+
+    def add_first(self, header: PacketHeader, body: Union[bytes, memoryview]) -> bool:
+        if self.header is not None:
+            return False
+        self.header = header
+        self.total = header.fragment_id + 1
+        self.stride = len(body)
+        self.buffer = bytearray(self.stride * self.total)
+        self.view = memoryview(self.buffer)
+        self.filled = bytearray(self.total)
+        if not self.add_part(0, body):
+            return False
+        early = self.early
+        self.early = {}
+        return all(self.add_part(index, part) for index, part in early.items())
+
+    def add_part(self, index: int, body: Union[bytes, memoryview]) -> bool:
+        view = self.view
+        if view is None:
+            if index in self.early:
+                return False
+            # Outlives the receive slot it arrived in, so keep our own copy
+            self.early[index] = bytes(body)
+            return True
+        if index >= self.total or self.filled[index]:
+            return False
+        size = len(body)
+        offset = index * self.stride
+        if index == self.total - 1:
+            if size > self.stride:
+                return False
+            self.length = offset + size
+        elif size != self.stride:
             return False
-        self.body += packet.body
-        self.frag_count += 1
-        if self.frag_count == self.header.fragment_id:
-            self.completed = True
+        view[offset:offset + size] = body
+        self.filled[index] = 1
+        self.received += 1
         return True
 
+    @property
+    def missing(self) -> int:
+        # Without the first packet there is no telling how many fragments are still out
+        return self.total - self.received if self.header is not None else 1
+
+    def assemble(self) -> Frame:
+        self.view.release()
+        buffer = self.buffer
+        del buffer[self.length:]
+        return Frame(self.header, buffer, self.started)
+
 
 @dataclass
 class DataFrameHeader:
@@ -79,59 +150,179 @@ class DataFrameHeader:
         return DataFrameHeader(*struct.unpack('<HIHI', data[:FRAME_HEADER_LENGTH]))
 
 
+class PacketWindow:
+    """
+    Remembers which of the last `size` packet IDs have been seen, counting back from the newest one.
+    IDs are 16-bit and compared modulo 2^16, so the window keeps working across wraparound.
+    """
+
+    def __init__(self, size: int = PACKET_WINDOW_SIZE):
+        self.size = size
+        self.mask = (1 << size) - 1
+        self.newest = -1
+        self.bits = 0
+
+    def contains(self, pkt_id: int) -> bool:
+        """
+        Whether add() would refuse `pkt_id`, without marking it.
+        """
+        if self.newest < 0:
+            return False
+        ahead = (pkt_id - self.newest) & 0xFFFF
+        if 0 < ahead < 0x8000:
+            return False
+        behind = (0x10000 - ahead) & 0xFFFF
+        return behind >= self.size or self.bits & (1 << behind) != 0
+
+    def add(self, pkt_id: int) -> bool:
+        """
+        Mark `pkt_id` as seen. Returns False if it was seen already or is too old to tell.
+        """
+        if self.newest < 0:
+            self.newest = pkt_id
+            self.bits = 1
+            return True
+        ahead = (pkt_id - self.newest) & 0xFFFF
+        if ahead == 0:
+            return False
+        elif ahead < 0x8000:
+            self.bits = ((self.bits << ahead) | 1) & self.mask if ahead < self.size else 1
+            self.newest = pkt_id
+            return True
+        behind = 0x10000 - ahead
+        if behind >= self.size:
+            return False
+        bit = 1 << behind
+        if self.bits & bit:
+            return False
+        self.bits |= bit
+        return True
+
+
+@dataclass
+class FrameAssemblerStats:
+    duplicates: int = 0
+    expired_frames: int = 0
+    dropped_frames: int = 0
+    missing_fragments: int = 0
+
+
 class FrameAssembler:
 
-    def __init__(self, channel: int):
+    def __init__(self, channel: int, timeout: float = FRAME_TIMEOUT, reliable_timeout: float = RELIABLE_FRAME_TIMEOUT,
+                 clock: Callable[[], float] = time.monotonic, thread_safe: bool = False):
         self.channel = channel
-        self.frame_queue: Queue[Frame] = Queue()
-        self.temp_frame: Optional[Frame] = None
-        self.packet_headers: Dict[Tuple[int, int], PacketHeader] = {}
+        self.timeout = timeout
+        self.reliable_timeout = reliable_timeout
+        self.clock = clock
+        self.stats = FrameAssemblerStats()
+        self.reassembly_time = REGISTRY.histogram('steamlink_frame_reassembly_seconds',
+                                                  'Time from the first packet of a fragmented frame to its last',
+                                                  channel=str(channel))
+        # Frames are normally polled by the thread that assembled them, which needs no locking.
+        # Only pay for a synchronized queue when a different thread consumes them.
+        self.frame_queue: Union[Deque[Frame], SimpleQueue[Frame]]
+        if thread_safe:
+            self.frame_queue = SimpleQueue()
+            self.push_frame: Callable[[Frame], None] = self._push_frame_queue
+            self.poll_frame: Callable[[], Optional[Frame]] = self._poll_frame_queue
+        else:
+            self.frame_queue = deque()
+            self.push_frame = self.frame_queue.append
+            self.poll_frame = self._poll_frame_deque
+        self.pending_frames: Dict[int, PartialFrame] = {}
+        self.next_deadline = math.inf
+        self.packet_windows: Dict[int, PacketWindow] = {}
 
     def add_packet(self, packet: Packet) -> bool:
         assert self.channel == packet.header.channel, f'Unexpected channel {packet.header.channel} (vs {self.channel})'
         header = packet.header
         pkt_type = header.pkt_type
-        if self.is_packet_handled(header):
+        if not self.add_handled_packet(header):
+            self.stats.duplicates += 1
             return False
-        self.add_handled_packet(header)
-        if pkt_type in [PacketType.RELIABLE, PacketType.UNRELIABLE]:
-            if self.temp_frame:
-                print(
-                    f'Message {packet.header} already present. {self.temp_frame.header}')
-                return False
-            frame = Frame(header, packet.body, header.fragment_id == 0)
-            if frame.completed:
-                self.frame_queue.put_nowait(frame)
-            else:
-                self.temp_frame = frame
-        elif pkt_type in [PacketType.RELIABLE_FRAG, PacketType.UNRELIABLE_FRAG]:
-            frame = self.temp_frame
-            if not frame:
-                print(f'No temp frame found for message in channel {header.channel}')
-                return False
-            elif not frame.append_packet(packet):
-                print(f'Failed to append packet in channel {header.channel}: {header}')
-                return False
-            elif frame.completed:
-                self.frame_queue.put_nowait(frame)
-                self.temp_frame = None
+        now = self.clock()
+        if now >= self.next_deadline:
+            self.expire(now)
+        if pkt_type in FRAME_START_TYPES:
+            if header.fragment_id == 0:
+                self.push_frame(Frame(header, packet.body, now))
+                return True
+            start_id = header.pkt_id
+            frame = self.pending_frames.get(start_id) or self.add_pending_frame(start_id, pkt_type, now)
+            accepted = frame.add_first(header, packet.body)
+        elif pkt_type in FRAGMENT_TYPES:
+            # Fragments carry consecutive packet IDs following the first packet of their frame
+            start_id = (header.pkt_id - header.fragment_id - 1) & 0xFFFF
+            frame = self.pending_frames.get(start_id) or self.add_pending_frame(start_id, pkt_type, now)
+            accepted = frame.add_part(header.fragment_id + 1, packet.body)
         else:
-            assert header.fragment_id == 0, f'Packet {header.pkt_type} has fragment_id {header.fragment_id}'
-            frame = Frame(header, packet.body)
-            if frame.completed:
-                self.frame_queue.put_nowait(frame)
+            assert header.fragment_id == 0, f'Packet {pkt_type} has fragment_id {header.fragment_id}'
+            self.push_frame(Frame(header, packet.body, now))
+            return True
+        if not accepted:
+            print(f'Failed to add packet to frame {start_id} in channel {header.channel}: {header}')
+            return False
+        if frame.received == frame.total:
+            del self.pending_frames[start_id]
+            self.reassembly_time.observe(now - frame.started)
+            self.push_frame(frame.assemble())
         return True
 
-    def poll_frame(self) -> Optional[Frame]:
+    def add_pending_frame(self, start_id: int, pkt_type: PacketType, now: float) -> PartialFrame:
+        if len(self.pending_frames) >= MAX_PENDING_FRAMES:
+            # Oldest first, as dicts keep insertion order
+            oldest = next(iter(self.pending_frames))
+            frame = self.pending_frames.pop(oldest)
+            self.stats.dropped_frames += 1
+            self.stats.missing_fragments += frame.missing
+        timeout = self.reliable_timeout if pkt_type in RELIABLE_TYPES else self.timeout
+        frame = self.pending_frames[start_id] = PartialFrame(now, now + timeout)
+        self.next_deadline = min(self.next_deadline, frame.deadline)
+        return frame
+
+    def expire(self, now: Optional[float] = None):
+        """
+        Release incomplete frames past their deadline, so a lost fragment never holds up the frames after it.
+        """
+        if now is None:
+            now = self.clock()
+        if now < self.next_deadline:
+            return
+        next_deadline = math.inf
+        for start_id, frame in list(self.pending_frames.items()):
+            if frame.deadline <= now:
+                del self.pending_frames[start_id]
+                self.stats.expired_frames += 1
+                self.stats.missing_fragments += frame.missing
+            else:
+                next_deadline = min(next_deadline, frame.deadline)
+        self.next_deadline = next_deadline
+
+    def _poll_frame_deque(self) -> Optional[Frame]:
+        return self.frame_queue.popleft() if self.frame_queue else None
+
+    def _push_frame_queue(self, frame: Frame):
+        body = frame.body
+        if isinstance(body, memoryview):
+            # Single packet frames point into the receive ring, whose next drain overwrites them before another
+            # thread gets around to them
+            frame.body = bytes(body)
+        self.frame_queue.put_nowait(frame)
+
+    def _poll_frame_queue(self) -> Optional[Frame]:
         try:
             return self.frame_queue.get_nowait()
         except queue.Empty:
             pass
         return None
 
-    def is_packet_handled(self, header: PacketHeader) -> bool:
-        handled = self.packet_headers.get((header.type_and_crc, header.pkt_id), None)
-        return handled and header.send_timestamp - handled.send_timestamp < 10000
+    def is_duplicate(self, header: PacketHeader) -> bool:
+        window = self.packet_windows.get(header.type_and_crc)
+        return window is not None and window.contains(header.pkt_id)
 
-    def add_handled_packet(self, header: PacketHeader):
-        self.packet_headers[(header.type_and_crc, header.pkt_id)] = header
+    def add_handled_packet(self, header: PacketHeader) -> bool:
+        window = self.packet_windows.get(header.type_and_crc)
+        if window is None:
+            window = self.packet_windows[header.type_and_crc] = PacketWindow()
+        return window.add(header.pkt_id)
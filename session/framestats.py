@@ -0,0 +1,250 @@
+import math
+
+from array import array
+from typing import List, Optional
+
+from protobuf.steammessages_remoteplay_pb2 import CFrameStatsListMsg, CFrameStatAccumulatedValue, \
+    CStreamingSessionStats, k_EStreamFrameEventRecv, k_EStreamFrameEventComplete, k_EStreamFrameEventDecodeBegin, \
+    k_EStreamFrameEventDecodeEnd, k_EStreamFrameResultPending, k_EStreamFrameResultDisplayed, \
+    k_EStreamFrameResultDroppedNetworkLost, k_EStreamFrameResultDroppedLate, k_EFrameStatFPS, \
+    k_EFrameStatNetworkDurationMS, k_EFrameStatDecodeDurationMS, k_EFrameStatClientBitrateKbitPerSec, \
+    k_EFrameStatPacketLossPercentage
+
+# Frames the host is told about every interval
+FRAME_STATS_INTERVAL = 1.0
+# Frames kept until they're reported, a power of two so slots follow the 16-bit frame ids across the wrap
+FRAME_STATS_CAPACITY = 256
+
+# Events recorded for every frame, by their index in the ring
+EVENT_RECV = 0
+EVENT_COMPLETE = 1
+EVENT_DECODE_BEGIN = 2
+EVENT_DECODE_END = 3
+FRAME_EVENTS = (k_EStreamFrameEventRecv, k_EStreamFrameEventComplete, k_EStreamFrameEventDecodeBegin,
+                k_EStreamFrameEventDecodeEnd)
+
+
+def timestamp_delta(begin: int, end: int) -> float:
+    """
+    Seconds from one frame timestamp to a later one, across the 32-bit wrap.
+    """
+    return ((end - begin) & 0xFFFFFFFF) / 65536
+
+
+class Accumulator:
+    __slots__ = ('count', 'total', 'total_squares')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.total_squares = 0.0
+
+    def add(self, value: float):
+        self.count += 1
+        self.total += value
+        self.total_squares += value * value
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    @property
+    def stddev(self) -> float:
+        if not self.count:
+            return 0.0
+        mean = self.mean
+        return math.sqrt(max(0.0, self.total_squares / self.count - mean * mean))
+
+
+class FrameStatsRecorder:
+    """
+    Per-frame events of a data channel, kept in preallocated arrays indexed by frame id until collect() turns the
+    finished ones into a CFrameStatsListMsg for the host. Recording a frame only writes into the arrays and adds to
+    the session totals, the messages are built once per report.
+    """
+
+    def __init__(self, data_type: int, capacity: int = FRAME_STATS_CAPACITY):
+        self.data_type = data_type
+        self.capacity = capacity
+        self.mask = capacity - 1
+        self.frame_ids = array('l', [-1]) * capacity
+        self.results = array('B', [k_EStreamFrameResultPending]) * capacity
+        self.sizes = array('L', [0]) * capacity
+        # 0 for events that didn't happen to the frame
+        self.events = array('L', [0]) * (capacity * len(FRAME_EVENTS))
+        # Next frame to report, and the newest one seen
+        self.next_id = -1
+        self.latest_id = -1
+        self.decoded_id = -1
+        self.first_timestamp = -1
+        self.last_timestamp = -1
+        self.displayed = 0
+        self.lost = 0
+        self.late = 0
+        self.received_bytes = 0
+        self.network_time = Accumulator()
+        self.decode_time = Accumulator()
+
+    def slot(self, frame_id: int) -> int:
+        """
+        Slot of `frame_id`, cleared for it if it held another frame.
+        """
+        slot = frame_id & self.mask
+        if self.frame_ids[slot] != frame_id:
+            self.frame_ids[slot] = frame_id
+            self.results[slot] = k_EStreamFrameResultPending
+            self.sizes[slot] = 0
+            base = slot * len(FRAME_EVENTS)
+            for i in range(len(FRAME_EVENTS)):
+                self.events[base + i] = 0
+            if self.next_id < 0:
+                self.next_id = self.latest_id = frame_id
+            elif not (frame_id - self.latest_id) & 0x8000:
+                self.latest_id = frame_id
+        return slot
+
+    def reported(self, frame_id: int) -> bool:
+        """
+        Whether `frame_id` is older than the frames still to be reported, its slot may be another frame's by now.
+        """
+        return self.next_id >= 0 and (frame_id - self.next_id) & 0x8000 != 0
+
+    def received(self, frame_id: int, size: int, timestamp: int, completed: int = 0):
+        """
+        `timestamp` is when the first packet of the frame arrived, `completed` when it was reassembled, if later.
+        """
+        completed = completed or timestamp
+        self.received_bytes += size
+        if self.first_timestamp < 0:
+            self.first_timestamp = timestamp
+        self.last_timestamp = completed
+        if self.reported(frame_id):
+            return
+        slot = self.slot(frame_id)
+        self.sizes[slot] = size
+        base = slot * len(FRAME_EVENTS)
+        self.events[base + EVENT_RECV] = timestamp
+        self.events[base + EVENT_COMPLETE] = completed
+
+    def add_network_time(self, seconds: float):
+        self.network_time.add(seconds * 1000)
+
+    def dropped_late(self, frame_id: int):
+        self.late += 1
+        if self.reported(frame_id):
+            return
+        slot = self.slot(frame_id)
+        if self.results[slot] == k_EStreamFrameResultDroppedNetworkLost:
+            # Counted as lost when it was skipped, it's late instead
+            self.lost -= 1
+        self.results[slot] = k_EStreamFrameResultDroppedLate
+
+    def decode_begin(self, frame_id: int, timestamp: int):
+        decoded_id = self.decoded_id
+        if decoded_id >= 0 and not (frame_id - decoded_id) & 0x8000:
+            # Frames skipped over on the way here never arrived, only the newest of them fit in the ring
+            gap = (frame_id - decoded_id) & 0xFFFF
+            self.lost += gap - 1
+            for i in range(max(1, gap - self.capacity + 1), gap):
+                self.results[self.slot((decoded_id + i) & 0xFFFF)] = k_EStreamFrameResultDroppedNetworkLost
+        if decoded_id < 0 or not (frame_id - decoded_id) & 0x8000:
+            self.decoded_id = frame_id
+        self.events[self.slot(frame_id) * len(FRAME_EVENTS) + EVENT_DECODE_BEGIN] = timestamp
+
+    def decode_end(self, frame_id: int, timestamp: int):
+        """
+        Can be called from a thread of its own: decode_begin() already took the slot, and besides last_timestamp,
+        which any recent timestamp will do for, nothing else writes what's updated here.
+        """
+        slot = frame_id & self.mask
+        if self.frame_ids[slot] != frame_id:
+            # Overrun by newer frames while it was decoded
+            return
+        base = slot * len(FRAME_EVENTS)
+        self.events[base + EVENT_DECODE_END] = timestamp
+        self.results[slot] = k_EStreamFrameResultDisplayed
+        self.displayed += 1
+        self.last_timestamp = timestamp
+        begin = self.events[base + EVENT_DECODE_BEGIN]
+        if begin:
+            self.decode_time.add(timestamp_delta(begin, timestamp) * 1000)
+
+    def collect(self) -> Optional[CFrameStatsListMsg]:
+        """
+        The frames finished since the last report, in order, up to the first one still pending. None if there are
+        none.
+        """
+        if self.next_id < 0:
+            return None
+        behind = (self.latest_id - self.next_id) & 0xFFFF
+        if behind >= self.capacity:
+            # Slots of the oldest ones were taken by newer frames before they could be reported
+            self.next_id = (self.latest_id - self.capacity + 1) & 0xFFFF
+            behind = self.capacity - 1
+        message = self.empty_message()
+        frame_id = self.next_id
+        for _ in range(behind + 1):
+            slot = frame_id & self.mask
+            result = self.results[slot]
+            if self.frame_ids[slot] != frame_id or result == k_EStreamFrameResultPending:
+                break
+            stats = message.stats.add(frame_id=frame_id, result=result, frame_size=self.sizes[slot])
+            base = slot * len(FRAME_EVENTS)
+            for i, event_id in enumerate(FRAME_EVENTS):
+                timestamp = self.events[base + i]
+                if timestamp:
+                    stats.events.add(event_id=event_id, timestamp=timestamp)
+            frame_id = (frame_id + 1) & 0xFFFF
+        self.next_id = frame_id
+        return message if message.stats else None
+
+    def empty_message(self) -> CFrameStatsListMsg:
+        return CFrameStatsListMsg(data_type=self.data_type, latest_frame_id=self.latest_id)
+
+    @property
+    def elapsed(self) -> float:
+        if self.first_timestamp < 0:
+            return 0.0
+        return timestamp_delta(self.first_timestamp, self.last_timestamp)
+
+    @property
+    def loss_percentage(self) -> float:
+        frames = self.displayed + self.lost + self.late
+        return (self.lost + self.late) * 100 / frames if frames else 0.0
+
+    def accumulated(self) -> List[CFrameStatAccumulatedValue]:
+        """
+        Totals over the whole stream.
+        """
+        elapsed = self.elapsed
+        values = [
+            CFrameStatAccumulatedValue(stat_type=k_EFrameStatPacketLossPercentage,
+                                       count=self.displayed + self.lost + self.late, average=self.loss_percentage),
+        ]
+        if elapsed > 0:
+            values.append(CFrameStatAccumulatedValue(stat_type=k_EFrameStatFPS, count=self.displayed,
+                                                     average=self.displayed / elapsed))
+            values.append(CFrameStatAccumulatedValue(stat_type=k_EFrameStatClientBitrateKbitPerSec,
+                                                     count=self.displayed,
+                                                     average=self.received_bytes * 8 / elapsed / 1000))
+        for stat_type, accumulator in ((k_EFrameStatNetworkDurationMS, self.network_time),
+                                       (k_EFrameStatDecodeDurationMS, self.decode_time)):
+            if accumulator.count:
+                values.append(CFrameStatAccumulatedValue(stat_type=stat_type, count=accumulator.count,
+                                                         average=accumulator.mean, stddev=accumulator.stddev))
+        return values
+
+
+def session_stats(recorders: List[FrameStatsRecorder]) -> CStreamingSessionStats:
+    """
+    Frame loss and network time over the streams of a session.
+    """
+    frames = sum(r.displayed + r.lost + r.late for r in recorders)
+    impaired = sum(r.lost + r.late for r in recorders)
+    network = Accumulator()
+    for recorder in recorders:
+        network.count += recorder.network_time.count
+        network.total += recorder.network_time.total
+        network.total_squares += recorder.network_time.total_squares
+    return CStreamingSessionStats(frame_loss_percentage=impaired * 100 / frames if frames else 0.0,
+                                  average_network_time_ms=network.mean, stddev_network_time_ms=network.stddev)
@@ -0,0 +1,135 @@
+import math
+import time
+
+from dataclasses import dataclass
+from typing import Callable, Dict, Generic, Optional, Tuple, TypeVar
+
+# Playout delay is JITTER_MULTIPLIER times the measured jitter, kept within the channel's bounds
+JITTER_MULTIPLIER = 4
+# How fast the transit baseline follows transit times that go up, e.g. when the clocks drift apart
+BASE_TRANSIT_GAIN = 1 / 256
+
+VIDEO_MIN_DELAY = 0.0
+VIDEO_MAX_DELAY = 0.015
+AUDIO_MIN_DELAY = 0.01
+AUDIO_MAX_DELAY = 0.08
+
+T = TypeVar('T')
+
+
+@dataclass
+class JitterBufferStats:
+    depth: int = 0
+    released: int = 0
+    # Arrived after a later frame
+    reordered: int = 0
+    # Arrived after its place in the sequence was already played out
+    late: int = 0
+    # Never arrived by the time a later frame was due
+    skipped: int = 0
+    jitter: float = 0.0
+    target_delay: float = 0.0
+
+
+class JitterBuffer(Generic[T]):
+    """
+    Puts frames back in order by their 16-bit frame id, and plays each one out a target delay after the time the
+    host sent it, counted from the fastest transit seen. The delay follows the interarrival jitter, estimated from
+    the packets' send timestamps as in RFC 3550. Frames that show up after their turn are dropped, or released
+    right away if `drop_late` is off.
+    """
+
+    def __init__(self, release: Callable[[T], None], min_delay: float, max_delay: float, drop_late: bool = True,
+                 clock: Callable[[], float] = time.monotonic):
+        self.release = release
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.drop_late = drop_late
+        self.clock = clock
+        self.stats = JitterBufferStats(target_delay=min_delay)
+        self.frames: Dict[int, Tuple[float, T]] = {}
+        self.next_id = -1
+        self.newest_id = -1
+        self.send_time = 0.0
+        self.last_timestamp = -1
+        self.last_transit = math.nan
+        self.base_transit = math.inf
+        self.next_deadline = math.inf
+
+    def push(self, frame_id: int, send_timestamp: int, item: T, now: Optional[float] = None):
+        """
+        Add a frame. `send_timestamp` is the host's send time in 1/65536 s, as in packet headers.
+        """
+        if now is None:
+            now = self.clock()
+        stats = self.stats
+        if self.next_id < 0:
+            self.next_id = self.newest_id = frame_id
+        elif (frame_id - self.next_id) & 0x8000 or frame_id in self.frames:
+            stats.late += 1
+            if not self.drop_late:
+                self.release(item)
+            return
+        if (frame_id - self.newest_id) & 0x8000:
+            stats.reordered += 1
+        else:
+            self.newest_id = frame_id
+        playout = self.update_transit(send_timestamp, now) + stats.target_delay
+        self.frames[frame_id] = (playout, item)
+        stats.depth = len(self.frames)
+        if playout < self.next_deadline:
+            self.next_deadline = playout
+        if playout <= now:
+            self.poll(now)
+
+    def update_transit(self, send_timestamp: int, now: float) -> float:
+        # Unwrap the 32-bit timestamp into a send time that keeps counting up
+        if self.last_timestamp >= 0:
+            delta = (send_timestamp - self.last_timestamp) & 0xFFFFFFFF
+            if delta & 0x80000000:
+                delta -= 0x100000000
+            self.send_time += delta / 65536
+        self.last_timestamp = send_timestamp
+        send_time = self.send_time
+        transit = now - send_time
+        stats = self.stats
+        if not math.isnan(self.last_transit):
+            stats.jitter += (abs(transit - self.last_transit) - stats.jitter) / 16
+            stats.target_delay = min(max(JITTER_MULTIPLIER * stats.jitter, self.min_delay), self.max_delay)
+        self.last_transit = transit
+        if transit < self.base_transit:
+            self.base_transit = transit
+        else:
+            self.base_transit += (transit - self.base_transit) * BASE_TRANSIT_GAIN
+        return send_time + self.base_transit
+
+    def poll(self, now: Optional[float] = None):
+        """
+        Release the frames whose playout time has come, in order.
+        """
+        if now is None:
+            now = self.clock()
+        if now < self.next_deadline:
+            return
+        frames = self.frames
+        stats = self.stats
+        while frames:
+            entry = frames.pop(self.next_id, None)
+            if entry is None:
+                # Give up on missing frames once anything after them is due
+                if min(playout for playout, _ in frames.values()) > now:
+                    break
+                next_id = self.next_id
+                gap = min((frame_id - next_id) & 0xFFFF for frame_id in frames)
+                stats.skipped += gap
+                self.next_id = (next_id + gap) & 0xFFFF
+                continue
+            playout, item = entry
+            if playout > now:
+                frames[self.next_id] = entry
+                break
+            self.next_id = (self.next_id + 1) & 0xFFFF
+            stats.released += 1
+            self.release(item)
+        stats.depth = len(frames)
+        self.next_deadline = min((playout for playout, _ in frames.values()), default=math.inf)
@@ -0,0 +1,88 @@
+from typing import Callable, Dict
+
+# Kinds of backend, each resolves to a factory
+# (rate, channels) -> an output with write(pcm)
+AUDIO_OUTPUT = 'audio_output'
+# (rate, channels) -> a decoder with decode(data, frame_size) -> pcm, raising DecodeError
+AUDIO_DECODER = 'audio_decoder'
+
+
+class MediaUnavailable(ImportError):
+    pass
+
+
+class DecodeError(Exception):
+    pass
+
+
+# Loaders by kind, in order of preference, each importing its library only when called
+_loaders: Dict[str, Dict[str, Callable[[], Callable]]] = {}
+_resolved: Dict[str, Callable] = {}
+_failures: Dict[str, MediaUnavailable] = {}
+
+
+def register_backend(kind: str, name: str, loader: Callable[[], Callable]):
+    """
+    Offer `loader` for `kind`, after the backends registered before it. The loader imports what the backend needs
+    and returns its factory, or raises ImportError if it can't.
+    """
+    _loaders.setdefault(kind, {})[name] = loader
+    _resolved.pop(kind, None)
+    _failures.pop(kind, None)
+
+
+def backend(kind: str) -> Callable:
+    """
+    The factory of the first backend of `kind` that loads, resolved once. Raises MediaUnavailable with the reason
+    of every backend that didn't.
+    """
+    factory = _resolved.get(kind)
+    if factory is not None:
+        return factory
+    if kind in _failures:
+        raise _failures[kind]
+    errors = []
+    for name, loader in _loaders.get(kind, {}).items():
+        try:
+            factory = loader()
+        except ImportError as e:
+            errors.append(f'{name}: {e}')
+            continue
+        _resolved[kind] = factory
+        return factory
+    _failures[kind] = MediaUnavailable(f'No {kind} backend available ({"; ".join(errors) or "none registered"})')
+    raise _failures[kind]
+
+
+def _alsa_output() -> Callable:
+    from alsaaudio import PCM, PCM_PLAYBACK, PCM_NORMAL, PCM_FORMAT_S16_LE
+
+    def open_output(rate: int, channels: int) -> PCM:
+        return PCM(type=PCM_PLAYBACK, mode=PCM_NORMAL, rate=rate, channels=channels, format=PCM_FORMAT_S16_LE,
+                   periodsize=32, device='default')
+
+    return open_output
+
+
+def _opus_decoder() -> Callable:
+    try:
+        from opuslib import Decoder, OpusError
+    except Exception as e:
+        # opuslib raises a bare Exception when libopus itself is missing
+        raise ImportError(str(e)) from e
+
+    class OpusDecoder:
+        def __init__(self, rate: int, channels: int):
+            self.decoder = Decoder(rate, channels)
+
+        def decode(self, data: bytes, frame_size: int) -> bytes:
+            try:
+                return self.decoder.decode(data, frame_size)
+            except OpusError as e:
+                raise DecodeError(str(e)) from e
+
+    return OpusDecoder
+
+
+register_backend(AUDIO_OUTPUT, 'alsa', _alsa_output)
+register_backend(AUDIO_DECODER, 'opus', _opus_decoder)
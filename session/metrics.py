@@ -0,0 +1,289 @@
+import bisect
+import json
+import math
+import os
+import threading
+import time
+import weakref
+
+from dataclasses import fields
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Iterable, List, Optional, Tuple, Union
+
+# Seconds, from a single fragment's worth of waiting up to the frame timeout
+LATENCY_BUCKETS = (0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.25)
+SNAPSHOT_INTERVAL = 10.0
+
+Labels = Tuple[Tuple[str, str], ...]
+# Collectors return (name, labels, value) for every value they export, whenever the metrics are read
+Sample = Tuple[str, Labels, float]
+
+
+class Counter:
+    __slots__ = ('name', 'labels', 'value')
+    kind = 'counter'
+
+    def __init__(self, name: str, labels: Labels):
+        self.name = name
+        self.labels = labels
+        self.value = 0
+
+    def inc(self, amount: int = 1):
+        self.value += amount
+
+    def samples(self) -> Iterable[Sample]:
+        yield self.name, self.labels, self.value
+
+
+class Gauge:
+    __slots__ = ('name', 'labels', 'value')
+    kind = 'gauge'
+
+    def __init__(self, name: str, labels: Labels):
+        self.name = name
+        self.labels = labels
+        self.value = 0.0
+
+    def set(self, value: float):
+        self.value = value
+
+    def samples(self) -> Iterable[Sample]:
+        yield self.name, self.labels, self.value
+
+
+class Histogram:
+    __slots__ = ('name', 'labels', 'buckets', 'counts', 'sum', 'count')
+    kind = 'histogram'
+
+    def __init__(self, name: str, labels: Labels, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.name = name
+        self.labels = labels
+        self.buckets = buckets
+        # One more for everything over the last bound
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self) -> Iterable[Sample]:
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            yield f'{self.name}_bucket', self.labels + (('le', repr(bound)),), cumulative
+        yield f'{self.name}_bucket', self.labels + (('le', '+Inf'),), self.count
+        yield f'{self.name}_sum', self.labels, self.sum
+        yield f'{self.name}_count', self.labels, self.count
+
+
+Metric = Union[Counter, Gauge, Histogram]
+
+
+def stats_samples(prefix: str, stats: object, labels: Labels) -> List[Sample]:
+    """
+    Samples for the fields of a stats dataclass that have a value, named `prefix`_`field`.
+    """
+    values = ((field.name, getattr(stats, field.name)) for field in fields(stats))
+    return [(f'{prefix}_{name}', labels, value) for name, value in values if value is not None]
+
+
+class MetricsRegistry:
+    """
+    Named counters, gauges and histograms, plus collectors that report values kept elsewhere (the stats
+    dataclasses of the session components) whenever the metrics are read. Updating a metric is a plain attribute
+    update without locking: each one is only written from one thread, and a reader seeing a slightly stale value
+    is fine.
+    """
+
+    def __init__(self, help_texts: Optional[Dict[str, str]] = None):
+        self.metrics: Dict[Tuple[str, Labels], Metric] = {}
+        self.help_texts: Dict[str, str] = dict(help_texts or {})
+        self.collectors: List[Callable[[], Optional[Callable[[], Iterable[Sample]]]]] = []
+        self.lock = threading.Lock()
+
+    def metric(self, metric_type: type, name: str, help_text: str, labels: Dict[str, str], *args) -> Metric:
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            metric = self.metrics.get(key)
+            if metric is None:
+                metric = self.metrics[key] = metric_type(name, key[1], *args)
+                if help_text:
+                    self.help_texts[name] = help_text
+            elif not isinstance(metric, metric_type):
+                raise ValueError(f'{name} is already a {metric.kind}')
+            return metric
+
+    def counter(self, name: str, help_text: str = '', **labels: str) -> Counter:
+        if not name.endswith('_total'):
+            name += '_total'
+        return self.metric(Counter, name, help_text, labels)
+
+    def gauge(self, name: str, help_text: str = '', **labels: str) -> Gauge:
+        return self.metric(Gauge, name, help_text, labels)
+
+    def histogram(self, name: str, help_text: str = '', buckets: Tuple[float, ...] = LATENCY_BUCKETS,
+                  **labels: str) -> Histogram:
+        return self.metric(Histogram, name, help_text, labels, buckets)
+
+    def add_collector(self, collector: Callable[[], Iterable[Sample]]):
+        """
+        Read `collector` along with the metrics. Bound methods are held weakly, so a channel that goes away takes
+        its collector with it.
+        """
+        ref = weakref.WeakMethod(collector) if hasattr(collector, '__self__') else lambda: collector
+        with self.lock:
+            self.collectors.append(ref)
+
+    def samples(self) -> Dict[str, Tuple[str, List[Sample]]]:
+        """
+        Everything by metric name, each with its type.
+        """
+        with self.lock:
+            metrics = list(self.metrics.values())
+            collectors = [ref() for ref in self.collectors]
+            self.collectors = [ref for ref, collector in zip(self.collectors, collectors) if collector is not None]
+        families: Dict[str, Tuple[str, List[Sample]]] = {}
+        for metric in metrics:
+            families.setdefault(metric.name, (metric.kind, []))[1].extend(metric.samples())
+        for collector in collectors:
+            if collector is None:
+                continue
+            for sample in collector():
+                families.setdefault(sample[0], ('gauge', []))[1].append(sample)
+        return families
+
+    def exposition(self) -> str:
+        """
+        The metrics in Prometheus text exposition format.
+        """
+        lines = []
+        for name, (kind, samples) in sorted(self.samples().items()):
+            help_text = self.help_texts.get(name)
+            if help_text:
+                lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            for sample_name, labels, value in samples:
+                if labels:
+                    label_text = ','.join(f'{key}="{value}"' for key, value in labels)
+                    lines.append(f'{sample_name}{{{label_text}}} {format_value(value)}')
+                else:
+                    lines.append(f'{sample_name} {format_value(value)}')
+        lines.append('')
+        return '\n'.join(lines)
+
+    def snapshot(self) -> dict:
+        """
+        The metrics as a JSON-serializable dict, with a sample list for every metric name. JSON has no NaN or
+        infinity, values that aren't finite are null.
+        """
+        return {
+            'timestamp': time.time(),
+            'metrics': {
+                name: [{'name': sample_name, 'labels': dict(labels), 'value': json_value(value)}
+                       for sample_name, labels, value in samples]
+                for name, (_, samples) in sorted(self.samples().items())
+            },
+        }
+
+
+def json_value(value: Union[int, float]) -> Optional[Union[int, float]]:
+    if isinstance(value, int) or math.isfinite(value):
+        return value
+    return None
+
+
+def format_value(value: float) -> str:
+    if isinstance(value, int):
+        return str(value)
+    if math.isnan(value):
+        return 'NaN'
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(value)
+
+
+REGISTRY = MetricsRegistry()
+
+
+class MetricsServer:
+    """
+    Serves the metrics over HTTP on a background thread: Prometheus text at /metrics, a JSON snapshot at
+    /metrics.json.
+    """
+
+    def __init__(self, registry: MetricsRegistry = REGISTRY, address: Tuple[str, int] = ('127.0.0.1', 9350)):
+        self.registry = registry
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == '/metrics':
+                    body = server.registry.exposition().encode()
+                    content_type = 'text/plain; version=0.0.4; charset=utf-8'
+                elif self.path == '/metrics.json':
+                    body = json.dumps(server.registry.snapshot(), allow_nan=False).encode()
+                    content_type = 'application/json'
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format: str, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(address, Handler)
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name='metrics-server', daemon=True)
+
+    @property
+    def address(self) -> Tuple[str, int]:
+        return self.httpd.server_address[:2]
+
+    def start(self) -> 'MetricsServer':
+        self.thread.start()
+        return self
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class SnapshotWriter:
+    """
+    Writes a JSON snapshot of the metrics to `path` every `interval` seconds on a background thread, and once more
+    when closed. Each snapshot replaces the file whole, so readers never see half of one.
+    """
+
+    def __init__(self, path: str, registry: MetricsRegistry = REGISTRY, interval: float = SNAPSHOT_INTERVAL):
+        self.path = path
+        self.registry = registry
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='metrics-snapshot', daemon=True)
+
+    def start(self) -> 'SnapshotWriter':
+        self.thread.start()
+        return self
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.write()
+
+    def write(self):
+        temp_path = f'{self.path}.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(self.registry.snapshot(), f, allow_nan=False)
+        os.replace(temp_path, self.path)
+
+    def close(self):
+        self.stopped.set()
+        self.thread.join()
+        self.write()
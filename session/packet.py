@@ -1,14 +1,17 @@
 import struct
 
 from crc32c import crc32c
-from dataclasses import dataclass, astuple
-from enum import Enum
-from typing import Optional
+from enum import IntEnum
+from typing import Optional, Union
 
 PACKET_HEADER_LENGTH = 13
+PACKET_CRC_LENGTH = 4
 
+_header_struct = struct.Struct('<BBBBBhHI')
+_crc_struct = struct.Struct('<I')
 
-class PacketType(Enum):
+
+class PacketType(IntEnum):
     UNCONNECTED = 0
     CONNECT = 1
     CONNECT_ACK = 2
@@ -21,24 +24,51 @@ class PacketType(Enum):
     DISCONNECT = 9
 
 
-@dataclass()
+# Indexed by the raw 7-bit type, so reading a header's type never constructs an enum
+_packet_types: tuple[PacketType, ...] = tuple(PacketType)
+
+RELIABLE_TYPES = frozenset([PacketType.RELIABLE, PacketType.RELIABLE_FRAG])
+UNRELIABLE_TYPES = frozenset([PacketType.UNRELIABLE, PacketType.UNRELIABLE_FRAG])
+FRAME_START_TYPES = frozenset([PacketType.RELIABLE, PacketType.UNRELIABLE])
+FRAGMENT_TYPES = frozenset([PacketType.RELIABLE_FRAG, PacketType.UNRELIABLE_FRAG])
+CONNECTION_TYPES = frozenset([PacketType.CONNECT, PacketType.CONNECT_ACK, PacketType.DISCONNECT])
+
+
 class PacketHeader:
-    type_and_crc: int = 0
-    retransmit_count: int = 0
-    src_conn_id: int = 0
-    dst_conn_id: int = 0
-    channel: int = 0
-    fragment_id: int = 0
-    pkt_id: int = 0
-    send_timestamp: int = 0
+    __slots__ = ('type_and_crc', 'retransmit_count', 'src_conn_id', 'dst_conn_id', 'channel', 'fragment_id',
+                 'pkt_id', 'send_timestamp')
+
+    def __init__(self, type_and_crc: int = 0, retransmit_count: int = 0, src_conn_id: int = 0, dst_conn_id: int = 0,
+                 channel: int = 0, fragment_id: int = 0, pkt_id: int = 0, send_timestamp: int = 0):
+        self.type_and_crc = type_and_crc
+        self.retransmit_count = retransmit_count
+        self.src_conn_id = src_conn_id
+        self.dst_conn_id = dst_conn_id
+        self.channel = channel
+        self.fragment_id = fragment_id
+        self.pkt_id = pkt_id
+        self.send_timestamp = send_timestamp
+
+    def __repr__(self) -> str:
+        return f'PacketHeader(type_and_crc={self.type_and_crc}, retransmit_count={self.retransmit_count}, ' \
+               f'src_conn_id={self.src_conn_id}, dst_conn_id={self.dst_conn_id}, channel={self.channel}, ' \
+               f'fragment_id={self.fragment_id}, pkt_id={self.pkt_id}, send_timestamp={self.send_timestamp})'
+
+    def __eq__(self, other) -> bool:
+        if other.__class__ is not self.__class__:
+            return NotImplemented
+        return self.astuple() == other.astuple()
 
     @property
     def pkt_type(self) -> PacketType:
-        return PacketType(self.type_and_crc & 0x7F)
+        try:
+            return _packet_types[self.type_and_crc & 0x7F]
+        except IndexError:
+            raise ValueError(f'{self.type_and_crc & 0x7F} is not a valid PacketType') from None
 
     @pkt_type.setter
     def pkt_type(self, pkt_type: PacketType):
-        self.type_and_crc = (self.type_and_crc & 0x80) | (pkt_type.value & 0x7F)
+        self.type_and_crc = (self.type_and_crc & 0x80) | (pkt_type & 0x7F)
 
     @property
     def has_crc(self) -> bool:
@@ -48,35 +78,66 @@ class PacketHeader:
     def has_crc(self, has_crc: bool):
         self.type_and_crc = (self.type_and_crc & 0x7F) | (0x80 if has_crc else 0x0)
 
+    def astuple(self) -> tuple[int, ...]:
+        return (self.type_and_crc, self.retransmit_count, self.src_conn_id, self.dst_conn_id, self.channel,
+                self.fragment_id, self.pkt_id, self.send_timestamp)
+
     def serialize(self) -> bytes:
-        return struct.pack('<BBBBBhHI', *astuple(self))
+        return _header_struct.pack(*self.astuple())
+
+    def serialize_into(self, buffer: Union[bytearray, memoryview], offset: int = 0):
+        _header_struct.pack_into(buffer, offset, *self.astuple())
 
     @classmethod
-    def parse(cls, data: bytes):
-        return PacketHeader(*struct.unpack('<BBBBBhHI', data[:PACKET_HEADER_LENGTH]))
+    def parse(cls, data: Union[bytes, memoryview]):
+        return cls(*_header_struct.unpack_from(data))
 
 
-@dataclass()
 class Packet:
-    header: PacketHeader
-    body: bytes
-    size: int = -1
-    crc_ok: Optional[bool] = None
-
-    def serialize(self, pad_to: int = 0) -> bytes:
-        data = self.header.serialize()
-        data += self.body
-        if pad_to > 0 and len(data) < pad_to:
-            data += bytes([0xFE for _ in range(0, pad_to - len(data))])
-        if self.header.has_crc:
-            data += int.to_bytes(crc32c(data), length=4, byteorder='little', signed=False)
+    __slots__ = ('header', 'body', 'size', '_data', '_crc_ok')
+
+    def __init__(self, header: PacketHeader, body: Union[bytes, memoryview], size: int = -1,
+                 crc_ok: Optional[bool] = None, data: Union[bytes, memoryview, None] = None):
+        self.header = header
+        self.body = body
+        self.size = size
+        self._data = data
+        self._crc_ok = crc_ok
+
+    def __repr__(self) -> str:
+        return f'Packet(header={self.header!r}, body={self.body!r}, size={self.size}, crc_ok={self.crc_ok})'
+
+    @property
+    def crc_ok(self) -> Optional[bool]:
+        # Checked on first access, straight over the received buffer. It must be read before the
+        # receive slot backing a parsed packet is reused.
+        data = self._data
+        if data is not None:
+            self._data = None
+            view = memoryview(data)
+            size = len(view) - PACKET_CRC_LENGTH
+            self._crc_ok = crc32c(view[:size]) == _crc_struct.unpack_from(view, size)[0]
+        return self._crc_ok
+
+    def serialize(self, pad_to: int = 0) -> bytearray:
+        header = self.header
+        body = self.body
+        length = PACKET_HEADER_LENGTH + len(body)
+        padded = max(length, pad_to)
+        has_crc = header.has_crc
+        data = bytearray(padded + PACKET_CRC_LENGTH if has_crc else padded)
+        header.serialize_into(data)
+        data[PACKET_HEADER_LENGTH:length] = body
+        if padded > length:
+            data[length:padded] = b'\xFE' * (padded - length)
+        if has_crc:
+            _crc_struct.pack_into(data, padded, crc32c(memoryview(data)[:padded]))
         return data
 
     @classmethod
-    def parse(cls, data: bytes):
+    def parse(cls, data: Union[bytes, memoryview]):
         header = PacketHeader.parse(data)
-        body = data[PACKET_HEADER_LENGTH:-4 if header.has_crc else None]
-        crc_ok = None
-        if header.has_crc:
-            crc_ok = crc32c(data[:-4]) == int.from_bytes(data[-4:None], byteorder='little', signed=False)
-        return Packet(header, body, len(data) - (4 if header.has_crc else 0), crc_ok)
+        if header.type_and_crc & 0x80:
+            size = len(data) - PACKET_CRC_LENGTH
+            return cls(header, data[PACKET_HEADER_LENGTH:size], size, data=data)
+        return cls(header, data[PACKET_HEADER_LENGTH:], len(data))
@@ -0,0 +1,161 @@
+import math
+import statistics
+import time
+
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Tuple
+
+from session.packet import PACKET_CRC_LENGTH
+
+PROBE_BUDGET = 1.0
+# Datagram sizes tried once each, in both directions, to find the largest that gets through
+PROBE_MTU_SIZES = (576, 1024, 1200, 1280, 1400, 1472)
+# Trains of (count, datagram size, interval between requests). Requests are small and ask for responses of the
+# given size, so the spacing of the responses shows the bottleneck from the host to us.
+PROBE_TRAINS = ((16, 600, 0.0), (32, 1200, 0.0), (32, 1200, 0.0), (64, 1200, 0.001))
+PROBE_TRAIN_START = 0.05
+PROBE_TRAIN_GAP = 0.05
+# How long to wait for stragglers once every request is out, within the budget
+PROBE_LINGER = 0.2
+# Smallest train dispersion taken for a measurement, below it the receive batching dominates
+MIN_DISPERSION = 0.0002
+MIN_TRAIN_RESPONSES = 4
+
+
+@dataclass
+class ProbeResult:
+    sent: int = 0
+    received: int = 0
+    rtt_min: float = math.nan
+    rtt_median: float = math.nan
+    bandwidth_kbps: float = math.nan
+    path_mtu: int = 0
+
+    @property
+    def loss(self) -> float:
+        return 1 - self.received / self.sent if self.sent else 0.0
+
+    @property
+    def ok(self) -> bool:
+        return self.received > 0
+
+
+class PingSent:
+    __slots__ = ('train', 'size', 'sent_at', 'received_at')
+
+    def __init__(self, train: int, size: int, sent_at: float):
+        self.train = train
+        self.size = size
+        self.sent_at = sent_at
+        self.received_at = math.nan
+
+
+# send(sequence, packet_size_requested, pad_to)
+SendPing = Callable[[int, int, int], None]
+
+
+class LinkProbe:
+    """
+    Measures the link to the host with discovery pings, within `budget` seconds of start(). First one ping of each
+    size in PROBE_MTU_SIZES, padded both ways, then the trains in PROBE_TRAINS. Driven by poll() on the worker.
+    """
+
+    def __init__(self, send: SendPing, budget: float = PROBE_BUDGET, mtu_sizes: Tuple[int, ...] = PROBE_MTU_SIZES,
+                 trains: Tuple[Tuple[int, int, float], ...] = PROBE_TRAINS,
+                 clock: Callable[[], float] = time.monotonic):
+        self.send = send
+        self.budget = budget
+        self.mtu_sizes = mtu_sizes
+        self.trains = trains
+        self.clock = clock
+        self.pings: Dict[int, PingSent] = {}
+        # Requests not sent yet: (send time, train index or -1 for the MTU pings, datagram size)
+        self.schedule: List[Tuple[float, int, int]] = []
+        self.listeners: List[Callable[[ProbeResult], None]] = []
+        self.result: Optional[ProbeResult] = None
+        self.deadline = math.inf
+        self.next_deadline = math.inf
+        self.sequence = 0
+
+    def start(self, now: Optional[float] = None):
+        if now is None:
+            now = self.clock()
+        self.deadline = now + self.budget
+        schedule = [(now, -1, size) for size in self.mtu_sizes]
+        at = now + PROBE_TRAIN_START
+        for train, (count, size, interval) in enumerate(self.trains):
+            schedule.extend((at + i * interval, train, size) for i in range(count))
+            at += (count - 1) * interval + PROBE_TRAIN_GAP
+        schedule.reverse()
+        self.schedule = schedule
+        self.poll(now)
+
+    def when_done(self, listener: Callable[[ProbeResult], None]):
+        """
+        Call `listener` with the result once the probe is done, or right away if it already is.
+        """
+        if self.result is not None:
+            listener(self.result)
+        else:
+            self.listeners.append(listener)
+
+    def on_response(self, sequence: int, now: Optional[float] = None):
+        ping = self.pings.get(sequence)
+        if ping is None or self.result is not None or not math.isnan(ping.received_at):
+            return
+        ping.received_at = self.clock() if now is None else now
+        if not self.schedule and all(not math.isnan(p.received_at) for p in self.pings.values()):
+            self.finish()
+
+    def poll(self, now: Optional[float] = None):
+        if self.result is not None:
+            return
+        if now is None:
+            now = self.clock()
+        if now >= self.deadline:
+            self.finish()
+            return
+        schedule = self.schedule
+        while schedule and schedule[-1][0] <= now:
+            _, train, size = schedule.pop()
+            sequence = self.sequence
+            self.sequence += 1
+            self.pings[sequence] = PingSent(train, size, now)
+            pad_to = size - PACKET_CRC_LENGTH
+            # MTU pings are padded on the way out too, train requests only ask for padded responses
+            self.send(sequence, pad_to, pad_to if train < 0 else 0)
+            if not schedule:
+                self.deadline = min(self.deadline, now + PROBE_LINGER)
+        self.next_deadline = schedule[-1][0] if schedule else self.deadline
+
+    def finish(self):
+        self.result = self.measure()
+        self.next_deadline = math.inf
+        listeners, self.listeners = self.listeners, []
+        for listener in listeners:
+            listener(self.result)
+
+    def measure(self) -> ProbeResult:
+        pings = self.pings.values()
+        received = [ping for ping in pings if not math.isnan(ping.received_at)]
+        result = ProbeResult(sent=len(self.pings), received=len(received))
+        if not received:
+            return result
+        rtts = [ping.received_at - ping.sent_at for ping in received]
+        result.rtt_min = min(rtts)
+        result.rtt_median = statistics.median(rtts)
+        result.path_mtu = max((ping.size for ping in received if ping.train < 0), default=0)
+        estimates = []
+        for train, (count, size, interval) in enumerate(self.trains):
+            if interval > 0:
+                continue
+            arrivals = sorted(ping.received_at for ping in received if ping.train == train)
+            if len(arrivals) < MIN_TRAIN_RESPONSES:
+                continue
+            dispersion = arrivals[-1] - arrivals[0]
+            if dispersion < MIN_DISPERSION:
+                continue
+            estimates.append((len(arrivals) - 1) * size * 8 / dispersion / 1000)
+        if estimates:
+            result.bandwidth_kbps = statistics.median(estimates)
+        return result
@@ -0,0 +1,71 @@
+import selectors
+import socket
+
+from typing import Optional, Protocol, Union
+
+RECV_BUFFER_SIZE = 2048
+RECV_RING_SLOTS = 64
+RECV_POLL_INTERVAL = 0.1
+
+
+class PacketHandler(Protocol):
+    closed: bool
+
+    def handle_packet(self, data: Union[bytes, memoryview]):
+        ...
+
+    def poll(self) -> float:
+        """
+        Run timers that are due, and return the delay in seconds until the next one.
+        """
+        ...
+
+
+class ReceiveRing:
+    """
+    Preallocated datagram slots. A slot handed out by drain() stays valid until the next drain(),
+    so anything that outlives handle_packet must copy what it needs.
+    """
+
+    def __init__(self, slots: int = RECV_RING_SLOTS, slot_size: int = RECV_BUFFER_SIZE):
+        self.buffers: list[bytearray] = [bytearray(slot_size) for _ in range(slots)]
+        self.views: list[memoryview] = [memoryview(buf) for buf in self.buffers]
+        self.sizes: list[int] = [0] * slots
+
+    def drain(self, sock: socket.socket) -> int:
+        count = 0
+        sizes = self.sizes
+        for view in self.views:
+            try:
+                sizes[count] = sock.recv_into(view)
+            except BlockingIOError:
+                break
+            count += 1
+        return count
+
+    def dispatch(self, count: int, handler: PacketHandler):
+        views = self.views
+        sizes = self.sizes
+        for i in range(count):
+            if handler.closed:
+                break
+            handler.handle_packet(views[i][:sizes[i]])
+
+
+def receive_loop(sock: socket.socket, handler: PacketHandler, timeout: float = RECV_POLL_INTERVAL,
+                 ring: Optional[ReceiveRing] = None):
+    # Sleep until the socket is readable or the handler's next timer is due, then drain everything queued
+    # before waiting again. The timeout only bounds how long a close request can go unnoticed.
+    if ring is None:
+        ring = ReceiveRing()
+    slots = len(ring.views)
+    with selectors.DefaultSelector() as selector:
+        selector.register(sock, selectors.EVENT_READ)
+        while not handler.closed:
+            if not selector.select(max(0.0, min(timeout, handler.poll()))):
+                continue
+            while not handler.closed:
+                count = ring.drain(sock)
+                ring.dispatch(count, handler)
+                if count < slots:
+                    break
@@ -0,0 +1,139 @@
+import math
+import time
+
+from dataclasses import dataclass
+from typing import Callable, Dict, Optional, Union
+
+from session.packet import PacketType
+from session.scheduler import SendPriority
+
+INITIAL_RTO = 0.5
+MIN_RTO = 0.05
+MAX_RTO = 2.0
+MAX_RETRANSMITS = 8
+
+
+@dataclass
+class RttEstimator:
+    """
+    Smoothed round trip time and retransmission timeout, as in RFC 6298.
+    """
+    srtt: Optional[float] = None
+    rttvar: float = 0.0
+    rto: float = INITIAL_RTO
+    min_rto: float = MIN_RTO
+    max_rto: float = MAX_RTO
+
+    def add_sample(self, rtt: float):
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt)
+            self.srtt = 0.875 * self.srtt + 0.125 * rtt
+        self.rto = min(max(self.srtt + 4 * self.rttvar, self.min_rto), self.max_rto)
+
+
+class OutgoingPacket:
+    __slots__ = ('has_crc', 'pkt_type', 'pkt_id', 'body', 'fragment_id', 'priority', 'sent_at', 'retransmit_count',
+                 'deadline')
+
+    def __init__(self, has_crc: bool, pkt_type: PacketType, pkt_id: int, body: Union[bytes, memoryview],
+                 fragment_id: int, priority: SendPriority, sent_at: float, deadline: float):
+        self.has_crc = has_crc
+        self.pkt_type = pkt_type
+        self.pkt_id = pkt_id
+        self.body = body
+        self.fragment_id = fragment_id
+        self.priority = priority
+        self.sent_at = sent_at
+        self.retransmit_count = 0
+        self.deadline = deadline
+
+
+@dataclass
+class RetransmitStats:
+    retransmits: int = 0
+    nack_retransmits: int = 0
+    timeouts: int = 0
+    given_up: int = 0
+
+
+SendFunction = Callable[[bool, PacketType, int, Union[bytes, memoryview], int, int, SendPriority], None]
+
+
+class RetransmitQueue:
+    """
+    Keeps every packet sent reliably until it's acknowledged, and sends it again, with its retransmit count
+    bumped, when the timeout derived from measured round trips runs out or the peer answers with a NACK.
+    """
+
+    def __init__(self, send: SendFunction, clock: Callable[[], float] = time.monotonic,
+                 max_retransmits: int = MAX_RETRANSMITS):
+        self.send = send
+        self.clock = clock
+        self.max_retransmits = max_retransmits
+        self.rtt = RttEstimator()
+        self.stats = RetransmitStats()
+        self.packets: Dict[int, OutgoingPacket] = {}
+        self.next_deadline = math.inf
+
+    def __contains__(self, pkt_id: int) -> bool:
+        return pkt_id in self.packets
+
+    def track(self, has_crc: bool, pkt_type: PacketType, pkt_id: int, body: Union[bytes, memoryview],
+              fragment_id: int = 0, priority: SendPriority = SendPriority.CONTROL):
+        now = self.clock()
+        packet = OutgoingPacket(has_crc, pkt_type, pkt_id, body, fragment_id, priority, now, now + self.rtt.rto)
+        self.packets[pkt_id] = packet
+        self.next_deadline = min(self.next_deadline, packet.deadline)
+
+    def acknowledge(self, pkt_id: int) -> bool:
+        packet = self.packets.pop(pkt_id, None)
+        if packet is None:
+            return False
+        # Karn's algorithm: an ACK for a retransmitted packet can't tell which copy it answers
+        if packet.retransmit_count == 0:
+            self.rtt.add_sample(self.clock() - packet.sent_at)
+        return True
+
+    def negative_acknowledge(self, pkt_id: int) -> bool:
+        """
+        Resend right away. Returns False if the packet is unknown or has run out of retransmits.
+        """
+        packet = self.packets.get(pkt_id)
+        if packet is None:
+            return False
+        self.stats.nack_retransmits += 1
+        return self.retransmit(packet, self.clock())
+
+    def poll(self, now: Optional[float] = None) -> list[int]:
+        """
+        Resend the packets whose timeout ran out. Returns IDs of packets given up on, which are no longer tracked.
+        """
+        if now is None:
+            now = self.clock()
+        if now < self.next_deadline:
+            return []
+        given_up = []
+        for packet in list(self.packets.values()):
+            if packet.deadline <= now:
+                self.stats.timeouts += 1
+                if not self.retransmit(packet, now):
+                    given_up.append(packet.pkt_id)
+        self.next_deadline = min((packet.deadline for packet in self.packets.values()), default=math.inf)
+        return given_up
+
+    def retransmit(self, packet: OutgoingPacket, now: float) -> bool:
+        if packet.retransmit_count >= self.max_retransmits:
+            del self.packets[packet.pkt_id]
+            self.stats.given_up += 1
+            return False
+        packet.retransmit_count += 1
+        # Exponential backoff, so a dead link isn't flooded
+        packet.deadline = now + min(self.rtt.rto * (1 << packet.retransmit_count), self.rtt.max_rto)
+        self.next_deadline = min(self.next_deadline, packet.deadline)
+        self.stats.retransmits += 1
+        self.send(packet.has_crc, packet.pkt_type, packet.pkt_id, packet.body, packet.retransmit_count,
+                  packet.fragment_id, packet.priority)
+        return True
@@ -0,0 +1,116 @@
+import math
+import threading
+import time
+
+from collections import deque
+from dataclasses import dataclass
+from enum import IntEnum
+from typing import Callable, Deque, Optional, Tuple, Union
+
+# Outgoing traffic is paced at the negotiated stream bitrate, this one until it's known
+DEFAULT_BITRATE_KBPS = 30000
+SEND_BURST = 64 * 1024
+
+
+class SendPriority(IntEnum):
+    INPUT = 0
+    CONTROL = 1
+    STATS = 2
+    DISCOVERY = 3
+
+
+@dataclass
+class SendClassStats:
+    sent: int = 0
+    sent_bytes: int = 0
+    queued: int = 0
+    total_delay: float = 0.0
+    max_delay: float = 0.0
+
+    @property
+    def mean_delay(self) -> float:
+        return self.total_delay / self.sent if self.sent else 0.0
+
+
+class TokenBucket:
+    """
+    Allows `rate` bytes per second on average, and bursts of up to `burst` bytes.
+    """
+
+    def __init__(self, rate: float, burst: int, now: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = now
+
+    def refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, size: int) -> float:
+        return max(0.0, (size - self.tokens) / self.rate)
+
+
+Datagram = Union[bytes, bytearray]
+
+
+class SendScheduler:
+    """
+    Every datagram the session sends goes through here. They wait in one queue per priority class, and each
+    flush() sends as many as the pacer allows, highest priority first. The worker thread flushes once per wakeup,
+    so whatever handling a batch of received packets queued goes out together.
+    """
+
+    def __init__(self, send: Callable[[Datagram], None], bitrate_kbps: int = DEFAULT_BITRATE_KBPS,
+                 burst: int = SEND_BURST, clock: Callable[[], float] = time.monotonic):
+        self.send = send
+        self.clock = clock
+        self.bucket = TokenBucket(bitrate_kbps * 125, burst, clock())
+        self.queues: list[Deque[Tuple[Datagram, float]]] = [deque() for _ in SendPriority]
+        self.stats: list[SendClassStats] = [SendClassStats() for _ in SendPriority]
+        self.lock = threading.Lock()
+        self.next_deadline = math.inf
+
+    def set_bitrate(self, bitrate_kbps: int):
+        with self.lock:
+            self.bucket.refill(self.clock())
+            self.bucket.rate = bitrate_kbps * 125
+
+    def enqueue(self, priority: SendPriority, data: Datagram):
+        with self.lock:
+            self.queues[priority].append((data, self.clock()))
+            self.stats[priority].queued += 1
+
+    def flush(self, now: Optional[float] = None) -> int:
+        """
+        Send what the pacer allows, and return the number of datagrams sent.
+        """
+        with self.lock:
+            if now is None:
+                now = self.clock()
+            bucket = self.bucket
+            bucket.refill(now)
+            count = 0
+            self.next_deadline = math.inf
+            for queue, stats in zip(self.queues, self.stats):
+                while queue:
+                    data, queued_at = queue[0]
+                    size = len(data)
+                    # A datagram bigger than the whole burst goes once the bucket is full, running it into debt
+                    needed = min(size, bucket.burst)
+                    if needed > bucket.tokens:
+                        # Lower classes wait too, so they can't take the tokens this one is waiting for
+                        self.next_deadline = now + bucket.wait_time(needed)
+                        return count
+                    queue.popleft()
+                    bucket.tokens -= size
+                    delay = now - queued_at
+                    stats.queued -= 1
+                    stats.sent += 1
+                    stats.sent_bytes += size
+                    stats.total_delay += delay
+                    if delay > stats.max_delay:
+                        stats.max_delay = delay
+                    self.send(data)
+                    count += 1
+            return count
@@ -0,0 +1,58 @@
+from typing import Optional
+
+SEND_WINDOW_SIZE = 256
+
+
+class PacketIdAllocator:
+    """
+    Hands out 16-bit packet IDs in increasing order, wrapping at 2^16, and tracks the ones still waiting for an ACK.
+    At most `window` IDs are in flight; once it is full, allocate() returns None and the sender has to wait.
+    """
+
+    def __init__(self, window: int = SEND_WINDOW_SIZE, start: int = 0):
+        self.window = window
+        self.next_id = start & 0xFFFF
+        self.in_flight: set[int] = set()
+
+    def __contains__(self, pkt_id: int) -> bool:
+        return pkt_id in self.in_flight
+
+    def __len__(self) -> int:
+        return len(self.in_flight)
+
+    @property
+    def full(self) -> bool:
+        return len(self.in_flight) >= self.window
+
+    def allocate(self, count: int = 1) -> Optional[int]:
+        """
+        Reserve `count` consecutive IDs and return the first one, or None if they don't fit in the window.
+        """
+        in_flight = self.in_flight
+        if len(in_flight) + count > self.window:
+            return None
+        pkt_id = self.next_id
+        # IDs handed out here are in flight for less than a full cycle, so only explicitly claimed IDs or
+        # ones never acknowledged can be in the way. Skip past them.
+        while any((pkt_id + i) & 0xFFFF in in_flight for i in range(count)):
+            pkt_id = (pkt_id + 1) & 0xFFFF
+        for i in range(count):
+            in_flight.add((pkt_id + i) & 0xFFFF)
+        self.next_id = (pkt_id + count) & 0xFFFF
+        return pkt_id
+
+    def claim(self, pkt_id: int) -> bool:
+        """
+        Mark an ID chosen by the caller as in flight, so allocate() won't hand it out until it's released.
+        Returns False if it was already in flight.
+        """
+        if pkt_id in self.in_flight:
+            return False
+        self.in_flight.add(pkt_id)
+        return True
+
+    def release(self, pkt_id: int) -> bool:
+        if pkt_id not in self.in_flight:
+            return False
+        self.in_flight.remove(pkt_id)
+        return True
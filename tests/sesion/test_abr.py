@@ -0,0 +1,90 @@
+import random
+from unittest import TestCase
+
+from session.abr import AbrController, StreamCounters, ABR_INTERVAL, MIN_DECREASE_INTERVAL, MIN_BITRATE_KBPS
+
+FRAMES_PER_INTERVAL = 30
+
+
+class StreamSimulation:
+    """
+    A stream over a link carrying `capacity` kbps, on top of random loss. The host sends at the target bitrate
+    whatever the framerate, and what it sends over the capacity is lost, frames the same share as bytes.
+    """
+
+    def __init__(self, bitrate_kbps: int = 20000, max_kbps: int = 30000, seed: int = 0):
+        self.now = 0.0
+        self.rng = random.Random(seed)
+        self.counters = StreamCounters()
+        self.bitrates: list[tuple[float, int]] = []
+        self.framerates: list[tuple[float, int]] = []
+        self.abr = AbrController(lambda: StreamCounters(**vars(self.counters)),
+                                 lambda kbps: self.bitrates.append((self.now, kbps)),
+                                 lambda fps: self.framerates.append((self.now, fps)),
+                                 bitrate_kbps, max_kbps, clock=lambda: self.now)
+
+    def run(self, seconds: float, capacity: int, loss: float = 0.0) -> list[int]:
+        history = []
+        for _ in range(int(seconds / ABR_INTERVAL)):
+            sent_kbps = self.abr.bitrate_kbps
+            frames = FRAMES_PER_INTERVAL * self.abr.framerate // 60
+            dropped = max(0.0, 1 - capacity / sent_kbps)
+            lost = sum(1 for _ in range(frames) if self.rng.random() < dropped + loss)
+            self.counters.frames += frames - lost
+            self.counters.lost += lost
+            self.counters.bytes += int(min(sent_kbps, capacity) * 125 * ABR_INTERVAL)
+            self.now += ABR_INTERVAL
+            self.abr.poll(self.now)
+            history.append(self.abr.bitrate_kbps)
+        return history
+
+
+class AbrControllerTest(TestCase):
+    def test_capacity_drop_and_recovery(self):
+        sim = StreamSimulation()
+        self.assertEqual(30000, max(sim.run(30, capacity=40000)))
+        history = sim.run(30, capacity=8000)
+        # Down to what the link carries within a couple of seconds, and no further than the floor
+        self.assertLessEqual(history[int(2 / ABR_INTERVAL)], 8000)
+        self.assertGreater(min(history), MIN_BITRATE_KBPS)
+        # Probing upwards overshoots the link, but only briefly and not by much
+        self.assertLess(sum(history) / len(history), 8000)
+        self.assertLess(max(history[1:]), 8000 * 1.1)
+        decreases = [t for t, kbps in sim.bitrates if 30 <= t]
+        self.assertTrue(all(b - a >= MIN_DECREASE_INTERVAL for a, b in zip(decreases, decreases[1:])))
+        history = sim.run(60, capacity=40000)
+        self.assertEqual(30000, history[-1])
+        self.assertEqual([], sim.framerates)
+
+    def test_hysteresis(self):
+        sim = StreamSimulation(seed=1)
+        sim.run(10, capacity=40000)
+        changes = len(sim.bitrates)
+        # Loss between the healthy and congested thresholds mostly holds the bitrate, despite the noise
+        sim.run(60, capacity=40000, loss=0.03)
+        self.assertLessEqual(len(sim.bitrates) - changes, 3)
+
+    def test_loss_spike(self):
+        sim = StreamSimulation(seed=2)
+        sim.run(10, capacity=40000)
+        before = sim.abr.bitrate_kbps
+        sim.run(ABR_INTERVAL, capacity=40000, loss=0.3)
+        sim.run(10, capacity=40000)
+        self.assertEqual(1, sim.abr.stats.decreases)
+        self.assertEqual(int(before * 0.75), min(kbps for _, kbps in sim.bitrates))
+
+    def test_framerate_fallback(self):
+        sim = StreamSimulation(seed=3)
+        sim.run(30, capacity=1500)
+        self.assertEqual(MIN_BITRATE_KBPS, sim.abr.bitrate_kbps)
+        self.assertEqual([30], [fps for _, fps in sim.framerates])
+        sim.run(60, capacity=40000)
+        self.assertEqual([30, 60], [fps for _, fps in sim.framerates])
+        self.assertGreater(sim.abr.bitrate_kbps, 2 * MIN_BITRATE_KBPS)
+
+    def test_idle_stream(self):
+        sim = StreamSimulation()
+        for _ in range(20):
+            sim.now += ABR_INTERVAL
+            sim.abr.poll(sim.now)
+        self.assertEqual([], sim.bitrates)
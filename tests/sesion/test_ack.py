@@ -0,0 +1,61 @@
+from unittest import TestCase
+
+from session.ack import AckScheduler
+from session.channels.base import Channel
+from session.packet import Packet, PacketHeader, PacketType
+from tests.sesion.test_retransmit import FakeClock
+from tests.sesion.test_sequence import RecordingClient
+
+
+def _reliable(pkt_type: PacketType, pkt_id: int, body: bytes, fragment_id: int = 0) -> Packet:
+    header = PacketHeader(channel=1, fragment_id=fragment_id, pkt_id=pkt_id)
+    header.pkt_type = pkt_type
+    return Packet(header, body)
+
+
+class AckSchedulerTest(TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.sent = []
+        self.acks = AckScheduler(lambda has_crc, pkt_type, pkt_id, body: self.sent.append((pkt_type, pkt_id)),
+                                 delay=0.002, clock=self.clock)
+
+    def test_held_until_deadline(self):
+        self.acks.ack(1)
+        self.acks.ack(2)
+        self.acks.poll(0.001)
+        self.assertEqual([], self.sent)
+        self.clock.now = 0.003
+        self.acks.poll(self.clock.now)
+        self.assertEqual([(PacketType.ACK, 1), (PacketType.ACK, 2)], self.sent)
+        self.assertEqual(2, self.acks.stats.sent)
+        self.assertAlmostEqual(0.003, self.acks.stats.max_added_latency)
+
+    def test_coalesced(self):
+        self.acks.nack(1)
+        self.acks.ack(2)
+        self.acks.ack(2)
+        self.acks.ack(1)
+        self.acks.nack(1)
+        self.acks.flush()
+        self.assertEqual([(PacketType.ACK, 1), (PacketType.ACK, 2)], self.sent)
+        self.assertEqual(3, self.acks.stats.saved)
+
+
+class ChannelAckTest(TestCase):
+    def test_reliable_keyframe(self):
+        clock = FakeClock()
+        client = RecordingClient()
+        channel = Channel(client, 1)
+        channel.acks.clock = clock
+        packets = [_reliable(PacketType.RELIABLE, 0, b'\x01' * 1000, 127)]
+        packets.extend(_reliable(PacketType.RELIABLE_FRAG, 1 + i, b'\x02' * 1000, i) for i in range(127))
+        for packet in packets:
+            channel.handle_packet(packet)
+        # The host resent one fragment before our ACK for it went out
+        channel.handle_packet(packets[5])
+        self.assertEqual([], client.sent)
+        clock.now = channel.poll(clock.now)
+        channel.poll(clock.now)
+        self.assertEqual([(PacketType.ACK, i) for i in range(128)], client.sent)
+        self.assertEqual(1, channel.acks.stats.saved)
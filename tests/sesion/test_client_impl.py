@@ -0,0 +1,35 @@
+import asyncio
+import socket
+from unittest import TestCase
+
+from session.client_impl import ClientImpl
+from session.packet import Packet, PacketHeader
+
+
+class ClientImplTest(TestCase):
+    def setUp(self):
+        self.host = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.host.bind(('127.0.0.1', 0))
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setblocking(False)
+        self.loop = asyncio.new_event_loop()
+        self.client = ClientImpl(self.loop, self.sock, self.host.getsockname(), bytes(16))
+
+    def tearDown(self):
+        self.sock.close()
+        self.host.close()
+        self.loop.close()
+
+    def test_garbled_datagrams_dropped(self):
+        # The type byte doesn't name any packet type, and the CRC doesn't match
+        data = Packet(PacketHeader(type_and_crc=0xFF, dst_conn_id=self.client.src_conn_id), b'garbled').serialize()
+        data[-1] ^= 0xFF
+        bad_crc = self.client.bad_crc_packets.value
+        self.client.handle_packet(bytes(data))
+        self.assertEqual(bad_crc + 1, self.client.bad_crc_packets.value)
+
+        invalid = self.client.invalid_packets.value
+        # Without a CRC to catch it
+        self.client.handle_packet(bytes(Packet(PacketHeader(type_and_crc=0x7F), b'garbled').serialize()))
+        self.client.handle_packet(b'short')
+        self.assertEqual(invalid + 2, self.client.invalid_packets.value)
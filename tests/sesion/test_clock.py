@@ -0,0 +1,76 @@
+import random
+from unittest import TestCase
+
+from session.clock import ClockSync, TimestampUnwrapper, MAX_OUTLIERS
+
+
+def _timestamp(seconds: float) -> int:
+    return int(seconds * 65536) & 0xFFFFFFFF
+
+
+class HostClock:
+    # Host time runs `drift` slower than ours and starts at `start`
+
+    def __init__(self, start: float, drift: float):
+        self.start = start
+        self.drift = drift
+
+    def at(self, local_time: float) -> float:
+        return self.start + local_time * (1 - self.drift)
+
+
+class ClockSyncTest(TestCase):
+    def simulate(self, sync: ClockSync, host: HostClock, start: float, seconds: float, rng: random.Random):
+        local_time = start
+        while local_time < start + seconds:
+            delay = 0.002 + rng.expovariate(1 / 0.003)
+            sync.add_sample(_timestamp(host.at(local_time)), local_time + delay)
+            local_time += 0.01
+
+    def test_offset_and_drift(self):
+        sync = ClockSync()
+        host = HostClock(start=1000.0, drift=50e-6)
+        self.simulate(sync, host, 0, 60, random.Random(0))
+        self.assertAlmostEqual(50, sync.drift, delta=5)
+        # A packet as fast as the fastest ones has no delay over the minimum
+        sent = host.at(60.0)
+        self.assertAlmostEqual(0.0, sync.one_way_delay(_timestamp(sent), 60.0 + 0.002), delta=0.001)
+        self.assertAlmostEqual(0.025, sync.one_way_delay(_timestamp(sent), 60.0 + 0.027), delta=0.001)
+        self.assertAlmostEqual(60.002, sync.to_local(_timestamp(sent)), delta=0.001)
+        self.assertGreater(sync.stats.jitter, 0.001)
+        self.assertEqual(0, sync.stats.outliers)
+
+    def test_wraparound(self):
+        sync = ClockSync()
+        # Host timestamps wrap 2^32 ten seconds in
+        host = HostClock(start=65536.0 - 10, drift=0)
+        self.simulate(sync, host, 0, 20, random.Random(1))
+        self.assertAlmostEqual(0, sync.drift, delta=20)
+        self.assertAlmostEqual(0.0, sync.one_way_delay(_timestamp(host.at(20.0)), 20.002), delta=0.001)
+
+    def test_outliers(self):
+        sync = ClockSync()
+        host = HostClock(start=1000.0, drift=0)
+        rng = random.Random(2)
+        self.simulate(sync, host, 0, 10, rng)
+        # A few stamps from the future are ignored
+        for i in range(3):
+            sync.add_sample(_timestamp(host.at(10.0 + i / 100) + 0.5), 10.0 + i / 100)
+        self.assertEqual(3, sync.stats.outliers)
+        sync.add_sample(_timestamp(host.at(10.05)), 10.052)
+        self.assertAlmostEqual(0.0, sync.one_way_delay(_timestamp(host.at(10.0)), 10.002), delta=0.001)
+        # A step in the host clock that persists is followed
+        host.start += 5
+        self.simulate(sync, host, 10.1, 5, rng)
+        self.assertEqual(1, sync.stats.resets)
+        self.assertEqual(3 + MAX_OUTLIERS, sync.stats.outliers)
+        self.assertAlmostEqual(0.0, sync.one_way_delay(_timestamp(host.at(15.0)), 15.002), delta=0.001)
+
+
+class TimestampUnwrapperTest(TestCase):
+    def test_unwrap(self):
+        unwrapper = TimestampUnwrapper()
+        self.assertEqual(0xFFFFFFF0, unwrapper.unwrap(0xFFFFFFF0))
+        self.assertEqual(0x100000010, unwrapper.unwrap(0x10))
+        self.assertEqual(0xFFFFFFFF, unwrapper.peek(0xFFFFFFFF))
+        self.assertEqual(0x100000020, unwrapper.unwrap(0x20))
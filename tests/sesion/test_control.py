@@ -0,0 +1,75 @@
+from unittest import TestCase
+
+from protobuf.steammessages_remoteplay_pb2 import k_EStreamChannelControl, k_EStreamControlInputKeyDown, \
+    k_EStreamControlInputMouseMotion, k_EStreamControlKeepAlive, k_EStreamControlSetTargetBitrate, \
+    CNegotiationInitMsg, k_EStreamVideoCodecH264, k_EStreamAudioCodecOpus
+from session.channels.control import Control, probed_bitrates, MAX_DECODE_BITRATE_KBPS, MAX_BURST_BITRATE_KBPS, \
+    MIN_DECODE_BITRATE_KBPS, PROBE_BITRATE_SHARE
+from session.client import DEFAULT_MTU
+from session.packet import PacketType
+from session.probe import ProbeResult
+from session.scheduler import SendPriority
+from tests.sesion.test_sequence import RecordingClient
+
+
+class NegotiatingClient(RecordingClient):
+
+    def __init__(self):
+        super().__init__()
+        self.bitrates: list[int] = []
+
+    def on_bitrate_changed(self, bitrate_kbps: int):
+        self.bitrates.append(bitrate_kbps)
+
+
+class ProbedBitratesTest(TestCase):
+    def test_no_result(self):
+        self.assertEqual((MAX_DECODE_BITRATE_KBPS, MAX_BURST_BITRATE_KBPS), probed_bitrates(None))
+        self.assertEqual((MAX_DECODE_BITRATE_KBPS, MAX_BURST_BITRATE_KBPS), probed_bitrates(ProbeResult(sent=10)))
+        # Answered, but no train came back to measure
+        self.assertEqual((MAX_DECODE_BITRATE_KBPS, MAX_BURST_BITRATE_KBPS),
+                         probed_bitrates(ProbeResult(sent=10, received=10)))
+
+    def test_loss(self):
+        decode, burst = probed_bitrates(ProbeResult(sent=100, received=75, bandwidth_kbps=20000))
+        self.assertEqual(15000, burst)
+        self.assertEqual(int(15000 * PROBE_BITRATE_SHARE), decode)
+
+    def test_clamped(self):
+        self.assertEqual((MIN_DECODE_BITRATE_KBPS, MIN_DECODE_BITRATE_KBPS),
+                         probed_bitrates(ProbeResult(sent=10, received=10, bandwidth_kbps=500)))
+        self.assertEqual((MAX_DECODE_BITRATE_KBPS, MAX_BURST_BITRATE_KBPS),
+                         probed_bitrates(ProbeResult(sent=10, received=10, bandwidth_kbps=1000000)))
+
+
+class ControlTest(TestCase):
+    def test_message_priority(self):
+        control = Control(RecordingClient(), k_EStreamChannelControl)
+        self.assertEqual(SendPriority.INPUT, control.message_priority(k_EStreamControlInputKeyDown))
+        self.assertEqual(SendPriority.INPUT, control.message_priority(k_EStreamControlInputMouseMotion))
+        self.assertEqual(control.send_priority, control.message_priority(k_EStreamControlKeepAlive))
+        self.assertEqual(control.send_priority, control.message_priority(k_EStreamControlSetTargetBitrate))
+        self.assertNotEqual(SendPriority.INPUT, control.send_priority)
+
+    def test_negotiation_config_lowers_mtu(self):
+        client = NegotiatingClient()
+        control = Control(client, k_EStreamChannelControl)
+        message = CNegotiationInitMsg(supported_audio_codecs=[k_EStreamAudioCodecOpus],
+                                      supported_video_codecs=[k_EStreamVideoCodecH264])
+        control.send_negotiation_config(5, message, ProbeResult(sent=10, received=10, bandwidth_kbps=10000,
+                                                                path_mtu=1024))
+        self.assertEqual(1024, client.mtu)
+        self.assertEqual([(PacketType.RELIABLE, 5)], client.sent)
+        self.assertEqual([int(10000 * PROBE_BITRATE_SHARE)], client.bitrates)
+        self.assertEqual(client.bitrates[0], control.max_bitrate_kbps)
+
+    def test_negotiation_config_keeps_mtu(self):
+        client = NegotiatingClient()
+        control = Control(client, k_EStreamChannelControl)
+        control.send_negotiation_config(5, CNegotiationInitMsg(), None)
+        self.assertEqual(DEFAULT_MTU, client.mtu)
+        # A path that takes more than we send doesn't raise it either
+        control.send_negotiation_config(6, CNegotiationInitMsg(), ProbeResult(sent=1, received=1, path_mtu=9000))
+        self.assertEqual(DEFAULT_MTU, client.mtu)
+        self.assertEqual([(PacketType.RELIABLE, 5), (PacketType.RELIABLE, 6)], client.sent)
+        self.assertEqual([MAX_DECODE_BITRATE_KBPS] * 2, client.bitrates)
@@ -0,0 +1,147 @@
+import secrets
+import struct
+import threading
+from unittest import TestCase
+
+from protobuf.steammessages_remoteplay_pb2 import CStartVideoDataMsg, k_EStreamFrameResultDisplayed
+from service.ccrypto import ZERO_IV, symmetric_key
+from session.channels.video import Video, VideoFrameHeader
+from session.decrypt import DecryptPool
+from session.frame import DataFrameHeader
+from session.framestats import EVENT_DECODE_BEGIN, EVENT_DECODE_END, FRAME_EVENTS
+from tests.sesion.test_sequence import RecordingClient
+
+
+class DecryptPoolTest(TestCase):
+    def setUp(self):
+        self.key = symmetric_key(secrets.token_bytes(16))
+        self.emitted: list[tuple[int, bytes]] = []
+        self.failed: list[int] = []
+        self.most_pending = 0
+
+    def sink(self, tag: int, data: memoryview):
+        self.most_pending = max(self.most_pending, len(self.pool.pending))
+        self.emitted.append((tag, bytes(data)))
+
+    def test_emitted_in_order(self):
+        self.pool = DecryptPool(self.key, ZERO_IV, self.sink, workers=4, max_in_flight=6)
+        # Big frames between small ones, so later frames tend to finish first
+        plains = [secrets.token_bytes(200 * 1024 if i % 3 == 0 else 100) for i in range(30)]
+        for i, plain in enumerate(plains):
+            self.pool.submit(i, self.key.encrypt(plain, ZERO_IV, False))
+        self.pool.drain()
+        self.assertEqual(list(enumerate(plains)), self.emitted)
+        self.assertLessEqual(self.most_pending, 6)
+        self.pool.close()
+
+    def test_failures_keep_their_place(self):
+        self.pool = DecryptPool(self.key, ZERO_IV, self.sink, workers=2, on_error=self.failed.append)
+        for i in range(6):
+            encrypted = self.key.encrypt(bytes([i]) * 40, ZERO_IV, False)
+            if i == 3:
+                # Cut short of a whole block
+                encrypted = encrypted[:-1]
+            self.pool.submit(i, encrypted)
+        self.pool.close()
+        self.assertEqual([0, 1, 2, 4, 5], [tag for tag, _ in self.emitted])
+        self.assertEqual([3], self.failed)
+        self.assertEqual(1, self.pool.stats.failed)
+
+    def test_plain_frames_keep_their_place(self):
+        self.pool = DecryptPool(self.key, ZERO_IV, self.sink, workers=4, max_in_flight=6)
+        plains = [secrets.token_bytes(200 * 1024 if i % 2 == 0 else 100) for i in range(20)]
+        for i, plain in enumerate(plains):
+            # The big ones are encrypted, the small ones between them would come out first if they skipped ahead
+            if i % 2 == 0:
+                self.pool.submit(i, self.key.encrypt(plain, ZERO_IV, False))
+            else:
+                self.pool.submit(i, plain, decrypt=False)
+        self.pool.close()
+        self.assertEqual(list(enumerate(plains)), self.emitted)
+        self.assertEqual(20, self.pool.stats.emitted)
+
+    def test_empty_frames_fail(self):
+        self.pool = DecryptPool(self.key, ZERO_IV, self.sink, workers=2, max_in_flight=2, on_error=self.failed.append)
+        for i, plain in enumerate([b'a', None, b'c', b'd', None, b'f']):
+            # Nothing at all to decrypt, just the video header
+            self.pool.submit(i, self.key.encrypt(plain, ZERO_IV, False) if plain is not None else b'')
+        self.pool.close()
+        self.assertEqual([(0, b'a'), (2, b'c'), (3, b'd'), (5, b'f')], self.emitted)
+        self.assertEqual([1, 4], self.failed)
+        self.assertEqual(0, len(self.pool.pending))
+
+    def test_empty_unpad(self):
+        with self.assertRaises(ValueError):
+            self.key.decrypt_into(b'', ZERO_IV, bytearray())
+
+
+
+class BlockingVideo(Video):
+
+    def __init__(self, client: RecordingClient):
+        super().__init__(client, CStartVideoDataMsg(channel=3), decrypt_workers=1)
+        self.decoding = threading.Event()
+        self.frames: list[bytes] = []
+
+    def handle_video(self, header: VideoFrameHeader, data: memoryview):
+        self.decoding.wait(5)
+        self.frames.append(bytes(data))
+
+
+class VideoDecryptPoolTest(TestCase):
+    def test_decode_timed_on_worker(self):
+        client = RecordingClient()
+        video = BlockingVideo(client)
+        plain = secrets.token_bytes(1000)
+        payload = struct.pack('<HBHH', 1, 0x20, 0, 0) + symmetric_key(client.auth_token).encrypt(plain, ZERO_IV, False)
+        video.release_data((DataFrameHeader(7, 0, 0, 0), payload))
+        events = video.frame_stats.events
+        base = 7 * len(FRAME_EVENTS)
+        self.assertNotEqual(0, events[base + EVENT_DECODE_BEGIN])
+        # Only queued for the worker so far
+        self.assertEqual(0, events[base + EVENT_DECODE_END])
+        video.decoding.set()
+        video.decrypt_pool.drain()
+        video.close()
+        self.assertEqual([plain], video.frames)
+        self.assertNotEqual(0, events[base + EVENT_DECODE_END])
+        self.assertEqual(k_EStreamFrameResultDisplayed, video.frame_stats.results[7])
+
+    def test_empty_frame_without_pool(self):
+        video = Video(RecordingClient(), CStartVideoDataMsg(channel=3))
+        failures = video.decrypt_failures.value
+        video.handle_data(None, struct.pack('<HBHH', 1, 0x20, 0, 0))
+        self.assertEqual(failures + 1, video.decrypt_failures.value)
+
+
+class RecordingVideo(Video):
+
+    def __init__(self, client: RecordingClient):
+        super().__init__(client, CStartVideoDataMsg(channel=3), decrypt_workers=4)
+        self.frames: list[tuple[int, bytes]] = []
+        self.threads: set[str] = set()
+
+    def handle_video(self, header: VideoFrameHeader, data: memoryview):
+        self.threads.add(threading.current_thread().name)
+        self.frames.append((header.sequence, bytes(data)))
+
+
+class VideoFrameOrderTest(TestCase):
+    def test_plain_frames_in_order(self):
+        client = RecordingClient()
+        video = RecordingVideo(client)
+        key = symmetric_key(client.auth_token)
+        expected = []
+        for sequence in range(20):
+            if sequence % 2 == 0:
+                plain = secrets.token_bytes(200 * 1024)
+                payload = struct.pack('<HBHH', sequence, 0x20, 0, 0) + key.encrypt(plain, ZERO_IV, False)
+            else:
+                plain = secrets.token_bytes(100)
+                payload = struct.pack('<HBHH', sequence, 0, 0, 0) + plain
+            expected.append((sequence, plain))
+            video.release_data((DataFrameHeader(sequence, 0, 0, 0), payload))
+        video.close()
+        self.assertEqual(expected, video.frames)
+        self.assertNotIn(threading.current_thread().name, video.threads)
+        self.assertEqual(20, video.frame_stats.displayed)
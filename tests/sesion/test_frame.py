@@ -1,8 +1,11 @@
+import sys
 from unittest import TestCase
 
 import secrets
 
-from session.frame import frame_encrypt, frame_decrypt
+from service.ccrypto import ZERO_IV, symmetric_key
+from session.frame import frame_encrypt, frame_decrypt, FrameAssembler, PacketWindow
+from session.packet import Packet, PacketHeader, PacketType
 
 
 class FrameTest(TestCase):
@@ -10,4 +13,176 @@ class FrameTest(TestCase):
         plain = secrets.token_bytes(20)
         key = secrets.token_bytes(16)
         encrypted = frame_encrypt(plain, key, 0)
-        frame_decrypt(encrypted, key, 0)
+        self.assertEqual(plain, frame_decrypt(encrypted, key, 0))
+        with self.assertRaises(ValueError):
+            frame_decrypt(encrypted, key, 1)
+
+    def test_decrypt_into(self):
+        key = symmetric_key(secrets.token_bytes(16))
+        # Both sides of the switch to ECB
+        for size in [20, 4000]:
+            plain = secrets.token_bytes(size)
+            encrypted = key.encrypt(plain, ZERO_IV, False)
+            self.assertEqual(plain, bytes(key.decrypt_into(encrypted, ZERO_IV, memoryview(bytearray(len(encrypted))))))
+
+
+class PacketWindowTest(TestCase):
+    def test_duplicates(self):
+        window = PacketWindow(64)
+        self.assertTrue(window.add(10))
+        self.assertTrue(window.add(12))
+        self.assertTrue(window.add(11))
+        self.assertFalse(window.add(10))
+        self.assertFalse(window.add(11))
+        self.assertFalse(window.add(12))
+
+    def test_wraparound(self):
+        window = PacketWindow(64)
+        for pkt_id in [65534, 65535, 0, 1]:
+            self.assertTrue(window.add(pkt_id))
+        self.assertFalse(window.add(65535))
+        self.assertFalse(window.add(0))
+        # A whole cycle later the same IDs are new packets again
+        for i in range(2, 0x10000 + 2):
+            window.add(i & 0xFFFF)
+        self.assertFalse(window.add(1))
+        self.assertTrue(window.add(3))
+
+    def test_too_old(self):
+        window = PacketWindow(64)
+        window.add(100)
+        window.add(200)
+        self.assertFalse(window.add(130))
+        self.assertTrue(window.add(150))
+
+
+class FrameAssemblerTest(TestCase):
+    def test_duplicate_dropped(self):
+        assembler = FrameAssembler(4)
+        self.assertTrue(assembler.add_packet(_packet(PacketType.UNRELIABLE, 7, b'frame')))
+        self.assertFalse(assembler.add_packet(_packet(PacketType.UNRELIABLE, 7, b'frame')))
+        self.assertEqual(b'frame', assembler.poll_frame().body)
+        self.assertIsNone(assembler.poll_frame())
+
+    def test_thread_safe_delivery(self):
+        assembler = FrameAssembler(4, thread_safe=True)
+        self.assertTrue(assembler.add_packet(_packet(PacketType.UNRELIABLE, 1, b'first')))
+        self.assertTrue(assembler.add_packet(_packet(PacketType.UNRELIABLE, 2, b'second')))
+        self.assertEqual(b'first', assembler.poll_frame().body)
+        self.assertEqual(b'second', assembler.poll_frame().body)
+        self.assertIsNone(assembler.poll_frame())
+
+    def test_thread_safe_copies_ring_slots(self):
+        assembler = FrameAssembler(4, thread_safe=True)
+        slot = bytearray(b'first')
+        self.assertTrue(assembler.add_packet(_packet(PacketType.UNRELIABLE, 1, memoryview(slot))))
+        # The receive ring reuses the slot for the next datagram
+        slot[:] = b'other'
+        self.assertEqual(b'first', assembler.poll_frame().body)
+
+    def test_fragments_reordered(self):
+        assembler = FrameAssembler(4)
+        packets = _fragmented(100, [b'aaaa', b'bbbb', b'cccc', b'dd'])
+        for i in [2, 3, 0, 1]:
+            self.assertTrue(assembler.add_packet(packets[i]))
+        frame = assembler.poll_frame()
+        self.assertEqual(b'aaaabbbbccccdd', frame.body)
+        self.assertEqual(100, frame.header.pkt_id)
+        self.assertFalse(assembler.pending_frames)
+
+    def test_frames_interleaved(self):
+        assembler = FrameAssembler(4)
+        first = _fragmented(65534, [b'111', b'111', b'1'])
+        second = _fragmented(1, [b'22', b'22', b'2'])
+        for packet in [second[1], first[0], first[2], second[0], second[2], first[1]]:
+            self.assertTrue(assembler.add_packet(packet))
+        self.assertEqual(b'22222', assembler.poll_frame().body)
+        self.assertEqual(b'1111111', assembler.poll_frame().body)
+
+    def test_oversized_fragment_rejected(self):
+        assembler = FrameAssembler(4)
+        packets = _fragmented(10, [b'aaaa', b'bbbbbb', b'cc'])
+        self.assertTrue(assembler.add_packet(packets[0]))
+        self.assertFalse(assembler.add_packet(packets[1]))
+        self.assertTrue(assembler.add_packet(packets[2]))
+        self.assertIsNone(assembler.poll_frame())
+
+    def test_lost_fragment_expires(self):
+        now = [0.0]
+        assembler = FrameAssembler(4, timeout=0.1, clock=lambda: now[0])
+        lost = _fragmented(10, [b'aa', b'bb', b'c'])
+        for packet in [lost[0], lost[2]]:
+            self.assertTrue(assembler.add_packet(packet))
+        now[0] = 0.05
+        following = _fragmented(13, [b'dd', b'e'])
+        for packet in following:
+            self.assertTrue(assembler.add_packet(packet))
+        self.assertEqual(b'dde', assembler.poll_frame().body)
+        self.assertIn(10, assembler.pending_frames)
+        now[0] = 0.2
+        assembler.expire()
+        self.assertFalse(assembler.pending_frames)
+        self.assertEqual(1, assembler.stats.expired_frames)
+        self.assertEqual(1, assembler.stats.missing_fragments)
+
+    def test_reliable_frames_wait_longer(self):
+        now = [0.0]
+        assembler = FrameAssembler(4, timeout=0.1, reliable_timeout=5, clock=lambda: now[0])
+        packets = _fragmented(10, [b'aa', b'b'])
+        packets[0].header.pkt_type = PacketType.RELIABLE
+        packets[1].header.pkt_type = PacketType.RELIABLE_FRAG
+        self.assertTrue(assembler.add_packet(packets[0]))
+        now[0] = 1
+        assembler.expire()
+        self.assertTrue(assembler.add_packet(packets[1]))
+        self.assertEqual(b'aab', assembler.poll_frame().body)
+        self.assertEqual(0, assembler.stats.expired_frames)
+
+    def test_first_packet_time_kept(self):
+        now = [1.0]
+        assembler = FrameAssembler(4, clock=lambda: now[0])
+        packets = _fragmented(10, [b'aa', b'bb', b'c'])
+        self.assertTrue(assembler.add_packet(packets[1]))
+        now[0] = 1.1
+        self.assertTrue(assembler.add_packet(packets[0]))
+        now[0] = 1.2
+        self.assertTrue(assembler.add_packet(packets[2]))
+        self.assertTrue(assembler.add_packet(_packet(PacketType.UNRELIABLE, 13, b'd')))
+        self.assertEqual([(b'aabbc', 1.0), (b'd', 1.2)],
+                         [(bytes(frame.body), frame.started) for frame in iter(assembler.poll_frame, None)])
+
+    def test_duplicates_counted(self):
+        assembler = FrameAssembler(4)
+        packets = _fragmented(10, [b'aa', b'b'])
+        self.assertTrue(assembler.add_packet(packets[0]))
+        self.assertFalse(assembler.add_packet(packets[0]))
+        self.assertEqual(1, assembler.stats.duplicates)
+
+    def test_soak_memory_flat(self):
+        # Three hours of 20ms audio packets: ids and timestamps both wrap several times
+        packets_per_second = 50
+        total = 3 * 3600 * packets_per_second
+        warmup = 600 * packets_per_second
+        assembler = FrameAssembler(4)
+        baseline = 0
+        for i in range(total):
+            if i == warmup:
+                baseline = sys.getallocatedblocks()
+            timestamp = (i * 65536 // packets_per_second) & 0xFFFFFFFF
+            self.assertTrue(assembler.add_packet(_packet(PacketType.UNRELIABLE, i & 0xFFFF, b'\x00', timestamp)))
+            assembler.poll_frame()
+        growth = sys.getallocatedblocks() - baseline
+        self.assertLess(growth, 100)
+
+
+def _packet(pkt_type: PacketType, pkt_id: int, body: bytes, timestamp: int = 0, fragment_id: int = 0) -> Packet:
+    header = PacketHeader(channel=4, fragment_id=fragment_id, pkt_id=pkt_id, send_timestamp=timestamp)
+    header.pkt_type = pkt_type
+    return Packet(header, body)
+
+
+def _fragmented(start_id: int, parts: list[bytes], timestamp: int = 0) -> list[Packet]:
+    packets = [_packet(PacketType.UNRELIABLE, start_id, parts[0], timestamp, len(parts) - 1)]
+    packets.extend(_packet(PacketType.UNRELIABLE_FRAG, (start_id + 1 + i) & 0xFFFF, part, timestamp, i)
+                   for i, part in enumerate(parts[1:]))
+    return packets
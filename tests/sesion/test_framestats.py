@@ -0,0 +1,135 @@
+from unittest import TestCase
+
+from protobuf.steammessages_remoteplay_pb2 import CFrameStatsListMsg, k_EStreamingVideoData, \
+    k_EStreamStatsFrameEvents, k_EStreamFrameEventRecv, k_EStreamFrameEventComplete, k_EStreamFrameEventDecodeBegin, \
+    k_EStreamFrameEventDecodeEnd, k_EStreamFrameResultDisplayed, k_EStreamFrameResultDroppedNetworkLost, \
+    k_EStreamFrameResultDroppedLate, k_EFrameStatPacketLossPercentage, k_EFrameStatFPS
+from session.channels.stats import Stats
+from session.framestats import FrameStatsRecorder
+from session.packet import PacketType
+from tests.sesion.test_sequence import RecordingClient
+
+TICKS_PER_FRAME = 1092
+
+
+def _play(recorder: FrameStatsRecorder, frame_id: int, size: int = 1000):
+    timestamp = 1 + frame_id * TICKS_PER_FRAME
+    recorder.received(frame_id & 0xFFFF, size, timestamp, timestamp + 5)
+    recorder.decode_begin(frame_id & 0xFFFF, timestamp + 10)
+    recorder.decode_end(frame_id & 0xFFFF, timestamp + 100)
+
+
+class FrameStatsRecorderTest(TestCase):
+    def setUp(self):
+        self.recorder = FrameStatsRecorder(k_EStreamingVideoData, capacity=16)
+
+    def test_reported_once(self):
+        for frame_id in range(3):
+            _play(self.recorder, frame_id)
+        message = self.recorder.collect()
+        self.assertEqual([0, 1, 2], [stats.frame_id for stats in message.stats])
+        self.assertEqual(2, message.latest_frame_id)
+        self.assertEqual([(k_EStreamFrameEventRecv, 1093), (k_EStreamFrameEventComplete, 1098),
+                          (k_EStreamFrameEventDecodeBegin, 1103), (k_EStreamFrameEventDecodeEnd, 1193)],
+                         [(event.event_id, event.timestamp) for event in message.stats[1].events])
+        self.assertEqual(k_EStreamFrameResultDisplayed, message.stats[1].result)
+        self.assertEqual(1000, message.stats[1].frame_size)
+        self.assertIsNone(self.recorder.collect())
+
+    def test_waits_for_pending(self):
+        _play(self.recorder, 0)
+        self.recorder.received(1, 1000, 2000)
+        self.recorder.received(2, 1000, 3000)
+        self.assertEqual([0], [stats.frame_id for stats in self.recorder.collect().stats])
+        self.assertIsNone(self.recorder.collect())
+        for frame_id in [1, 2]:
+            self.recorder.decode_begin(frame_id, 3100)
+            self.recorder.decode_end(frame_id, 3200)
+        self.assertEqual([1, 2], [stats.frame_id for stats in self.recorder.collect().stats])
+
+    def test_lost_and_late(self):
+        for frame_id in [0, 1, 3, 4]:
+            _play(self.recorder, frame_id)
+        self.assertEqual(1, self.recorder.lost)
+        self.recorder.received(2, 1000, 5000)
+        self.recorder.dropped_late(2)
+        _play(self.recorder, 5)
+        _play(self.recorder, 7)
+        results = [stats.result for stats in self.recorder.collect().stats]
+        self.assertEqual([k_EStreamFrameResultDisplayed] * 2 + [k_EStreamFrameResultDroppedLate] +
+                         [k_EStreamFrameResultDisplayed] * 3 + [k_EStreamFrameResultDroppedNetworkLost] +
+                         [k_EStreamFrameResultDisplayed], results)
+        self.assertEqual((6, 1, 1), (self.recorder.displayed, self.recorder.lost, self.recorder.late))
+        self.assertAlmostEqual(25.0, self.recorder.loss_percentage)
+
+    def test_wraparound(self):
+        for frame_id in range(0xFFFE, 0x10002):
+            _play(self.recorder, frame_id)
+        message = self.recorder.collect()
+        self.assertEqual([0xFFFE, 0xFFFF, 0, 1], [stats.frame_id for stats in message.stats])
+        self.assertEqual(1, message.latest_frame_id)
+        self.assertEqual(0, self.recorder.lost)
+
+    def test_overrun(self):
+        for frame_id in range(40):
+            _play(self.recorder, frame_id)
+        message = self.recorder.collect()
+        self.assertEqual(list(range(24, 40)), [stats.frame_id for stats in message.stats])
+
+
+class RecordingStatsClient(RecordingClient):
+
+    def __init__(self):
+        super().__init__()
+        self.messages: list[CFrameStatsListMsg] = []
+        self.body = bytearray()
+        self.fragments = 0
+
+    def send_packet(self, has_crc: bool, pkt_type: PacketType, pkt_id: int, channel: int, payload: bytes = b'',
+                    pad_to: int = 0, retransmit_count: int = 0, fragment_id: int = 0, *args):
+        super().send_packet(has_crc, pkt_type, pkt_id, channel, payload, pad_to, retransmit_count, fragment_id, *args)
+        if pkt_type == PacketType.RELIABLE:
+            self.body = bytearray(payload)
+            self.fragments = fragment_id
+        elif pkt_type == PacketType.RELIABLE_FRAG:
+            self.body += payload
+            self.fragments -= 1
+        else:
+            return
+        if self.fragments == 0 and self.body[0] == k_EStreamStatsFrameEvents:
+            self.messages.append(CFrameStatsListMsg.FromString(bytes(self.body[1:])))
+
+
+class StatsChannelTest(TestCase):
+    def setUp(self):
+        self.client = RecordingStatsClient()
+        self.stats = Stats(self.client, 2)
+        self.recorder = FrameStatsRecorder(k_EStreamingVideoData)
+        self.stats.add_recorder(self.recorder)
+
+    def test_reports_every_interval(self):
+        self.assertEqual(1.0, self.stats.poll(0.0))
+        for frame_id in range(60):
+            _play(self.recorder, frame_id)
+        self.stats.poll(0.5)
+        self.assertEqual([], self.client.messages)
+        self.assertEqual(2.0, self.stats.poll(1.0))
+        self.assertEqual(1, len(self.client.messages))
+        self.assertEqual(60, len(self.client.messages[0].stats))
+        self.stats.poll(2.0)
+        self.assertEqual(1, len(self.client.messages))
+
+    def test_session_stats(self):
+        for frame_id in [0, 1, 2, 4]:
+            _play(self.recorder, frame_id)
+        self.recorder.add_network_time(0.002)
+        self.recorder.add_network_time(0.004)
+        stats = self.stats.send_session_stats()
+        self.assertAlmostEqual(20.0, stats.frame_loss_percentage)
+        self.assertAlmostEqual(3.0, stats.average_network_time_ms)
+        self.assertAlmostEqual(1.0, stats.stddev_network_time_ms)
+        message = self.client.messages[-1]
+        self.assertEqual(5, len(message.stats))
+        accumulated = {value.stat_type: value for value in message.accumulated_stats}
+        self.assertAlmostEqual(20.0, accumulated[k_EFrameStatPacketLossPercentage].average)
+        self.assertEqual(4, accumulated[k_EFrameStatFPS].count)
@@ -0,0 +1,30 @@
+import os
+import tempfile
+from unittest import TestCase
+
+from service.identity import Identity, DEVICE_ID_FILE, STEAMID_FILE
+
+
+class IdentityTest(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.path = os.path.join(self.directory.name, 'profile')
+
+    def test_generated_once(self):
+        identity = Identity(self.path)
+        device_id = identity.device_id
+        os.remove(os.path.join(self.path, DEVICE_ID_FILE))
+        # Read once, not again for every message
+        self.assertEqual(device_id, identity.device_id)
+        self.assertEqual(32, len(identity.secret_key))
+        self.assertEqual(identity.secret_key, Identity(self.path).secret_key)
+
+    def test_steamid(self):
+        identity = Identity(self.path)
+        with self.assertRaises(IOError):
+            identity.steamid
+        identity.steamid = 76561197960287930
+        self.assertEqual(76561197960287930, Identity(self.path).steamid)
+        # Nothing left over from the write
+        self.assertEqual([STEAMID_FILE], os.listdir(self.path))
@@ -0,0 +1,119 @@
+import random
+import struct
+from unittest import TestCase
+
+from protobuf.steammessages_remoteplay_pb2 import k_EStreamDataPacket
+from session.channels.data import Data
+from session.jitter import JitterBuffer
+from session.packet import Packet, PacketHeader, PacketType
+from tests.sesion.test_retransmit import FakeClock
+from tests.sesion.test_sequence import RecordingClient
+
+FRAME_INTERVAL = 0.01
+
+
+def _timestamp(seconds: float) -> int:
+    return int(seconds * 65536) & 0xFFFFFFFF
+
+
+class JitterBufferTest(TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.released = []
+        self.buffer = JitterBuffer(self.released.append, 0.01, 0.05, clock=self.clock)
+
+    def push(self, frame_id: int, arrival: float, sent: float = None):
+        self.clock.now = arrival
+        self.buffer.poll(arrival)
+        if sent is None:
+            sent = frame_id * FRAME_INTERVAL
+        self.buffer.push(frame_id & 0xFFFF, _timestamp(sent), frame_id)
+
+    def drain(self):
+        self.clock.now += 1
+        self.buffer.poll(self.clock.now)
+
+    def test_reordered(self):
+        for frame_id, arrival in [(0, 0.0), (2, 0.02), (1, 0.021), (3, 0.03)]:
+            self.push(frame_id, arrival)
+        self.drain()
+        self.assertEqual([0, 1, 2, 3], self.released)
+        self.assertEqual(1, self.buffer.stats.reordered)
+        self.assertEqual(0, self.buffer.stats.depth)
+
+    def test_held_for_target_delay(self):
+        self.push(0, 0.0)
+        self.assertEqual([], self.released)
+        self.assertAlmostEqual(0.01, self.buffer.next_deadline)
+        self.buffer.poll(0.01)
+        self.assertEqual([0], self.released)
+
+    def test_late_and_missing(self):
+        self.push(0, 0.0)
+        self.push(2, 0.02)
+        self.push(3, 0.03)
+        self.buffer.poll(0.03)
+        self.assertEqual([0, 2], self.released)
+        self.assertEqual(1, self.buffer.stats.skipped)
+        self.push(1, 0.035)
+        self.drain()
+        self.assertEqual([0, 2, 3], self.released)
+        self.assertEqual(1, self.buffer.stats.late)
+
+    def test_late_flagged(self):
+        self.buffer.drop_late = False
+        self.push(1, 0.0)
+        self.drain()
+        self.push(0, self.clock.now)
+        self.assertEqual([1, 0], self.released)
+        self.assertEqual(1, self.buffer.stats.late)
+
+    def test_adapts_to_jitter(self):
+        rng = random.Random(0)
+        for frame_id in range(200):
+            self.push(frame_id, frame_id * FRAME_INTERVAL)
+        self.assertAlmostEqual(0.01, self.buffer.stats.target_delay)
+        for frame_id in range(200, 400):
+            self.push(frame_id, frame_id * FRAME_INTERVAL + rng.uniform(0, 0.02))
+        self.assertGreater(self.buffer.stats.target_delay, 0.02)
+        self.assertLessEqual(self.buffer.stats.target_delay, 0.05)
+        self.drain()
+        self.assertEqual(list(range(400)), self.released)
+
+    def test_wraparound(self):
+        start = 0xFFFE
+        for i in range(4):
+            self.push(start + i, i * FRAME_INTERVAL, (start + i) * FRAME_INTERVAL % 65536)
+        self.drain()
+        self.assertEqual([start + i for i in range(4)], self.released)
+        self.assertEqual(0, self.buffer.stats.reordered + self.buffer.stats.late + self.buffer.stats.skipped)
+
+
+class RecordingData(Data):
+    jitter_min_delay = 0.01
+    jitter_max_delay = 0.01
+
+    def __init__(self):
+        super().__init__(RecordingClient(), 4)
+        self.data: list[tuple[int, bytes]] = []
+
+    def handle_data(self, header, payload: bytes):
+        self.data.append((header.id, payload))
+
+
+class DataChannelTest(TestCase):
+    def test_reordered_from_receive_slots(self):
+        clock = FakeClock()
+        channel = RecordingData()
+        channel.jitter_buffer.clock = clock
+        slot = bytearray(64)
+        for frame_id, pkt_id in [(0, 10), (2, 12), (1, 11)]:
+            header = PacketHeader(channel=4, pkt_id=pkt_id, send_timestamp=_timestamp(frame_id * FRAME_INTERVAL))
+            header.pkt_type = PacketType.UNRELIABLE
+            body = bytes([k_EStreamDataPacket]) + struct.pack('<HIHI', frame_id, 0, 0, 0) + b'frame %d' % frame_id
+            data = Packet(header, body).serialize()
+            # Every packet arrives in the same slot, like the receive ring reusing it
+            slot[:len(data)] = data
+            channel.handle_packet(Packet.parse(memoryview(slot)[:len(data)]))
+        channel.poll(1)
+        self.assertEqual([(i, b'frame %d' % i) for i in range(3)], channel.data)
@@ -0,0 +1,34 @@
+from unittest import TestCase, mock
+
+from session import media
+
+
+def _missing():
+    raise ImportError('No module named missing')
+
+
+class MediaBackendTest(TestCase):
+    def test_first_that_loads(self):
+        media.register_backend('test_output', 'missing', _missing)
+        media.register_backend('test_output', 'fallback', lambda: 'fallback factory')
+        self.assertEqual('fallback factory', media.backend('test_output'))
+
+    def test_unavailable(self):
+        media.register_backend('test_decoder', 'missing', _missing)
+        with self.assertRaisesRegex(media.MediaUnavailable, 'missing: No module named missing'):
+            media.backend('test_decoder')
+        # Once one shows up it's picked up
+        media.register_backend('test_decoder', 'present', lambda: 'decoder')
+        self.assertEqual('decoder', media.backend('test_decoder'))
+
+    @mock.patch.dict(media._loaders, {media.AUDIO_DECODER: {'missing': _missing}})
+    @mock.patch.dict(media._resolved, clear=True)
+    @mock.patch.dict(media._failures, clear=True)
+    def test_audio_channel_without_backends(self):
+        from protobuf.steammessages_remoteplay_pb2 import CStartAudioDataMsg
+        from session.channels.audio import Audio
+        from tests.sesion.test_sequence import RecordingClient
+        audio = Audio(RecordingClient(), CStartAudioDataMsg(channel=3, frequency=48000, channels=2))
+        self.assertIsNone(audio.executor)
+        audio.handle_data(None, b'\x00' * 10)
+        audio.close()
@@ -0,0 +1,23 @@
+from unittest import TestCase
+
+from protobuf.steammessages_remoteclient_discovery_pb2 import CMsgRemoteClientBroadcastStatus, \
+    CMsgRemoteClientBroadcastDiscovery, k_ERemoteClientBroadcastMsgStatus, k_ERemoteClientBroadcastMsgDiscovery
+from service.common import message_parse, message_serialize
+
+
+class DiscoveryMessageTest(TestCase):
+    def test_round_trip(self):
+        for seq_num in range(3):
+            data = message_serialize(k_ERemoteClientBroadcastMsgDiscovery,
+                                     CMsgRemoteClientBroadcastDiscovery(seq_num=seq_num), 42)
+            header, body = message_parse(data)
+            self.assertEqual((42, k_ERemoteClientBroadcastMsgDiscovery), (header.client_id, header.msg_type))
+            self.assertEqual(seq_num, body.seq_num)
+
+    def test_truncated(self):
+        data = message_serialize(k_ERemoteClientBroadcastMsgStatus, CMsgRemoteClientBroadcastStatus(hostname='host'), 1)
+        self.assertEqual('host', message_parse(data)[1].hostname)
+        with self.assertRaises(ValueError):
+            message_parse(data[:-2])
+        with self.assertRaises(ValueError):
+            message_parse(b'\x00' * 8 + data[8:])
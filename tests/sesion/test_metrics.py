@@ -0,0 +1,115 @@
+import gc
+import json
+import os
+import tempfile
+import urllib.request
+from dataclasses import dataclass
+from unittest import TestCase
+
+from session.channels.base import Channel
+from session.metrics import MetricsRegistry, MetricsServer, SnapshotWriter, REGISTRY
+from session.packet import Packet, PacketHeader, PacketType
+from tests.sesion.test_sequence import RecordingClient
+
+
+@dataclass
+class ExampleStats:
+    dropped: int = 3
+    jitter: float = 0.5
+
+
+class ExampleComponent:
+
+    def __init__(self):
+        self.stats = ExampleStats()
+
+    def collect_metrics(self):
+        return [('example_dropped', (('channel', '4'),), self.stats.dropped)]
+
+
+class MetricsRegistryTest(TestCase):
+    def setUp(self):
+        self.registry = MetricsRegistry()
+
+    def test_same_metric_for_same_labels(self):
+        counter = self.registry.counter('packets', 'Packets', channel='1')
+        self.assertIs(counter, self.registry.counter('packets_total', channel='1'))
+        self.assertIsNot(counter, self.registry.counter('packets', channel='2'))
+        with self.assertRaises(ValueError):
+            self.registry.gauge('packets_total', channel='1')
+
+    def test_exposition(self):
+        self.registry.counter('packets', 'Packets received', channel='1').inc(3)
+        self.registry.gauge('bitrate').set(1.5)
+        histogram = self.registry.histogram('latency', 'Latency', buckets=(0.01, 0.1))
+        for value in [0.005, 0.05, 0.5]:
+            histogram.observe(value)
+        self.assertEqual('\n'.join([
+            '# TYPE bitrate gauge',
+            'bitrate 1.5',
+            '# HELP latency Latency',
+            '# TYPE latency histogram',
+            'latency_bucket{le="0.01"} 1',
+            'latency_bucket{le="0.1"} 2',
+            'latency_bucket{le="+Inf"} 3',
+            'latency_sum 0.555',
+            'latency_count 3',
+            '# HELP packets_total Packets received',
+            '# TYPE packets_total counter',
+            'packets_total{channel="1"} 3',
+            '',
+        ]), self.registry.exposition())
+
+    def test_collector_goes_with_its_owner(self):
+        component = ExampleComponent()
+        self.registry.add_collector(component.collect_metrics)
+        self.assertIn('example_dropped{channel="4"} 3', self.registry.exposition())
+        del component
+        gc.collect()
+        self.assertNotIn('example_dropped', self.registry.exposition())
+        self.assertEqual([], self.registry.collectors)
+
+    def test_snapshot_file(self):
+        self.registry.counter('packets').inc()
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'metrics.json')
+            writer = SnapshotWriter(path, self.registry, interval=60).start()
+            writer.close()
+            with open(path) as f:
+                snapshot = json.load(f)
+        self.assertEqual([{'name': 'packets_total', 'labels': {}, 'value': 1}], snapshot['metrics']['packets_total'])
+
+    def test_snapshot_not_finite(self):
+        self.registry.gauge('rtt').set(float('nan'))
+        self.registry.gauge('bandwidth').set(float('inf'))
+        self.registry.gauge('bitrate').set(1.5)
+        metrics = json.loads(json.dumps(self.registry.snapshot(), allow_nan=False))['metrics']
+        self.assertEqual([None, None, 1.5], [metrics[name][0]['value'] for name in ['rtt', 'bandwidth', 'bitrate']])
+
+    def test_http(self):
+        self.registry.counter('packets').inc(2)
+        server = MetricsServer(self.registry, ('127.0.0.1', 0)).start()
+        try:
+            host, port = server.address
+            with urllib.request.urlopen(f'http://{host}:{port}/metrics') as response:
+                self.assertIn('packets_total 2', response.read().decode())
+            with urllib.request.urlopen(f'http://{host}:{port}/metrics.json') as response:
+                self.assertIn('packets_total', json.load(response)['metrics'])
+        finally:
+            server.close()
+
+
+class ChannelMetricsTest(TestCase):
+    def test_nack_counted(self):
+        channel = Channel(RecordingClient(), 7)
+        before = channel.nacks_sent.value
+        # The last fragment can't be bigger than the first packet
+        for pkt_type, pkt_id, fragment_id, body in [(PacketType.RELIABLE, 4, 1, b'head'),
+                                                    (PacketType.RELIABLE_FRAG, 5, 0, b'oversized fragment')]:
+            header = PacketHeader(channel=7, fragment_id=fragment_id, pkt_id=pkt_id)
+            header.pkt_type = pkt_type
+            channel.handle_packet(Packet(header, body))
+        self.assertEqual(before + 1, channel.nacks_sent.value)
+        self.assertIn('steamlink_nacks_sent_total{channel="7",type="channel"}', REGISTRY.exposition())
+        self.assertIn(('steamlink_retransmit_given_up', (('channel', '7'), ('type', 'channel')), 0),
+                      channel.collect_metrics())
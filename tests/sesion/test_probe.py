@@ -0,0 +1,84 @@
+import heapq
+import math
+import random
+from unittest import TestCase
+
+from session.packet import PACKET_CRC_LENGTH
+from session.probe import LinkProbe, PROBE_BUDGET
+from tests.sesion.test_retransmit import FakeClock
+
+
+class SimulatedLink:
+    """
+    Answers pings after `rtt`, with responses from the host queued behind each other at `rate_kbps`.
+    """
+
+    def __init__(self, clock: FakeClock, rtt: float, rate_kbps: float, mtu: int, loss: float = 0.0, seed: int = 0):
+        self.clock = clock
+        self.rtt = rtt
+        self.rate = rate_kbps * 1000 / 8
+        self.mtu = mtu
+        self.loss = loss
+        self.rng = random.Random(seed)
+        self.link_free = 0.0
+        self.events: list[tuple[float, int]] = []
+        self.probe: LinkProbe = None
+
+    def send(self, sequence: int, packet_size_requested: int, pad_to: int):
+        size = packet_size_requested + PACKET_CRC_LENGTH
+        if max(size, pad_to + PACKET_CRC_LENGTH) > self.mtu or self.rng.random() < self.loss:
+            return
+        start = max(self.clock.now + self.rtt / 2, self.link_free)
+        self.link_free = start + size / self.rate
+        heapq.heappush(self.events, (self.link_free + self.rtt / 2, sequence))
+
+    def run(self):
+        self.probe.start(self.clock.now)
+        while self.probe.result is None:
+            self.clock.now = min(self.events[0][0] if self.events else math.inf, self.probe.next_deadline)
+            while self.events and self.events[0][0] <= self.clock.now:
+                self.probe.on_response(heapq.heappop(self.events)[1], self.clock.now)
+            self.probe.poll(self.clock.now)
+        return self.probe.result
+
+
+class LinkProbeTest(TestCase):
+    def probe(self, **kwargs):
+        clock = FakeClock()
+        link = SimulatedLink(clock, **kwargs)
+        link.probe = LinkProbe(link.send, clock=clock)
+        results = []
+        link.probe.when_done(results.append)
+        result = link.run()
+        self.assertEqual([result], results)
+        return result, clock.now
+
+    def test_measures_link(self):
+        result, elapsed = self.probe(rtt=0.004, rate_kbps=50000, mtu=1400)
+        self.assertEqual(1400, result.path_mtu)
+        self.assertAlmostEqual(50000, result.bandwidth_kbps, delta=2500)
+        self.assertAlmostEqual(0.004, result.rtt_min, delta=0.001)
+        # Only the MTU ping over 1400 bytes went missing
+        self.assertEqual(1, result.sent - result.received)
+        self.assertLess(elapsed, PROBE_BUDGET)
+
+    def test_stops_when_all_answered(self):
+        result, elapsed = self.probe(rtt=0.004, rate_kbps=50000, mtu=1500)
+        self.assertEqual(result.sent, result.received)
+        self.assertEqual(1472, result.path_mtu)
+        self.assertLess(elapsed, 0.5)
+
+    def test_lossy_link(self):
+        result, elapsed = self.probe(rtt=0.02, rate_kbps=8000, mtu=1500, loss=0.1, seed=3)
+        self.assertAlmostEqual(0.1, result.loss, delta=0.06)
+        self.assertAlmostEqual(8000, result.bandwidth_kbps, delta=800)
+        self.assertLessEqual(elapsed, PROBE_BUDGET)
+
+    def test_no_answer(self):
+        result, elapsed = self.probe(rtt=0.01, rate_kbps=1000, mtu=0)
+        self.assertFalse(result.ok)
+        self.assertTrue(math.isnan(result.bandwidth_kbps))
+        self.assertLessEqual(elapsed, PROBE_BUDGET)
+        results = []
+        LinkProbe(lambda *args: None).when_done(results.append)
+        self.assertEqual([], results)
@@ -0,0 +1,51 @@
+import socket
+from unittest import TestCase
+
+from session.receiver import ReceiveRing
+
+
+class RecordingHandler:
+
+    def __init__(self):
+        self.closed = False
+        self.packets: list[bytes] = []
+
+    def handle_packet(self, data):
+        self.packets.append(bytes(data))
+
+
+class ReceiveRingTest(TestCase):
+    def setUp(self):
+        self.recv_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.recv_sock.bind(('127.0.0.1', 0))
+        self.recv_sock.setblocking(False)
+        self.send_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def tearDown(self):
+        self.recv_sock.close()
+        self.send_sock.close()
+
+    def send(self, *datagrams: bytes):
+        for datagram in datagrams:
+            self.send_sock.sendto(datagram, self.recv_sock.getsockname())
+
+    def test_drain_batch(self):
+        ring = ReceiveRing(slots=4, slot_size=64)
+        self.send(b'first', b'second', b'third')
+        handler = RecordingHandler()
+        count = ring.drain(self.recv_sock)
+        ring.dispatch(count, handler)
+        self.assertEqual(3, count)
+        self.assertEqual([b'first', b'second', b'third'], handler.packets)
+        self.assertEqual(0, ring.drain(self.recv_sock))
+
+    def test_slots_reused(self):
+        ring = ReceiveRing(slots=2, slot_size=64)
+        self.send(b'a' * 10, b'b' * 10, b'c' * 3)
+        handler = RecordingHandler()
+        self.assertEqual(2, ring.drain(self.recv_sock))
+        first = ring.buffers[0]
+        self.assertEqual(1, ring.drain(self.recv_sock))
+        ring.dispatch(1, handler)
+        self.assertIs(first, ring.buffers[0])
+        self.assertEqual([b'ccc'], handler.packets)
@@ -0,0 +1,232 @@
+import random
+from unittest import TestCase
+
+from protobuf.steammessages_remoteplay_pb2 import CSetTitleMsg, k_EStreamControlSetTitle
+from session.channels.base import Channel
+from session.client import DEFAULT_MTU
+from session.frame import Frame
+from session.packet import Packet, PacketHeader, PacketType
+from session.retransmit import RttEstimator, MIN_RTO, MAX_RETRANSMITS
+from session.scheduler import SendPriority
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class LossyLink:
+    """
+    One direction of a link between two channels, dropping the datagrams `drop` picks.
+    """
+
+    def __init__(self, drop=lambda header: False):
+        self.closed = False
+        self.auth_token = bytes(16)
+        self.mtu = DEFAULT_MTU
+        self.drop = drop
+        self.peer: Channel = None
+        self.queue: list[bytes] = []
+        self.sent: list[PacketHeader] = []
+
+    def send_packet(self, has_crc: bool, pkt_type: PacketType, pkt_id: int, channel: int, payload: bytes = b'',
+                    pad_to: int = 0, retransmit_count: int = 0, fragment_id: int = 0,
+                    priority: SendPriority = SendPriority.CONTROL):
+        header = PacketHeader(channel=channel, fragment_id=fragment_id, pkt_id=pkt_id,
+                              retransmit_count=retransmit_count)
+        header.has_crc = has_crc
+        header.pkt_type = pkt_type
+        self.sent.append(header)
+        if not self.drop(header):
+            self.queue.append(bytes(Packet(header, payload).serialize(pad_to)))
+
+    def pump(self) -> int:
+        delivered, self.queue = self.queue, []
+        for data in delivered:
+            self.peer.handle_packet(Packet.parse(data))
+        return len(delivered)
+
+
+class RecordingChannel(Channel):
+
+    def __init__(self, client, channel: int):
+        super().__init__(client, channel)
+        self.frames: list[bytes] = []
+
+    def handle_frame(self, frame: Frame):
+        self.frames.append(bytes(frame.body))
+
+
+def connect(forward: LossyLink, backward: LossyLink, clock: FakeClock) -> tuple[Channel, RecordingChannel]:
+    sender = Channel(forward, 1)
+    receiver = RecordingChannel(backward, 1)
+    sender.retransmits.clock = clock
+    receiver.acks.clock = clock
+    forward.peer = receiver
+    backward.peer = sender
+    return sender, receiver
+
+
+def title(i: int) -> bytes:
+    return bytes([k_EStreamControlSetTitle]) + CSetTitleMsg(text=f'title {i}').SerializeToString()
+
+
+class RetransmitTest(TestCase):
+    def test_first_transmission_lost(self):
+        clock = FakeClock()
+        forward = LossyLink(lambda header: header.pkt_type == PacketType.RELIABLE and header.retransmit_count == 0)
+        backward = LossyLink()
+        sender, receiver = connect(forward, backward, clock)
+        sender.send_reliable(k_EStreamControlSetTitle, CSetTitleMsg(text='title 0'))
+        self.assertEqual(0, forward.pump())
+        clock.now += 0.1
+        sender.poll(clock.now)
+        self.assertEqual(0, forward.pump())
+        clock.now = sender.retransmits.next_deadline
+        sender.poll(clock.now)
+        self.assertEqual(1, forward.sent[-1].retransmit_count)
+        forward.pump()
+        receiver.acks.flush()
+        backward.pump()
+        self.assertEqual([title(0)], receiver.frames)
+        self.assertFalse(sender.retransmits.packets)
+        self.assertEqual(0, len(sender.sent_packets))
+
+    def test_random_loss(self):
+        clock = FakeClock()
+        rng = random.Random(1)
+        forward = LossyLink(lambda header: rng.random() < 0.3)
+        backward = LossyLink(lambda header: rng.random() < 0.3)
+        sender, receiver = connect(forward, backward, clock)
+        for i in range(50):
+            sender.send_reliable(k_EStreamControlSetTitle, CSetTitleMsg(text=f'title {i}'))
+        for _ in range(1000):
+            forward.pump()
+            backward.pump()
+            if not sender.retransmits.packets and not sender.pending_reliable:
+                break
+            clock.now += 0.05
+            receiver.poll(clock.now)
+            sender.poll(clock.now)
+        self.assertEqual(sorted(title(i) for i in range(50)), sorted(receiver.frames))
+        self.assertEqual(0, len(sender.sent_packets))
+        self.assertEqual(0, sender.retransmits.stats.given_up)
+        self.assertGreater(sender.retransmits.stats.retransmits, 0)
+        # Duplicates caused by lost ACKs are acknowledged again, never handed up twice
+        self.assertGreater(receiver.frame_assembler.stats.duplicates, 0)
+
+    def test_nack_resends_immediately(self):
+        clock = FakeClock()
+        forward = LossyLink()
+        sender, receiver = connect(forward, LossyLink(), clock)
+        sender.send_reliable(k_EStreamControlSetTitle, CSetTitleMsg(text='title 0'))
+        sender.on_nack(0, 0)
+        self.assertEqual([0, 1], [header.retransmit_count for header in forward.sent])
+        self.assertEqual(1, sender.retransmits.stats.nack_retransmits)
+
+    def test_gives_up(self):
+        clock = FakeClock()
+        forward = LossyLink(lambda header: True)
+        sender, receiver = connect(forward, LossyLink(), clock)
+        sender.send_reliable(k_EStreamControlSetTitle, CSetTitleMsg(text='title 0'))
+        for _ in range(100):
+            clock.now += 1
+            sender.poll(clock.now)
+        self.assertEqual(MAX_RETRANSMITS + 1, len(forward.sent))
+        self.assertEqual(1, sender.retransmits.stats.given_up)
+        self.assertEqual(0, len(sender.sent_packets))
+
+    def test_rto_follows_rtt(self):
+        clock = FakeClock()
+        sender, receiver = connect(LossyLink(), LossyLink(), clock)
+        for i in range(20):
+            sender.send_reliable(k_EStreamControlSetTitle, CSetTitleMsg(text=f'title {i}'))
+            clock.now += 0.02
+            sender.on_ack(i, 0)
+        self.assertAlmostEqual(0.02, sender.retransmits.rtt.srtt, places=3)
+        self.assertEqual(MIN_RTO, sender.retransmits.rtt.rto)
+
+
+class RttEstimatorTest(TestCase):
+    def test_variance(self):
+        estimator = RttEstimator()
+        estimator.add_sample(0.1)
+        self.assertAlmostEqual(0.3, estimator.rto)
+        for _ in range(50):
+            estimator.add_sample(0.1)
+        self.assertAlmostEqual(0.1, estimator.srtt)
+        self.assertLess(estimator.rto, 0.11)
+
+
+class EncryptingChannel(Channel):
+
+    def frame_should_encrypt(self, msg_type: int) -> bool:
+        return True
+
+
+class FragmentationTest(TestCase):
+    def test_loopback(self):
+        clock = FakeClock()
+        lost = {3}
+        forward = LossyLink(lambda header: header.retransmit_count == 0 and header.pkt_id in lost)
+        backward = LossyLink()
+        sender, receiver = connect(forward, backward, clock)
+        text = ''.join(chr(ord('a') + i % 26) for i in range(10000))
+        sender.send_reliable(k_EStreamControlSetTitle, CSetTitleMsg(text=text))
+        body = bytes([k_EStreamControlSetTitle]) + CSetTitleMsg(text=text).SerializeToString()
+        count = len(forward.sent)
+        self.assertEqual(-(-len(body) // (DEFAULT_MTU - 17)), count)
+        self.assertEqual([(PacketType.RELIABLE, count - 1)] + [(PacketType.RELIABLE_FRAG, i) for i in range(count - 1)],
+                         [(header.pkt_type, header.fragment_id) for header in forward.sent])
+        self.assertEqual(list(range(count)), [header.pkt_id for header in forward.sent])
+        self.assertTrue(all(len(data) <= DEFAULT_MTU for data in forward.queue))
+        forward.pump()
+        receiver.acks.flush()
+        backward.pump()
+        self.assertEqual([], receiver.frames)
+        clock.now = sender.retransmits.next_deadline
+        sender.poll(clock.now)
+        resent = forward.sent[count:]
+        self.assertEqual([(PacketType.RELIABLE_FRAG, 3, 2, 1)],
+                         [(header.pkt_type, header.pkt_id, header.fragment_id, header.retransmit_count)
+                          for header in resent])
+        forward.pump()
+        receiver.acks.flush()
+        backward.pump()
+        self.assertEqual([body], receiver.frames)
+        self.assertEqual(0, len(sender.sent_packets))
+
+    def test_waits_for_window(self):
+        forward = LossyLink()
+        sender = EncryptingChannel(forward, 1)
+        sender.sent_packets.window = 4
+        sender.send_reliable(k_EStreamControlSetTitle, CSetTitleMsg(text='short'))
+        sender.send_reliable(k_EStreamControlSetTitle, CSetTitleMsg(text='x' * 4000))
+        self.assertEqual(1, len(forward.sent))
+        self.assertEqual(1, sender.send_encrypt_sequence)
+        self.assertEqual(1, len(sender.pending_reliable))
+        sender.on_ack(0, 0)
+        self.assertEqual(5, len(forward.sent))
+        self.assertEqual(2, sender.send_encrypt_sequence)
+        with self.assertRaises(ValueError):
+            sender.send_reliable(k_EStreamControlSetTitle, CSetTitleMsg(text='x' * 10000), 100)
+
+    def test_explicit_id_waits_for_fragments(self):
+        forward = LossyLink()
+        sender = EncryptingChannel(forward, 1)
+        sender.send_reliable(k_EStreamControlSetTitle, CSetTitleMsg(text='short'), 2)
+        first = sender.retransmits.packets[2]
+        # The head's ID is free but the third fragment would take 2
+        sender.send_reliable(k_EStreamControlSetTitle, CSetTitleMsg(text='x' * 4000), 0)
+        self.assertEqual(1, len(forward.sent))
+        self.assertEqual(1, sender.send_encrypt_sequence)
+        self.assertIs(first, sender.retransmits.packets[2])
+        self.assertEqual(1, len(sender.held_reliable))
+        sender.on_ack(2, 0)
+        self.assertEqual([0, 1, 2, 3], [header.pkt_id for header in forward.sent[1:]])
+        self.assertEqual(2, sender.send_encrypt_sequence)
+        self.assertEqual(0, len(sender.held_reliable))
@@ -0,0 +1,54 @@
+from unittest import TestCase
+
+from session.scheduler import SendPriority, SendScheduler
+from tests.sesion.test_retransmit import FakeClock
+
+
+class SendSchedulerTest(TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.sent = []
+        # 8 Mbit/s is 1000 bytes per millisecond
+        self.scheduler = SendScheduler(self.sent.append, bitrate_kbps=8000, burst=4000, clock=self.clock)
+
+    def test_priority_order(self):
+        self.scheduler.enqueue(SendPriority.DISCOVERY, b'discovery')
+        self.scheduler.enqueue(SendPriority.STATS, b'stats')
+        self.scheduler.enqueue(SendPriority.CONTROL, b'control')
+        self.scheduler.enqueue(SendPriority.INPUT, b'input')
+        self.assertEqual(4, self.scheduler.flush())
+        self.assertEqual([b'input', b'control', b'stats', b'discovery'], self.sent)
+
+    def test_paced(self):
+        for _ in range(10):
+            self.scheduler.enqueue(SendPriority.STATS, bytes(1000))
+        self.assertEqual(4, self.scheduler.flush())
+        self.assertAlmostEqual(0.001, self.scheduler.next_deadline)
+        self.clock.now = 0.002
+        self.assertEqual(2, self.scheduler.flush())
+        self.scheduler.set_bitrate(80000)
+        self.clock.now = 0.0025
+        self.assertEqual(4, self.scheduler.flush())
+
+    def test_oversized_datagram(self):
+        self.scheduler.enqueue(SendPriority.CONTROL, bytes(6000))
+        self.assertEqual(1, self.scheduler.flush())
+        self.scheduler.enqueue(SendPriority.CONTROL, bytes(100))
+        self.assertEqual(0, self.scheduler.flush())
+        self.assertAlmostEqual(0.0021, self.scheduler.next_deadline)
+
+    def test_input_delay_flat_under_load(self):
+        # Stats uploads arrive at twice the paced rate, one input event every 10 ms
+        for tick in range(1000):
+            self.clock.now = tick / 1000
+            self.scheduler.enqueue(SendPriority.STATS, bytes(1000))
+            self.scheduler.enqueue(SendPriority.STATS, bytes(1000))
+            if tick % 10 == 0:
+                self.scheduler.enqueue(SendPriority.INPUT, bytes(100))
+            self.scheduler.flush()
+        input_stats = self.scheduler.stats[SendPriority.INPUT]
+        stats_stats = self.scheduler.stats[SendPriority.STATS]
+        self.assertEqual(100, input_stats.sent)
+        self.assertLessEqual(input_stats.max_delay, 0.001)
+        self.assertGreater(stats_stats.queued, 900)
+        self.assertGreater(stats_stats.mean_delay, 0.1)
@@ -0,0 +1,99 @@
+from unittest import TestCase
+
+from protobuf.steammessages_remoteplay_pb2 import CKeepAliveMsg, k_EStreamControlKeepAlive
+from session.channels.base import Channel
+from session.client import DEFAULT_MTU
+from session.packet import PacketType
+from session.scheduler import SendPriority
+from session.sequence import PacketIdAllocator
+
+
+class PacketIdAllocatorTest(TestCase):
+    def test_monotonic(self):
+        allocator = PacketIdAllocator()
+        self.assertEqual([0, 1, 2], [allocator.allocate() for _ in range(3)])
+        allocator.release(0)
+        self.assertEqual(3, allocator.allocate())
+
+    def test_wraparound(self):
+        allocator = PacketIdAllocator(start=65534)
+        self.assertEqual([65534, 65535, 0], [allocator.allocate() for _ in range(3)])
+        self.assertEqual(1, allocator.allocate(2))
+        self.assertEqual(3, allocator.next_id)
+
+    def test_skips_claimed(self):
+        allocator = PacketIdAllocator()
+        self.assertTrue(allocator.claim(1))
+        self.assertFalse(allocator.claim(1))
+        self.assertEqual(0, allocator.allocate())
+        self.assertEqual(2, allocator.allocate())
+        self.assertEqual(3, allocator.allocate(2))
+        self.assertTrue(allocator.claim(6))
+        self.assertEqual(7, allocator.allocate(2))
+
+    def test_skips_unacknowledged_after_wrap(self):
+        allocator = PacketIdAllocator(window=4)
+        stuck = allocator.allocate()
+        for _ in range(0xFFFF):
+            allocator.release(allocator.allocate())
+        self.assertIn(stuck, allocator)
+        self.assertEqual(1, allocator.allocate())
+
+    def test_window_full(self):
+        allocator = PacketIdAllocator(window=2)
+        allocator.allocate()
+        allocator.allocate()
+        self.assertTrue(allocator.full)
+        self.assertIsNone(allocator.allocate())
+        allocator.release(0)
+        self.assertEqual(2, allocator.allocate())
+
+
+class RecordingClient:
+
+    def __init__(self):
+        self.closed = False
+        self.auth_token = bytes(16)
+        self.mtu = DEFAULT_MTU
+        self.sent: list[tuple[PacketType, int]] = []
+
+    def send_packet(self, has_crc: bool, pkt_type: PacketType, pkt_id: int, channel: int, payload: bytes = b'',
+                    pad_to: int = 0, retransmit_count: int = 0, fragment_id: int = 0,
+                    priority: SendPriority = SendPriority.CONTROL):
+        self.sent.append((pkt_type, pkt_id))
+
+
+class ChannelBackpressureTest(TestCase):
+    def test_queued_until_acked(self):
+        client = RecordingClient()
+        channel = Channel(client, 1)
+        channel.sent_packets = PacketIdAllocator(window=2)
+        for _ in range(4):
+            channel.send_reliable(k_EStreamControlKeepAlive, CKeepAliveMsg())
+        self.assertEqual([(PacketType.RELIABLE, 0), (PacketType.RELIABLE, 1)], client.sent)
+        channel.on_ack(1, 0)
+        channel.on_ack(0, 0)
+        self.assertEqual([0, 1, 2, 3], [pkt_id for _, pkt_id in client.sent])
+        self.assertFalse(channel.pending_reliable)
+
+    def test_explicit_id_reserved(self):
+        client = RecordingClient()
+        channel = Channel(client, 1)
+        channel.send_reliable(k_EStreamControlKeepAlive, CKeepAliveMsg(), 1)
+        channel.send_reliable(k_EStreamControlKeepAlive, CKeepAliveMsg())
+        channel.send_reliable(k_EStreamControlKeepAlive, CKeepAliveMsg())
+        self.assertEqual([1, 0, 2], [pkt_id for _, pkt_id in client.sent])
+
+    def test_explicit_id_held_while_in_flight(self):
+        client = RecordingClient()
+        channel = Channel(client, 1)
+        channel.send_reliable(k_EStreamControlKeepAlive, CKeepAliveMsg())
+        first = channel.retransmits.packets[0]
+        # The same ID while the first message is unacknowledged
+        channel.send_reliable(k_EStreamControlKeepAlive, CKeepAliveMsg(), 0)
+        self.assertEqual([0], [pkt_id for _, pkt_id in client.sent])
+        self.assertIs(first, channel.retransmits.packets[0])
+        channel.on_ack(0, 0)
+        self.assertEqual([0, 0], [pkt_id for _, pkt_id in client.sent])
+        self.assertFalse(channel.held_reliable)
+        self.assertIn(0, channel.sent_packets)